@@ -1,8 +1,17 @@
 from datetime import datetime, timedelta, timezone
 from jose import jwt, JWTError
 from passlib.context import CryptContext
+import asyncio
+import multiprocessing
 import os
-from typing import Optional, Dict, Any, Union
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, Set, Tuple, Union
+
+from . import metrics
 
 SECRET_KEY = os.getenv("JWT_SECRET", "secret-dev-key")
 ALGORITHM = "HS256"
@@ -14,7 +23,19 @@ except ValueError:
     print("[AUTH] Warning: ACCESS_TOKEN_EXPIRE_MINUTES is not a valid integer. Using default (1440).")
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto") # Switched to 'bcrypt' as it's more common than 'bcrypt_sha256' in passlib
+# bcrypt cost factor (log2 of the work). Hashes below it are upgraded on the next successful login.
+try:
+    BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+except ValueError:
+    BCRYPT_ROUNDS = 12
+    print("[AUTH] Warning: BCRYPT_ROUNDS is not a valid integer. Using default (12).")
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+) # Switched to 'bcrypt' as it's more common than 'bcrypt_sha256' in passlib
 
 
 def hash_password(password: str) -> str:
@@ -29,6 +50,68 @@ def verify_password(password: str, hashed_password: str) -> bool:
     return pwd_context.verify(password, hashed_password)
 
 
+def verify_and_update_password(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verifies a password; also returns a new hash if the stored one uses an outdated cost."""
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
+# --- Password Hashing Pool ---
+# bcrypt is deliberately slow, so it runs in worker processes (one core each) instead of
+# the request threadpool. At most PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE calls
+# are accepted at once; beyond that callers get PasswordHasherBusy straight away.
+try:
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+    PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", 32))
+except ValueError:
+    PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE = os.cpu_count() or 1, 32
+    print("[AUTH] Warning: PASSWORD_HASH_WORKERS / PASSWORD_HASH_MAX_QUEUE are not valid integers. Using defaults.")
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing pool is saturated; the request should be retried later."""
+
+
+class PasswordHasher:
+    """A size-limited process pool for bcrypt with a bounded backlog."""
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_queue: int = PASSWORD_HASH_MAX_QUEUE):
+        self.workers = max(1, workers)
+        self.capacity = self.workers + max(0, max_queue)
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                # "spawn" because the server process is multi-threaded, where fork is unsafe
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    async def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy()
+        try:
+            return await asyncio.wrap_future(self._get_pool().submit(fn, *args))
+        finally:
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await self._run(verify_and_update_password, password, hashed_password)
+
+
+password_hasher = PasswordHasher()
+
+
 def create_access_token(
     data: Dict[str, Union[str, int]],
     expires_delta: Optional[timedelta] = None
@@ -58,4 +141,98 @@ def decode_token(token: str) -> Optional[Dict[str, Any]]:
         return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
         # JWTError covers all token-related failures (expired, invalid signature, etc.)
-        return None
\ No newline at end of file
+        return None
+
+
+# --- Authenticated User Cache ---
+try:
+    AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 10000))
+    AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", 300))
+except ValueError:
+    AUTH_CACHE_SIZE, AUTH_CACHE_TTL_SECONDS = 10000, 300.0
+    print("[AUTH] Warning: AUTH_CACHE_SIZE / AUTH_CACHE_TTL_SECONDS are not valid numbers. Using defaults.")
+
+
+@dataclass(frozen=True)
+class AuthenticatedUser:
+    """The identity behind a verified token. Deliberately not an ORM object."""
+    id: int
+    email: str
+
+
+class TokenCache:
+    """
+    Bounded LRU of verified token -> AuthenticatedUser.
+
+    An entry lives for at most `ttl` seconds and never past the token's own expiry.
+    `invalidate_user` drops every cached token of a user, so the next request
+    re-checks the database. Invalidation is per process; with several workers the
+    TTL bounds how long another worker can keep trusting a cached entry.
+    """
+
+    def __init__(self, max_size: int = AUTH_CACHE_SIZE, ttl: float = AUTH_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[AuthenticatedUser, float]]" = OrderedDict()
+        self._by_user: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[AuthenticatedUser]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                metrics.cache_lookup("auth_token", misses=1)
+                return None
+            user, expires_at = entry
+            if now >= expires_at:
+                self._drop(token)
+                metrics.cache_lookup("auth_token", misses=1)
+                return None
+            self._entries.move_to_end(token)
+            metrics.cache_lookup("auth_token", hits=1)
+            return user
+
+    def put(self, token: str, user: AuthenticatedUser, token_exp: Optional[float] = None):
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        lifetime = self.ttl
+        if token_exp is not None:
+            lifetime = min(lifetime, token_exp - time.time())
+        if lifetime <= 0:
+            return
+        with self._lock:
+            self._drop(token)
+            self._entries[token] = (user, time.monotonic() + lifetime)
+            self._by_user.setdefault(user.id, set()).add(token)
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for token in list(self._by_user.get(user_id, ())):
+                self._drop(token)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def _drop(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is not None:
+            tokens = self._by_user.get(entry[0].id)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._by_user[entry[0].id]
+
+
+token_cache = TokenCache()
+
+
+def invalidate_user(user_id: int):
+    """Call after deleting a user or changing their password."""
+    token_cache.invalidate_user(user_id)
+
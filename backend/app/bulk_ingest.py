@@ -0,0 +1,361 @@
+"""
+Offline bulk import of a document collection for one user.
+
+Runs in three phases, each resumable after an interruption:
+
+1. extract + chunk: files are processed in parallel on a process pool (one file per
+   worker, pages extracted in-process) into WORK_DIR/<sha256>/chunks.jsonl.
+2. embed: chunk files are embedded through the shared embedding scheduler, which
+   batches texts across files; vectors go to WORK_DIR/<sha256>/vectors.f32.
+3. load: Document and Chunk rows are bulk-inserted, then every new vector is added
+   to the user's FAISS shard in one pass, which is trained once at the end if needed.
+
+Progress lives in WORK_DIR/state.jsonl and the artifacts themselves; rows are matched
+to artifacts by content hash, so a rerun skips finished work. A file that fails to
+extract or embed is reported and left out; the others are still imported, and the
+work directory is kept so a rerun retries only the failures. After a clean run the
+importer removes the files it created there, never anything else in the directory.
+The server must not be running while importing, since both would write the same
+FAISS shards.
+
+Run from the backend directory, e.g.:
+    python -m app.manage bulk-import papers/ --user 1
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import asdict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from . import embeddings, lexical, models, text_store, utils
+from .ingest import STREAM_BATCH_SIZE, _batched, _iter_jsonl, _write_atomic
+from .index_manager import index_manager
+
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".txt", ".md")
+WORK_DIR = os.getenv("BULK_IMPORT_WORK_DIR", "bulk_import")
+REPORT_EVERY_SECONDS = 10.0
+
+
+# --- Inputs ---
+def discover_files(source: str) -> List[str]:
+    """
+    Files to import from a directory (walked recursively, supported extensions only)
+    or a manifest: a text file with one path per line, relative to the manifest.
+    """
+    if os.path.isdir(source):
+        found = []
+        for root, dirs, names in os.walk(source):
+            dirs.sort()
+            for name in sorted(names):
+                if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                    found.append(os.path.abspath(os.path.join(root, name)))
+        return found
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, encoding="utf-8") as f:
+        lines = [line.strip() for line in f]
+    return [os.path.abspath(os.path.join(base, line)) for line in lines if line and not line.startswith("#")]
+
+
+def _file_hash(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(1024 * 1024):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+# --- Phase 1: extract + chunk (worker processes) ---
+def extract_file(path: str, work_dir: str) -> Dict:
+    """
+    Worker task: hashes, extracts and chunks one file into <work_dir>/<sha256>/.
+    Returns the state record for the file.
+    """
+    content_hash = _file_hash(path)
+    out_dir = os.path.join(work_dir, content_hash)
+    chunks_path = os.path.join(out_dir, "chunks.jsonl")
+    text_path = os.path.join(out_dir, "text.txt")
+    record = {"path": path, "filename": os.path.basename(path), "content_hash": content_hash}
+    if os.path.exists(chunks_path) and os.path.exists(text_path):
+        # Same content seen under another path, or extracted before an interruption
+        with open(chunks_path, encoding="utf-8") as f:
+            return {**record, "chunks": sum(1 for _ in f)}
+
+    os.makedirs(out_dir, exist_ok=True)
+    n_chunks = 0
+    wrote_any = False
+    text_tmp = f"{text_path}.{os.getpid()}.tmp"
+
+    def tee_pages(text_file):
+        nonlocal wrote_any
+        for page_number, page_text in utils.iter_text_pages(path, record["filename"], parallel=False):
+            if page_text:
+                text_file.write(("\n" if wrote_any else "") + page_text)
+                wrote_any = True
+            yield page_number, page_text
+
+    def write_chunks(f):
+        nonlocal n_chunks
+        with open(text_tmp, "w", encoding="utf-8") as text_file:
+            for chunk in embeddings.iter_chunks(tee_pages(text_file)):
+                f.write(json.dumps(asdict(chunk)) + "\n")
+                n_chunks += 1
+
+    _write_atomic(chunks_path, "w", write_chunks)
+    os.replace(text_tmp, text_path)
+    return {**record, "chunks": n_chunks}
+
+
+# --- Phase 2: embed (threads feeding the embedding scheduler) ---
+def embed_artifact(out_dir: str) -> int:
+    """Embeds <out_dir>/chunks.jsonl into vectors.f32 unless that already exists. Returns the chunk count."""
+    chunks_path = os.path.join(out_dir, "chunks.jsonl")
+    vectors_path = os.path.join(out_dir, "vectors.f32")
+    count = 0
+
+    def write_vectors(f):
+        nonlocal count
+        for batch in _batched(_iter_jsonl(chunks_path), STREAM_BATCH_SIZE):
+            vectors = embeddings.embed_texts([record["text"] for record in batch])
+            f.write(np.ascontiguousarray(vectors, dtype="float32").tobytes())
+            count += len(batch)
+
+    if not os.path.exists(vectors_path):
+        _write_atomic(vectors_path, "wb", write_vectors)
+    return count
+
+
+class Progress:
+    """Counts finished files and chunks per phase and prints throughput periodically."""
+
+    def __init__(self, total_files: int):
+        self.total_files = total_files
+        self.started = time.perf_counter()
+        self.last_report = self.started
+        self.counts = {"extracted": 0, "embedded": 0, "loaded": 0, "chunks_embedded": 0, "skipped": 0}
+
+    def add(self, **counts):
+        for key, n in counts.items():
+            self.counts[key] += n
+        now = time.perf_counter()
+        if now - self.last_report >= REPORT_EVERY_SECONDS:
+            self.last_report = now
+            self.report()
+
+    def report(self, final: bool = False):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        c = self.counts
+        print(
+            f"[BULK] {'Done' if final else 'Progress'}: {c['extracted']}/{self.total_files} extracted, "
+            f"{c['embedded']} embedded, {c['loaded']} loaded, {c['skipped']} skipped | "
+            f"{c['extracted'] / elapsed:.1f} files/s, {c['chunks_embedded'] / elapsed:.1f} chunks/s, "
+            f"{elapsed:.0f}s elapsed"
+        )
+
+
+class BulkImporter:
+    """Imports files for one user; see the module docstring for the phases."""
+
+    def __init__(self, user_id: int, work_dir: str = WORK_DIR, workers: Optional[int] = None,
+                 embed_concurrency: int = 4):
+        self.user_id = user_id
+        self.work_dir = os.path.abspath(work_dir)
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.embed_concurrency = max(1, embed_concurrency)
+        self.state_path = os.path.join(self.work_dir, "state.jsonl")
+        # Path -> error for files left out of this run
+        self.failures: Dict[str, str] = {}
+
+    # --- State ---
+    def _load_state(self) -> Dict[str, Dict]:
+        """Extraction records from earlier runs, keyed by path."""
+        if not os.path.exists(self.state_path):
+            return {}
+        state = {}
+        with open(self.state_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn last line from an interrupted run
+                state[record["path"]] = record
+        return state
+
+    def _artifact_dir(self, record: Dict) -> str:
+        return os.path.join(self.work_dir, record["content_hash"])
+
+    # --- Phases 1 and 2 ---
+    def prepare(self, files: List[str], progress: Progress) -> List[Dict]:
+        """
+        Extracts and embeds every file not finished by an earlier run. Embedding of a
+        file starts as soon as its extraction completes. Returns the state records.
+        """
+        os.makedirs(self.work_dir, exist_ok=True)
+        state = self._load_state()
+        todo = [path for path in files if path not in state]
+        progress.add(extracted=len(files) - len(todo))
+
+        embed_pool = ThreadPoolExecutor(self.embed_concurrency, thread_name_prefix="bulk-embed")
+        submitted = set()
+        embedding = {}  # embed future -> content hash
+        embed_failed = set()
+
+        def submit_embed(record):
+            if record["chunks"] and record["content_hash"] not in submitted:
+                submitted.add(record["content_hash"])
+                future = embed_pool.submit(embed_artifact, self._artifact_dir(record))
+                embedding[future] = record["content_hash"]
+                futures.add(future)
+
+        futures = set()
+        for record in state.values():
+            submit_embed(record)
+
+        # "spawn" because the embedding scheduler already runs threads in this process
+        with ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn")) as pool, \
+                open(self.state_path, "a", encoding="utf-8") as state_file:
+            pending = {pool.submit(extract_file, path, self.work_dir): path for path in todo}
+            futures |= set(pending)
+            while futures:
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = pending.pop(future, None)
+                    if path is None:
+                        try:
+                            progress.add(embedded=1, chunks_embedded=future.result())
+                        except Exception as e:
+                            content_hash = embedding[future]
+                            embed_failed.add(content_hash)
+                            for failed_path, record in state.items():
+                                if record["content_hash"] == content_hash:
+                                    self._skip(failed_path, f"embedding failed: {e}", progress)
+                        continue
+                    try:
+                        record = future.result()
+                    except Exception as e:
+                        self._skip(path, str(e), progress)
+                        continue
+                    state_file.write(json.dumps(record) + "\n")
+                    state_file.flush()
+                    state[path] = record
+                    progress.add(extracted=1)
+                    submit_embed(record)
+        embed_pool.shutdown()
+        return [state[path] for path in files if path in state and state[path]["content_hash"] not in embed_failed]
+
+    def _skip(self, path: str, error: str, progress: Progress):
+        print(f"[BULK] Skipping {path}: {error}")
+        self.failures[path] = error
+        progress.add(skipped=1)
+
+    # --- Phase 3 ---
+    def load(self, session, records: List[Dict], progress: Progress) -> int:
+        """
+        Inserts rows for every artifact that has none yet, then adds all vectors missing
+        from the user's shard in one pass. Returns the number of vectors added.
+        """
+        with index_manager.read(self.user_id) as index:
+            indexed = set(embeddings.index_ids(index).tolist())
+
+        missing = []  # (faiss ids, artifact dir) for vectors not yet in the shard
+        seen = set()
+        for record in records:
+            if not record["chunks"] or record["content_hash"] in seen:
+                continue
+            seen.add(record["content_hash"])
+            out_dir = self._artifact_dir(record)
+
+            doc = (
+                session.query(models.Document)
+                .filter(models.Document.user_id == self.user_id, models.Document.content_hash == record["content_hash"])
+                .first()
+            )
+            if doc is None:
+                ids = self._insert_rows(session, record, out_dir)
+            else:
+                ids = np.array([
+                    i for (i,) in session.query(models.Chunk.faiss_index_id)
+                    .filter(models.Chunk.doc_id == doc.id)
+                    .order_by(models.Chunk.faiss_index_id)
+                ], dtype="int64")
+            if len(ids) and int(ids[0]) not in indexed:
+                missing.append((ids, out_dir))
+            progress.add(loaded=1)
+
+        added = 0
+        with index_manager.write(self.user_id, background_rebuild=False) as index:
+            for ids, out_dir in missing:
+                vectors = np.memmap(os.path.join(out_dir, "vectors.f32"), dtype="float32", mode="r").reshape(-1, embeddings.DIM)
+                for start in range(0, len(ids), STREAM_BATCH_SIZE):
+                    end = start + STREAM_BATCH_SIZE
+                    index.add_with_ids(np.array(vectors[start:end]), ids[start:end])
+                added += len(ids)
+                del vectors
+        if index_manager.needs_rebuild(self.user_id):
+            index_manager.rebuild_shard(self.user_id)
+        index_manager.flush()
+        return added
+
+    def _insert_rows(self, session, record: Dict, out_dir: str) -> np.ndarray:
+        doc = models.Document(user_id=self.user_id, filename=record["filename"], content_hash=record["content_hash"])
+        session.add(doc)
+        session.flush()
+        text_store.put_file(doc.id, os.path.join(out_dir, "text.txt"))
+
+        ids = index_manager.allocate_ids(record["chunks"])
+        offset = 0
+        for batch in _batched(_iter_jsonl(os.path.join(out_dir, "chunks.jsonl")), STREAM_BATCH_SIZE):
+            session.bulk_insert_mappings(models.Chunk, [
+                {
+                    "faiss_index_id": int(faiss_id),
+                    "doc_id": doc.id,
+                    "user_id": self.user_id,
+                    "content": chunk["text"],
+                    "page": chunk["page"],
+                    "start_offset": chunk["start_offset"],
+                    "end_offset": chunk["end_offset"],
+                    "token_count": chunk["token_count"],
+                }
+                for faiss_id, chunk in zip(ids[offset:offset + len(batch)], batch)
+            ])
+            offset += len(batch)
+        lexical.index_document(session, self.user_id, doc.id)
+        # One commit per document: a rerun either sees all of its rows or none
+        session.commit()
+        return ids
+
+    def run(self, session, files: List[str], keep_work: bool = False) -> Dict:
+        progress = Progress(len(files))
+        records = self.prepare(files, progress)
+        added = self.load(session, records, progress)
+        progress.report(final=True)
+        if self.failures:
+            print(f"[BULK] {len(self.failures)} file(s) failed; keeping {self.work_dir} so a rerun retries them")
+        elif not keep_work:
+            self._remove_work()
+        return {
+            "files": len(files),
+            "documents": len({r["content_hash"] for r in records if r["chunks"]}),
+            "vectors_added": added,
+            "failed": len(self.failures),
+        }
+
+    def _remove_work(self):
+        """
+        Deletes what the importer wrote to the work directory: state.jsonl and the
+        artifact directory of every file it recorded. The work directory itself goes only
+        if that leaves it empty, so pointing --work-dir at a directory in use is safe.
+        """
+        for record in self._load_state().values():
+            shutil.rmtree(self._artifact_dir(record), ignore_errors=True)
+        try:
+            os.remove(self.state_path)
+            os.rmdir(self.work_dir)
+        except OSError:
+            pass
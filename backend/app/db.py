@@ -1,13 +1,13 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 from dotenv import load_dotenv
-from typing import Generator
+from typing import Generator, List
 from sqlalchemy.orm import Session
 from pathlib import Path # Used for cleaner path handling
 
 # --- Configuration ---
-load_dotenv() 
+load_dotenv()
 
 # 💡 FIX: Use an absolute path for the SQLite database file
 
@@ -15,28 +15,88 @@ load_dotenv()
 BASE_DIR = Path(__file__).resolve().parent
 
 # Define the database file name (can be set in .env or defaults to a safe name)
-DB_FILE_NAME = os.getenv("DB_FILE_NAME", "smart_research_hub.db") 
+DB_FILE_NAME = os.getenv("DB_FILE_NAME", "smart_research_hub.db")
 
 # Construct the absolute path to the database file
 DB_PATH = BASE_DIR / DB_FILE_NAME
 
-# The final SQLAlchemy URL
-SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_PATH}" 
+# The final SQLAlchemy URL: DATABASE_URL (e.g. PostgreSQL in docker-compose) wins over the local SQLite file
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL") or f"sqlite:///{DB_PATH}"
+# Older Heroku-style URLs use the scheme SQLAlchemy 1.4+ no longer accepts
+if SQLALCHEMY_DATABASE_URL.startswith("postgres://"):
+    SQLALCHEMY_DATABASE_URL = "postgresql://" + SQLALCHEMY_DATABASE_URL[len("postgres://"):]
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        print(f"[DB] Warning: {name} is not a valid integer. Using default ({default}).")
+        return default
+
+# --- Pool Settings (server databases) ---
+# Connections kept open, extra connections allowed under bursts, and seconds to wait for one
+DB_POOL_SIZE = _env_int("DB_POOL_SIZE", 10)
+DB_MAX_OVERFLOW = _env_int("DB_MAX_OVERFLOW", 20)
+DB_POOL_TIMEOUT = _env_int("DB_POOL_TIMEOUT", 30)
+# Connections older than this are replaced, before the server or a proxy drops them
+DB_POOL_RECYCLE = _env_int("DB_POOL_RECYCLE", 1800)
+
+# --- SQLite Settings ---
+# Milliseconds a writer waits for the lock instead of failing with "database is locked"
+SQLITE_BUSY_TIMEOUT_MS = _env_int("SQLITE_BUSY_TIMEOUT_MS", 5000)
+# Page cache per connection, in KiB. Every pooled connection gets its own cache, so a
+# process can use up to 15x this (SQLAlchemy's default SQLite pool: 5 + 10 overflow)
+# and a deployment that much again per worker; the OS page cache sits behind it anyway.
+SQLITE_CACHE_KB = _env_int("SQLITE_CACHE_KB", 8 * 1024)
+# NORMAL is durable across application crashes in WAL mode; only power loss can drop the last commits
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+if SQLITE_SYNCHRONOUS not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+    print(f"[DB] Warning: unknown SQLITE_SYNCHRONOUS '{SQLITE_SYNCHRONOUS}'. Using NORMAL.")
+    SQLITE_SYNCHRONOUS = "NORMAL"
 
 
 # --- Engine Setup ---
-# For SQLite, we need this argument to allow multiple threads (requests) 
-# to interact with the database connection.
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, 
-    connect_args={"check_same_thread": False}
-)
+def _create_engine(url: str):
+    if url.startswith("sqlite"):
+        # For SQLite, we need this argument to allow multiple threads (requests)
+        # to interact with the database connection.
+        engine = create_engine(
+            url,
+            connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        )
+
+        @event.listens_for(engine, "connect")
+        def _tune_sqlite(dbapi_connection, connection_record):
+            # WAL lets readers run alongside the single writer instead of queueing behind it
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+            cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+            cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB}")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+            cursor.close()
+
+        return engine
+
+    return create_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        # Checks a connection before handing it out, so a restarted database is not an error
+        pool_pre_ping=True,
+    )
+
+
+engine = _create_engine(SQLALCHEMY_DATABASE_URL)
 
 # --- Session Setup ---
 # SessionLocal is the factory for creating new Session objects
 SessionLocal = sessionmaker(
-    autocommit=False, 
-    autoflush=False, 
+    autocommit=False,
+    autoflush=False,
     bind=engine
 )
 
@@ -44,10 +104,56 @@ SessionLocal = sessionmaker(
 Base = declarative_base()
 
 
+# --- Column Migrations ---
+# create_all() creates missing tables but never changes existing ones, so columns added
+# to a model after its table shipped are listed here as (table, column, SQL type) and
+# added by ensure_columns() on startup. Each step is skipped once the column exists.
+ADDED_COLUMNS = [
+    # Chunk provenance
+    ("chunks", "page", "INTEGER"),
+    ("chunks", "start_offset", "INTEGER"),
+    ("chunks", "end_offset", "INTEGER"),
+    ("chunks", "token_count", "INTEGER"),
+    # Upload deduplication
+    ("documents", "content_hash", "VARCHAR(64)"),
+    # Document replacement
+    ("ingest_jobs", "replaces_doc_id", "INTEGER"),
+]
+# Indexes added to existing tables, as (name, table, column)
+ADDED_INDEXES = [
+    ("ix_documents_content_hash", "documents", "content_hash"),
+    ("ix_chunks_doc_id", "chunks", "doc_id"),
+]
+
+
+def ensure_columns(engine) -> List[str]:
+    """Adds any ADDED_COLUMNS (and their indexes) missing from existing tables; returns those added."""
+    added = []
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        tables = set(inspector.get_table_names())
+        columns = {}
+        for table, column, sql_type in ADDED_COLUMNS:
+            if table not in tables:
+                continue
+            if table not in columns:
+                columns[table] = {c["name"] for c in inspector.get_columns(table)}
+            if column not in columns[table]:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {sql_type}"))
+                columns[table].add(column)
+                added.append(f"{table}.{column}")
+        for name, table, column in ADDED_INDEXES:
+            if table in tables:
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({column})"))
+    for column in added:
+        print(f"[DB] Added column {column}")
+    return added
+
+
 # --- Dependency Function ---
 def get_db() -> Generator[Session, None, None]:
     """
-    Dependency that provides a database session for a single request 
+    Dependency that provides a database session for a single request
     and ensures it is closed afterwards.
     """
     db = SessionLocal()
@@ -55,4 +161,4 @@ def get_db() -> Generator[Session, None, None]:
         yield db
     finally:
         # Ensures the database session is always closed
-        db.close()
\ No newline at end of file
+        db.close()
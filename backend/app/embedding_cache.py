@@ -0,0 +1,170 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from . import metrics
+
+# --- Cache Settings ---
+# SQLite file holding every embedding computed so far. Set to an empty string to disable.
+CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db")
+try:
+    QUERY_CACHE_SIZE = int(os.getenv("EMBEDDING_QUERY_CACHE_SIZE", 2048))
+except ValueError:
+    QUERY_CACHE_SIZE = 2048
+    print("[CACHE] Warning: EMBEDDING_QUERY_CACHE_SIZE is not a valid integer. Using default (2048).")
+
+# SQLite caps the number of bound parameters per statement
+_LOOKUP_BATCH = 500
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form used for cache keys: Unicode NFC with collapsed whitespace."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def text_hash(text: str) -> str:
+    """SHA-256 of the normalized text."""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed store of embeddings, keyed by (model, dimension, text hash).
+
+    Vectors are kept as raw float32 bytes in SQLite, so identical chunks and repeated
+    queries are only ever sent to the embedding provider once. Query embeddings are
+    additionally held in a small in-memory LRU so repeated searches skip SQLite too.
+    """
+
+    def __init__(self, path: str, model: str, dim: int, query_cache_size: int = QUERY_CACHE_SIZE):
+        self.path = path
+        self.model = model
+        self.dim = dim
+        self.enabled = bool(path)
+        self._local = threading.local()
+        self._hot: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._hot_size = query_cache_size
+        self._hot_lock = threading.Lock()
+        if self.enabled:
+            self._connect().execute(
+                """
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    dim INTEGER NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    PRIMARY KEY (model, dim, text_hash)
+                ) WITHOUT ROWID
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared across threads, so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # --- Persistent tier ---
+    def get_many(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Returns the cached vector for each text, or None where there is none."""
+        vectors = self._lookup(texts)
+        if self.enabled:
+            hits = sum(vector is not None for vector in vectors)
+            metrics.cache_lookup("embedding", hits=hits, misses=len(vectors) - hits)
+        return vectors
+
+    def _lookup(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        if not self.enabled or not texts:
+            return [None] * len(texts)
+
+        hashes = [text_hash(t) for t in texts]
+        found: Dict[str, np.ndarray] = {}
+        unique = list(dict.fromkeys(hashes))
+        conn = self._connect()
+        for start in range(0, len(unique), _LOOKUP_BATCH):
+            batch = unique[start:start + _LOOKUP_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT text_hash, vector FROM embeddings "
+                f"WHERE model = ? AND dim = ? AND text_hash IN ({placeholders})",
+                [self.model, self.dim, *batch],
+            )
+            for h, blob in rows:
+                found[h] = np.frombuffer(blob, dtype="float32")
+        return [found.get(h) for h in hashes]
+
+    def put_many(self, texts: Sequence[str], vectors) -> None:
+        """Stores one vector per text."""
+        if not self.enabled or not texts:
+            return
+        vectors = np.asarray(vectors, dtype="float32")
+        rows = [
+            (self.model, self.dim, text_hash(t), vectors[i].tobytes())
+            for i, t in enumerate(texts)
+        ]
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    # --- Hot tier for queries ---
+    def get_query(self, text: str) -> Optional[np.ndarray]:
+        """Looks a query up in the in-memory LRU, then in SQLite."""
+        return self.get_queries([text])[0]
+
+    def get_queries(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """
+        Looks queries up in the in-memory LRU, then the rest in SQLite with one lookup.
+        Queries found in SQLite are moved into the LRU.
+        """
+        keys = [normalize_text(t) for t in texts]
+        vectors: List[Optional[np.ndarray]] = [None] * len(texts)
+        with self._hot_lock:
+            for i, key in enumerate(keys):
+                vector = self._hot.get(key)
+                if vector is not None:
+                    self._hot.move_to_end(key)
+                    vectors[i] = vector
+
+        cold = [i for i, vector in enumerate(vectors) if vector is None]
+        for i, vector in zip(cold, self._lookup([texts[i] for i in cold])):
+            if vector is not None:
+                vectors[i] = vector
+                self._remember_query(keys[i], vector)
+        hits = sum(vector is not None for vector in vectors)
+        metrics.cache_lookup("query_embedding", hits=hits, misses=len(texts) - hits)
+        return vectors
+
+    def put_query(self, text: str, vector) -> None:
+        self.put_queries([text], np.asarray(vector, dtype="float32").reshape(1, -1))
+
+    def put_queries(self, texts: Sequence[str], vectors) -> None:
+        """Stores query vectors in SQLite and in the in-memory LRU."""
+        vectors = np.asarray(vectors, dtype="float32")
+        self.put_many(texts, vectors)
+        for text, vector in zip(texts, vectors):
+            # A copy, so the LRU does not keep the whole batch alive
+            self._remember_query(normalize_text(text), vector.copy())
+
+    def _remember_query(self, key: str, vector: np.ndarray) -> None:
+        if self._hot_size <= 0:
+            return
+        with self._hot_lock:
+            self._hot[key] = vector
+            self._hot.move_to_end(key)
+            while len(self._hot) > self._hot_size:
+                self._hot.popitem(last=False)
@@ -0,0 +1,336 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, List, Optional
+
+import numpy as np
+
+from . import metrics
+from .tokenizer import count_tokens_many
+
+# --- Scheduler Settings ---
+def _env_number(name, default, cast=int):
+    try:
+        return cast(os.getenv(name, default))
+    except ValueError:
+        print(f"[EMBED] Warning: {name} is not a valid number. Using default ({default}).")
+        return default
+
+# Per-request limits of the embeddings API (OpenAI: 2048 inputs, 300k tokens)
+BATCH_MAX_TOKENS = _env_number("EMBEDDING_BATCH_MAX_TOKENS", 50000)
+BATCH_MAX_ITEMS = _env_number("EMBEDDING_BATCH_MAX_ITEMS", 256)
+# Requests in flight at once
+MAX_CONCURRENCY = _env_number("EMBEDDING_MAX_CONCURRENCY", 4)
+# Account-level budgets; 0 disables the limit
+REQUESTS_PER_MINUTE = _env_number("EMBEDDING_RPM", 3000)
+TOKENS_PER_MINUTE = _env_number("EMBEDDING_TPM", 1000000)
+MAX_RETRIES = _env_number("EMBEDDING_MAX_RETRIES", 6)
+# How long a partly-filled batch waits for texts from other uploads before it is sent
+COALESCE_SECONDS = _env_number("EMBEDDING_COALESCE_MS", 20, float) / 1000.0
+
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+def _is_retryable(exc: Exception) -> bool:
+    """Rate limits, timeouts and 5xx responses are retried; anything else fails the batch."""
+    status = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    if status in _RETRYABLE_STATUS:
+        return True
+    return type(exc).__name__ in {"RateLimitError", "APIConnectionError", "APITimeoutError", "InternalServerError", "TimeoutError"}
+
+
+class RateLimiter:
+    """
+    Token buckets for requests-per-minute and tokens-per-minute, refilled continuously.
+
+    Normal requests take the budget one at a time, in order. Urgent requests (search
+    queries) skip that line: while one is waiting, normal requests hold back, so a
+    query only ever waits for the budget itself, not for a queue of upload batches.
+    """
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self._urgent_waiting = 0
+        self._no_urgent = asyncio.Event()
+        self._no_urgent.set()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60.0)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60.0)
+
+    def pause(self, seconds: float):
+        """Holds back every request for a while, e.g. after the provider answered 429."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, tokens: int, urgent: bool = False):
+        # A batch larger than the whole per-minute budget still has to go out eventually
+        tokens = min(tokens, self.tpm) if self.tpm else tokens
+        if not urgent:
+            async with self._lock:
+                await self._take(tokens, urgent=False)
+            return
+
+        self._urgent_waiting += 1
+        self._no_urgent.clear()
+        try:
+            await self._take(tokens, urgent=True)
+        finally:
+            self._urgent_waiting -= 1
+            if not self._urgent_waiting:
+                self._no_urgent.set()
+
+    async def _take(self, tokens: int, urgent: bool):
+        while True:
+            if not urgent and not self._no_urgent.is_set():
+                await self._no_urgent.wait()
+                continue
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._refill()
+            wait = 0.0
+            if self.rpm and self._requests < 1:
+                wait = max(wait, (1 - self._requests) * 60.0 / self.rpm)
+            if self.tpm and self._tokens < tokens:
+                wait = max(wait, (tokens - self._tokens) * 60.0 / self.tpm)
+            if wait <= 0:
+                if self.rpm:
+                    self._requests -= 1
+                if self.tpm:
+                    self._tokens -= tokens
+                return
+            await asyncio.sleep(wait)
+
+
+@dataclass
+class _Request:
+    """One caller's texts; resolved once every text has a vector."""
+    future: Future
+    vectors: list
+    remaining: int
+
+
+@dataclass
+class _Item:
+    text: str
+    tokens: int
+    request: _Request
+    position: int
+
+
+@dataclass
+class _Batch:
+    items: List[_Item] = field(default_factory=list)
+    tokens: int = 0
+
+
+class EmbeddingScheduler:
+    """
+    Sends embedding work to the provider in token-budgeted batches.
+
+    Callers on any thread `submit` lists of texts. The scheduler's own event loop
+    packs pending texts, including texts from different uploads, into batches of at
+    most `max_batch_tokens` tokens and `max_batch_items` inputs. It sends up to
+    `max_concurrency` batches at once within the RPM/TPM budgets, and retries rate
+    limits and transient errors with exponential backoff.
+
+    Texts submitted with `urgent=True` (search queries) use a separate lane that
+    shares the RPM/TPM budgets: they are batched only with other urgent texts
+    already waiting, without the coalescing delay. They have their own concurrency
+    slots and go ahead of upload batches waiting for the rate limits.
+    """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], Awaitable[List[List[float]]]],
+        max_batch_tokens: int = BATCH_MAX_TOKENS,
+        max_batch_items: int = BATCH_MAX_ITEMS,
+        max_concurrency: int = MAX_CONCURRENCY,
+        rpm: int = REQUESTS_PER_MINUTE,
+        tpm: int = TOKENS_PER_MINUTE,
+        max_retries: int = MAX_RETRIES,
+        coalesce_seconds: float = COALESCE_SECONDS,
+    ):
+        self.embed_batch = embed_batch
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_items = max_batch_items
+        self.max_concurrency = max(1, max_concurrency)
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_retries = max_retries
+        self.coalesce_seconds = coalesce_seconds
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    # --- Lifecycle ---
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            ready = threading.Event()
+
+            def run():
+                self._loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(self._loop)
+                self._pending: "asyncio.Queue[_Item]" = asyncio.Queue()
+                self._urgent: "asyncio.Queue[_Item]" = asyncio.Queue()
+                self._slots = asyncio.Semaphore(self.max_concurrency)
+                self._urgent_slots = asyncio.Semaphore(self.max_concurrency)
+                self._limiter = RateLimiter(self.rpm, self.tpm)
+                self._loop.create_task(self._dispatch())
+                self._loop.create_task(self._dispatch_urgent())
+                ready.set()
+                self._loop.run_forever()
+
+            self._thread = threading.Thread(target=run, name="embedding-scheduler", daemon=True)
+            self._thread.start()
+            ready.wait()
+
+    def close(self):
+        with self._start_lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread = None
+            self._loop = None
+
+    # --- Public API ---
+    def submit(self, texts: List[str], urgent: bool = False) -> Future:
+        """
+        Queues texts for embedding; the future resolves to a (len(texts), dim) float32 array.
+        `urgent` puts them in the low-latency lane used for search queries.
+        """
+        future: Future = Future()
+        if not texts:
+            future.set_result(np.zeros((0, 0), dtype="float32"))
+            return future
+
+        self._ensure_started()
+        request = _Request(future=future, vectors=[None] * len(texts), remaining=len(texts))
+        items = [
+            _Item(text=t, tokens=n, request=request, position=i)
+            for i, (t, n) in enumerate(zip(texts, count_tokens_many(texts)))
+        ]
+
+        queue = self._urgent if urgent else self._pending
+
+        def enqueue():
+            for item in items:
+                queue.put_nowait(item)
+
+        self._loop.call_soon_threadsafe(enqueue)
+        return future
+
+    def embed(self, texts: List[str], urgent: bool = False) -> np.ndarray:
+        """Blocking form of `submit`."""
+        return self.submit(texts, urgent=urgent).result()
+
+    # --- Event loop side ---
+    async def _dispatch(self):
+        while True:
+            item = await self._pending.get()
+            batch = _Batch()
+            self._add(batch, item)
+
+            # Give concurrent uploads a moment to top up a partly-filled batch
+            deadline = self._loop.time() + self.coalesce_seconds
+            while len(batch.items) < self.max_batch_items:
+                try:
+                    timeout = max(0.0, deadline - self._loop.time())
+                    nxt = self._pending.get_nowait() if self._pending.qsize() else await asyncio.wait_for(self._pending.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if batch.tokens + nxt.tokens > self.max_batch_tokens:
+                    # Over budget: send this batch now and start the next with `nxt`
+                    await self._launch(batch)
+                    batch = _Batch()
+                    deadline = self._loop.time() + self.coalesce_seconds
+                self._add(batch, nxt)
+            await self._launch(batch)
+
+    async def _dispatch_urgent(self):
+        while True:
+            batch = _Batch()
+            self._add(batch, await self._urgent.get())
+            # No coalescing delay: only queries that are already waiting join the batch
+            while len(batch.items) < self.max_batch_items and self._urgent.qsize():
+                nxt = self._urgent.get_nowait()
+                if batch.tokens + nxt.tokens > self.max_batch_tokens:
+                    await self._launch(batch, urgent=True)
+                    batch = _Batch()
+                self._add(batch, nxt)
+            await self._launch(batch, urgent=True)
+
+    @staticmethod
+    def _add(batch: _Batch, item: _Item):
+        batch.items.append(item)
+        batch.tokens += item.tokens
+
+    async def _launch(self, batch: _Batch, urgent: bool = False):
+        if not batch.items:
+            return
+        # Waiting for a free slot here is what bounds the number of requests in flight
+        slots = self._urgent_slots if urgent else self._slots
+        await slots.acquire()
+        self._loop.create_task(self._send(batch, slots, urgent))
+
+    async def _send(self, batch: _Batch, slots: asyncio.Semaphore, urgent: bool = False):
+        try:
+            texts = [item.text for item in batch.items]
+            attempt = 0
+            while True:
+                await self._limiter.acquire(batch.tokens, urgent=urgent)
+                start = time.perf_counter()
+                try:
+                    vectors = await self.embed_batch(texts)
+                    metrics.STAGE_SECONDS.observe(time.perf_counter() - start, stage="embedding_request")
+                    metrics.EMBEDDING_REQUESTS.inc(outcome="ok")
+                    metrics.EMBEDDING_TOKENS.inc(batch.tokens)
+                    break
+                except Exception as e:
+                    metrics.EMBEDDING_REQUESTS.inc(outcome="error")
+                    attempt += 1
+                    if attempt > self.max_retries or not _is_retryable(e):
+                        self._fail(batch, e)
+                        return
+                    delay = min(60.0, 2 ** attempt) * (0.5 + random.random() / 2)
+                    print(f"[EMBED] Retrying batch of {len(texts)} after error ({e}); waiting {delay:.1f}s")
+                    if getattr(e, "status_code", None) == 429 or type(e).__name__ == "RateLimitError":
+                        self._limiter.pause(delay)
+                    await asyncio.sleep(delay)
+            self._deliver(batch, vectors)
+        finally:
+            slots.release()
+
+    @staticmethod
+    def _deliver(batch: _Batch, vectors):
+        for item, vector in zip(batch.items, vectors):
+            request = item.request
+            if request.future.done():
+                continue
+            request.vectors[item.position] = vector
+            request.remaining -= 1
+            if request.remaining == 0:
+                request.future.set_result(np.asarray(request.vectors, dtype="float32"))
+
+    @staticmethod
+    def _fail(batch: _Batch, exc: Exception):
+        for item in batch.items:
+            if not item.request.future.done():
+                item.request.future.set_exception(exc)
@@ -1,13 +1,28 @@
+import asyncio
+import hashlib
 import os
+import re
+import threading
+import time
+from bisect import bisect_right
+from dataclasses import dataclass
 import numpy as np
-import faiss
-from langchain_openai import OpenAIEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from . import metrics
+from .lazy import lazy_import
+from .embedding_cache import EmbeddingCache, CACHE_PATH as EMBEDDING_CACHE_PATH
+from .embedding_scheduler import EmbeddingScheduler
+from .tokenizer import count_tokens
+
+# Imported on first use (see lazy.py); langchain and the OpenAI client are imported in get_embeddings_client
+faiss = lazy_import("faiss")
 
 # --- Load API key from environment ---
 # Note: The main application (main.py) should handle the global load_dotenv() call.
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
+# "openai" calls the API; "local" uses the deterministic offline embedder below
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai").lower()
+if not OPENAI_API_KEY and EMBEDDING_PROVIDER != "local":
     # Changed to a print/log for a module file, letting the main app handle termination
     print("WARNING: Missing OPENAI_API_KEY in environment. Embeddings will fail if used.")
 
@@ -19,57 +34,518 @@ _MODEL_DIMENSIONS = {
     "text-embedding-3-large": 3072,
 }
 # Safely get the dimension, defaulting to 1536
-DIM = int(os.getenv("EMBEDDING_DIM", _MODEL_DIMENSIONS.get(EMBEDDING_MODEL, 1536)))
+NATIVE_DIM = _MODEL_DIMENSIONS.get(EMBEDDING_MODEL, 1536)
+# text-embedding-3-* vectors can be shortened (e.g. EMBEDDING_DIM=512); the API truncates and
+# re-normalizes them. Changing it requires re-embedding everything already indexed.
+DIM = int(os.getenv("EMBEDDING_DIM", NATIVE_DIM))
+
+
+class LocalEmbeddings:
+    """
+    Deterministic offline stand-in for OpenAIEmbeddings (a hashed bag of words).
+
+    Texts sharing words get nearby vectors, so search behaves sensibly in tests and
+    benchmarks. `latency_seconds` simulates the provider's per-request round trip.
+    """
+
+    def __init__(self, dim, latency_seconds=0.0):
+        self.dim = dim
+        self.latency_seconds = latency_seconds
+
+    def _embed(self, text):
+        vec = np.zeros(self.dim, dtype="float32")
+        for token in re.findall(r"\w+", text.lower()):
+            h = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            vec[h % self.dim] += 1.0 if h >> 63 else -1.0
+        norm = np.linalg.norm(vec)
+        if norm == 0:
+            vec[0] = 1.0
+            return vec
+        return vec / norm
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency_seconds)
+        return [self._embed(t).tolist() for t in texts]
+
+    def embed_query(self, text):
+        time.sleep(self.latency_seconds)
+        return self._embed(text).tolist()
 
-# --- Initialize Embedding Client ---
-embeddings_client = OpenAIEmbeddings(
-    model=EMBEDDING_MODEL,
-    openai_api_key=OPENAI_API_KEY,
-)
+    async def aembed_documents(self, texts):
+        await asyncio.sleep(self.latency_seconds)
+        return [self._embed(t).tolist() for t in texts]
 
+
+# --- Embedding Client ---
+# Created on first use: langchain and the OpenAI SDK take a while to import, and a worker
+# that only serves lexical searches or cached queries never needs them.
+_embeddings_client = None
+_client_lock = threading.Lock()
+
+def get_embeddings_client():
+    global _embeddings_client
+    if _embeddings_client is None:
+        with _client_lock:
+            if _embeddings_client is None:
+                if EMBEDDING_PROVIDER == "local":
+                    _embeddings_client = LocalEmbeddings(DIM, float(os.getenv("LOCAL_EMBEDDING_LATENCY_MS", 0)) / 1000.0)
+                else:
+                    from langchain_openai import OpenAIEmbeddings
+                    _embeddings_client = OpenAIEmbeddings(
+                        model=EMBEDDING_MODEL,
+                        openai_api_key=OPENAI_API_KEY,
+                        # Only the text-embedding-3 models accept a shorter output dimension
+                        **({"dimensions": DIM} if DIM != NATIVE_DIM and EMBEDDING_MODEL.startswith("text-embedding-3") else {}),
+                    )
+    return _embeddings_client
+
+
+# --- Embedding Scheduler ---
+async def _embed_batch(texts):
+    return await get_embeddings_client().aembed_documents(texts)
+
+# Chunks from all concurrent uploads are batched and rate-limited here
+embedding_scheduler = EmbeddingScheduler(_embed_batch)
+
+# --- Embedding Cache ---
+# Identical chunks and repeated queries are only embedded once per (model, dimension)
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_MODEL, DIM)
+
+# Legacy single-file index (one global IndexFlatL2, FAISS id == position).
 INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "faiss_index.idx")
+# Directory holding one sub-index per user ("user_<id>.g<generation>.idx").
+INDEX_DIR = os.getenv("FAISS_INDEX_DIR", "faiss_index")
+
+# --- Index Type Settings ---
+def _env_int(name, default):
+    """Reads an integer setting, falling back to the default on bad values."""
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        print(f"WARNING: {name} is not a valid integer. Using default ({default}).")
+        return default
+
+# flat = exact search; ivf_flat / ivf_pq / hnsw = approximate search.
+# sq_fp16 / sq8 / opq_pq = exhaustive search over compressed vectors (2x / 4x / DIM*4/PQ_M x smaller).
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw", "sq_fp16", "sq8", "opq_pq")
+# Types that keep lossy vectors; their top candidates are re-ranked at full precision
+COMPRESSED_INDEX_TYPES = ("ivf_pq", "sq_fp16", "sq8", "opq_pq")
+INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat").lower()
+if INDEX_TYPE not in INDEX_TYPES:
+    print(f"WARNING: Unknown FAISS_INDEX_TYPE '{INDEX_TYPE}'. Using 'flat'.")
+    INDEX_TYPE = "flat"
+
+# Shards stay exact (flat) until they hold this many vectors, then they are rebuilt
+# into INDEX_TYPE, trained on a random sample of at most TRAIN_SAMPLE_SIZE vectors.
+TRAIN_MIN_VECTORS = _env_int("FAISS_TRAIN_MIN_VECTORS", 10000)
+TRAIN_SAMPLE_SIZE = _env_int("FAISS_TRAIN_SAMPLE_SIZE", 100000)
+IVF_NLIST = _env_int("FAISS_IVF_NLIST", 1024)  # upper bound; scaled down for small shards
+IVF_NPROBE = _env_int("FAISS_IVF_NPROBE", 16)
+PQ_M = _env_int("FAISS_PQ_M", 64)  # sub-quantizers; must divide DIM
+HNSW_M = _env_int("FAISS_HNSW_M", 32)
+HNSW_EF_CONSTRUCTION = _env_int("FAISS_HNSW_EF_CONSTRUCTION", 200)
+HNSW_EF_SEARCH = _env_int("FAISS_HNSW_EF_SEARCH", 64)
+# Compressed indexes return RERANK_FACTOR * k candidates, which are re-scored with the
+# float32 vectors from the embedding cache; 1 disables re-ranking.
+RERANK_FACTOR = max(1, _env_int("FAISS_RERANK_FACTOR", 4))
 
 # --- FAISS Index Handling ---
-def create_embeddings_index(vectors=None):
-    """Initializes a new FAISS IndexFlatL2."""
-    index = faiss.IndexFlatL2(DIM)
-    if vectors is not None and len(vectors) > 0:
-        # Ensures vectors is a NumPy array for correct addition
-        arr = np.array(vectors).astype("float32")
-        index.add(arr)
+def _factory_string(index_type, n_vectors):
+    """FAISS index_factory description for an IndexIDMap2 of the given type."""
+    if index_type == "flat":
+        return "IDMap2,Flat"
+    if index_type == "hnsw":
+        return f"IDMap2,HNSW{HNSW_M}"
+    if index_type == "sq_fp16":
+        return "IDMap2,SQfp16"
+    if index_type == "sq8":
+        return "IDMap2,SQ8"
+    if index_type == "opq_pq":
+        return f"IDMap2,OPQ{PQ_M},PQ{PQ_M}"
+    # Rule of thumb: about 4 * sqrt(n) inverted lists, with at least ~39 training points each
+    nlist = max(1, min(IVF_NLIST, int(4 * np.sqrt(n_vectors)), n_vectors // 39))
+    if index_type == "ivf_pq":
+        return f"IDMap2,IVF{nlist},PQ{PQ_M}"
+    return f"IDMap2,IVF{nlist},Flat"
+
+def index_type_of(index):
+    """Returns which of INDEX_TYPES an IndexIDMap2 wraps."""
+    inner = faiss.downcast_index(index.index)
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(inner, faiss.IndexPreTransform):
+        return "opq_pq"
+    if isinstance(inner, faiss.IndexScalarQuantizer):
+        return "sq_fp16" if inner.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(inner, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+def create_embeddings_index(vectors=None, ids=None, index_type=None):
+    """
+    Initializes a new FAISS index keyed by explicit ids (IndexIDMap2).
+
+    The index is of `index_type` (default: FAISS_INDEX_TYPE), except that shards with
+    fewer than TRAIN_MIN_VECTORS vectors are kept flat; a type the caller asked for by
+    name is reported when that happens. Types that need training are trained on a
+    sample of `vectors`. If vectors are given without ids, they are numbered from 0.
+    """
+    arr = np.zeros((0, DIM), dtype="float32") if vectors is None else np.asarray(vectors, dtype="float32")
+    if ids is None:
+        ids = np.arange(len(arr))
+    ids = np.asarray(ids, dtype="int64")
+
+    requested = index_type
+    index_type = index_type or INDEX_TYPE
+    if index_type != "flat" and len(arr) < TRAIN_MIN_VECTORS:
+        if requested is not None:
+            print(
+                f"Warning: building a flat index instead of {requested}: {len(arr)} vectors is "
+                f"below FAISS_TRAIN_MIN_VECTORS ({TRAIN_MIN_VECTORS})."
+            )
+        index_type = "flat"
+
+    index = faiss.index_factory(DIM, _factory_string(index_type, len(arr)), faiss.METRIC_L2)
+    inner = faiss.downcast_index(index.index)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        inner.hnsw.efSearch = HNSW_EF_SEARCH
+    elif isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = IVF_NPROBE
+        # Lets vectors be reconstructed by id, which rebuilds and migrations rely on
+        inner.set_direct_map_type(faiss.DirectMap.Array)
+
+    if not index.is_trained:
+        sample = arr
+        if len(arr) > TRAIN_SAMPLE_SIZE:
+            rng = np.random.default_rng(0)
+            sample = arr[rng.choice(len(arr), TRAIN_SAMPLE_SIZE, replace=False)]
+        index.train(sample)
+
+    if len(arr) > 0:
+        index.add_with_ids(arr, ids)
     return index
 
-def save_index(index):
-    """Saves the FAISS index to the specified path."""
-    faiss.write_index(index, INDEX_PATH)
+def index_ids(index):
+    """The ids stored in an IndexIDMap2, in insertion order."""
+    return faiss.vector_to_array(index.id_map).astype("int64")
+
+def stored_ids(index, ids):
+    """The ids among `ids` that an IndexIDMap2 holds (each looked up in its id map)."""
+    found = []
+    for i in ids:
+        try:
+            index.reconstruct(int(i))
+        except RuntimeError:
+            continue
+        found.append(int(i))
+    return found
+
+def export_vectors(index, start=0, exact=None):
+    """
+    Returns (ids, vectors) for the entries of an IndexIDMap2 from position `start` on, in
+    insertion order. `exact` maps ids to their full-precision vectors; the other entries
+    are reconstructed from the index, which is lossy on compressed index types.
+    """
+    ids = index_ids(index)[start:]
+    if len(ids) == 0:
+        return ids, np.zeros((0, DIM), dtype="float32")
+    if not exact:
+        return ids, index.index.reconstruct_n(start, len(ids))
+    vectors = np.empty((len(ids), DIM), dtype="float32")
+    for row, i in enumerate(ids):
+        vector = exact.get(int(i))
+        if vector is None:
+            # Inner-index keys are positions in the IndexIDMap2
+            vector = index.index.reconstruct(start + row)
+        vectors[row] = vector
+    return ids, vectors
+
+def needs_rebuild(index):
+    """True once a flat shard has grown large enough to be trained into INDEX_TYPE."""
+    return (
+        INDEX_TYPE != "flat"
+        and index_type_of(index) == "flat"
+        and index.ntotal >= TRAIN_MIN_VECTORS
+    )
+
+def rebuild_index(index, index_type=None):
+    """Builds a new index of `index_type` holding the same ids and vectors."""
+    ids, vectors = export_vectors(index)
+    return create_embeddings_index(vectors, ids, index_type=index_type)
+
+def id_exclusion_selector(ids):
+    """A FAISS IDSelector matching every id except `ids` (used to hide deleted vectors)."""
+    batch = faiss.IDSelectorBatch(np.asarray(sorted(ids), dtype="int64"))
+    selector = faiss.IDSelectorNot(batch)
+    selector.referenced_objects = [batch]  # keep the wrapped selector alive
+    return selector
+
+@metrics.span("faiss_search")
+def search_index(index, query_vectors, k, nprobe=None, ef_search=None, selector=None):
+    """
+    Searches an index, optionally overriding nprobe (IVF) or efSearch (HNSW) for this query.
+    Only ids accepted by `selector` (see id_exclusion_selector) are returned, if one is given.
+    Returns FAISS's (distances, ids) arrays.
+    """
+    params = None
+    inner = faiss.downcast_index(index.index)
+    # Search parameters replace the index's own settings, so defaults are carried over
+    if isinstance(inner, faiss.IndexIVF) and (nprobe or selector is not None):
+        params = faiss.SearchParametersIVF(nprobe=int(nprobe or inner.nprobe))
+    elif isinstance(inner, faiss.IndexHNSW) and (ef_search or selector is not None):
+        params = faiss.SearchParametersHNSW(efSearch=int(ef_search or inner.hnsw.efSearch))
+    elif selector is not None:
+        params = faiss.SearchParameters()
+    if selector is not None:
+        params.sel = selector
+    queries = np.asarray(query_vectors, dtype="float32").reshape(-1, DIM)
+    return index.search(queries, k, params=params)
+
+def rerank_exact(query_vector, candidate_ids, candidate_distances, full_vectors, k):
+    """
+    Re-scores candidates from a compressed index with exact squared L2 distances.
+    `full_vectors` maps id -> float32 vector; candidates without one keep their
+    approximate distance. Returns the best k as (ids, distances).
+    """
+    query_vector = np.asarray(query_vector, dtype="float32").reshape(-1)
+    scored = []
+    for idx, dist in zip(candidate_ids, candidate_distances):
+        vector = full_vectors.get(idx)
+        if vector is not None:
+            diff = vector - query_vector
+            dist = float(np.dot(diff, diff))
+        scored.append((idx, dist))
+    scored.sort(key=lambda pair: pair[1])
+    scored = scored[:k]
+    return [i for i, _ in scored], [d for _, d in scored]
+
+def _shard_file(user_id, generation, suffix):
+    name = f"user_{int(user_id)}" if generation is None else f"user_{int(user_id)}.g{int(generation)}"
+    return name + suffix
+
+def shard_path(user_id, directory=None, generation=None):
+    """
+    Path of the sub-index holding one user's vectors as saved in `generation`.
+    Without a generation, the fixed name used before snapshots were generation-named.
+    """
+    return os.path.join(directory or INDEX_DIR, _shard_file(user_id, generation, ".idx"))
 
-def load_index():
-    """Loads the FAISS index from the path, or creates a new empty one."""
-    if os.path.exists(INDEX_PATH):
+def tombstones_path(user_id, directory=None, generation=None):
+    """Path of the ids deleted from a user's sub-index (as of `generation`) but not yet compacted away."""
+    return os.path.join(directory or INDEX_DIR, _shard_file(user_id, generation, ".tombstones.npy"))
+
+def parse_shard_file(name):
+    """(user_id, generation or None) for a file named by shard_path or tombstones_path, else None."""
+    match = re.fullmatch(r"user_(\d+)(?:\.g(\d+))?(?:\.idx|\.tombstones\.npy)", name)
+    if match is None:
+        return None
+    user_id, generation = match.groups()
+    return int(user_id), None if generation is None else int(generation)
+
+def save_tombstones(ids, path):
+    """Writes a set of deleted ids atomically (an empty set removes the file)."""
+    if not ids:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.asarray(sorted(ids), dtype="int64"))
+    os.replace(tmp_path, path)
+
+def load_tombstones(path):
+    """Reads the deleted ids saved by save_tombstones; an empty set if there are none."""
+    if not os.path.exists(path):
+        return set()
+    return set(int(i) for i in np.load(path))
+
+@metrics.span("faiss_write")
+def save_index(index, path=None):
+    """
+    Saves the FAISS index to the specified path.
+    Writes to a temporary file first and renames it, so readers never see a partial index.
+    """
+    path = path or INDEX_PATH
+    tmp_path = f"{path}.tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+
+@metrics.span("faiss_read")
+def load_index(path=None, mmap=False):
+    """
+    Loads the FAISS index from the path, or creates a new empty one.
+    With `mmap`, the index is opened read-only with its codes (flat, SQ and PQ storage,
+    HNSW graphs, IVF lists) memory-mapped from the file instead of copied into the
+    process, so they are file-backed pages the OS can share and evict.
+    """
+    path = path or INDEX_PATH
+    if os.path.exists(path):
+        if mmap:
+            # IO_FLAG_MMAP alone maps only IVF inverted lists; MMAP_IFC covers every code array
+            flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+            try:
+                return faiss.read_index(path, flags)
+            except Exception as e:
+                print(f"Warning: could not memory-map FAISS index {path} ({e}). Loading a private copy.")
         try:
-            return faiss.read_index(INDEX_PATH)
+            return faiss.read_index(path)
         except Exception as e:
             print(f"Error loading FAISS index: {e}. Creating a new one.")
             return create_embeddings_index()
     return create_embeddings_index()
 
 # --- Text Chunking ---
-def chunk_text(text, chunk_size=500, overlap=50):
-    """Splits a large text into smaller, overlapping chunks."""
-    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=overlap)
-    return splitter.split_text(text)
+# Chunk sizes are in embedding-model tokens and are capped at the model's input limit
+MAX_INPUT_TOKENS = _env_int("EMBEDDING_MAX_INPUT_TOKENS", 8191)
+CHUNK_TOKENS = min(_env_int("CHUNK_TOKENS", 256), MAX_INPUT_TOKENS)
+CHUNK_OVERLAP_TOKENS = min(_env_int("CHUNK_OVERLAP_TOKENS", 32), CHUNK_TOKENS // 2)
+
+
+@dataclass
+class ChunkRecord:
+    """A chunk of text and where it came from (offsets are into the page-joined document text)."""
+    text: str
+    page: int
+    start_offset: int
+    end_offset: int
+    token_count: int
+
+
+def iter_chunks(pages, chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """
+    Splits a stream of (page_number, text) pairs into overlapping ChunkRecords.
+
+    Pages are consumed one at a time and only the unfinished tail of the text is kept
+    between pages, so memory does not grow with the document. Offsets refer to the
+    pages joined with "\n", the same text `utils.extract_text` returns.
+    """
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    chunk_tokens = min(chunk_tokens, MAX_INPUT_TOKENS)
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_tokens,
+        chunk_overlap=overlap_tokens,
+        length_function=count_tokens,
+    )
+    buffer = ""          # text not yet emitted (plus the overlap carried into the next chunk)
+    buffer_start = 0     # document offset of buffer[0]
+    page_starts = []     # (document offset, page number) of pages overlapping the buffer
+    doc_length = 0
+
+    def emit(pieces):
+        search_from = 0
+        for piece in pieces:
+            start = buffer.find(piece, search_from)
+            if start < 0:
+                start = search_from
+            search_from = start + 1
+            doc_start = buffer_start + start
+            i = bisect_right(page_starts, (doc_start, float("inf"))) - 1
+            page = page_starts[max(i, 0)][1]
+            yield start, ChunkRecord(piece, page, doc_start, doc_start + len(piece), count_tokens(piece))
+
+    for page_number, text in pages:
+        if not text:
+            continue
+        if doc_length:
+            buffer += "\n"
+            doc_length += 1
+        page_starts.append((doc_length, page_number))
+        buffer += text
+        doc_length += len(text)
+
+        pieces = splitter.split_text(buffer)
+        if len(pieces) < 2:
+            continue
+        # The last piece may continue on the next page, so it stays in the buffer
+        located = list(emit(pieces))
+        for _, record in located[:-1]:
+            yield record
+        keep_from = located[-1][0]
+        buffer = buffer[keep_from:]
+        buffer_start += keep_from
+        # Forget pages that end before the buffer, keeping the one it starts in
+        while len(page_starts) > 1 and page_starts[1][0] <= buffer_start:
+            page_starts.pop(0)
+
+    if buffer.strip():
+        for _, record in emit(splitter.split_text(buffer)):
+            yield record
+
+
+def chunk_text(text, chunk_size=CHUNK_TOKENS, overlap=CHUNK_OVERLAP_TOKENS):
+    """Splits a large text into smaller, overlapping chunks of at most `chunk_size` tokens."""
+    return [record.text for record in iter_chunks([(1, text)], chunk_size, overlap)]
 
 # --- Embedding Generation ---
 def embed_texts(texts):
     """
     Generates embeddings for a list of text strings.
     Returns a (n, DIM) numpy array of embeddings.
+
+    Texts already in the embedding cache are not sent to the provider, and
+    duplicates within the list are embedded once.
     """
     if not texts or not isinstance(texts, list):
         return np.zeros((0, DIM), dtype="float32")
     
     # Ensure all elements are strings before embedding
     texts = [str(t) for t in texts]
-    
-    embs = embeddings_client.embed_documents(texts)
-    return np.array(embs, dtype="float32")
\ No newline at end of file
+
+    out = np.zeros((len(texts), DIM), dtype="float32")
+    missing = {}  # text -> positions still needing an embedding
+    for i, (text, cached) in enumerate(zip(texts, embedding_cache.get_many(texts))):
+        if cached is not None:
+            out[i] = cached
+        else:
+            missing.setdefault(text, []).append(i)
+
+    if missing:
+        to_embed = list(missing)
+        embs = embedding_scheduler.embed(to_embed)
+        embedding_cache.put_many(to_embed, embs)
+        for text, emb in zip(to_embed, embs):
+            out[missing[text]] = emb
+    return out
+
+def embed_query(text):
+    """
+    Embeds a search query, serving repeats from the embedding cache. Returns a (DIM,) array.
+    Misses go through the scheduler's urgent lane, so searches count against the same
+    rate limits as uploads without queueing behind them.
+    """
+    cached = embedding_cache.get_query(text)
+    if cached is not None:
+        return cached
+    emb = embedding_scheduler.embed([text], urgent=True)[0]
+    embedding_cache.put_query(text, emb)
+    return emb
+
+def embed_queries(texts):
+    """
+    Embeds many search queries at once. Returns a (n, DIM) array.
+
+    Cached queries are served from the embedding cache (its in-memory LRU first, as in
+    embed_query); the rest (deduplicated) go to the provider through the embedding
+    scheduler's urgent lane, in as few batched requests as its batch and rate limits
+    allow, and are added to the LRU.
+    """
+    texts = [str(t) for t in texts]
+    out = np.zeros((len(texts), DIM), dtype="float32")
+    missing = {}  # text -> positions still needing an embedding
+    for i, (text, cached) in enumerate(zip(texts, embedding_cache.get_queries(texts))):
+        if cached is not None:
+            out[i] = cached
+        else:
+            missing.setdefault(text, []).append(i)
+
+    if missing:
+        to_embed = list(missing)
+        embs = embedding_scheduler.embed(to_embed, urgent=True)
+        embedding_cache.put_queries(to_embed, embs)
+        for text, emb in zip(to_embed, embs):
+            out[missing[text]] = emb
+    return out
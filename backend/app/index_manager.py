@@ -0,0 +1,701 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from . import embeddings, metrics
+
+# --- Persistence Settings ---
+# Seconds to wait after the first unsaved change before the index is written to disk.
+# Further writes inside that window are folded into the same save.
+try:
+    PERSIST_DELAY_SECONDS = float(os.getenv("FAISS_PERSIST_DELAY_SECONDS", 5))
+except ValueError:
+    PERSIST_DELAY_SECONDS = 5.0
+    print("[INDEX] Warning: FAISS_PERSIST_DELAY_SECONDS is not a valid number. Using default (5).")
+
+# --- Serving Mode ---
+# "writer": this process owns the shards, applies changes and publishes snapshots.
+# "reader": shards are memory-mapped read-only (shared between worker processes through
+# the page cache) and reloaded whenever the writer publishes a newer generation.
+INDEX_MODE = os.getenv("INDEX_MODE", "writer").lower()
+if INDEX_MODE not in ("writer", "reader"):
+    print(f"[INDEX] Warning: unknown INDEX_MODE '{INDEX_MODE}'. Using 'writer'.")
+    INDEX_MODE = "writer"
+try:
+    REFRESH_SECONDS = float(os.getenv("INDEX_REFRESH_SECONDS", 1))
+except ValueError:
+    REFRESH_SECONDS = 1.0
+    print("[INDEX] Warning: INDEX_REFRESH_SECONDS is not a valid number. Using default (1).")
+MANIFEST_NAME = "manifest.json"
+# While the shards load in the background, index calls wait up to this long before giving up
+try:
+    LOAD_WAIT_SECONDS = float(os.getenv("INDEX_LOAD_WAIT_SECONDS", 30))
+except ValueError:
+    LOAD_WAIT_SECONDS = 30.0
+    print("[INDEX] Warning: INDEX_LOAD_WAIT_SECONDS is not a valid number. Using default (30).")
+
+
+class ReadOnlyIndex(Exception):
+    """Raised when a reader process tries to change a shard."""
+
+
+class IndexNotReady(Exception):
+    """Raised when the shards are still loading (or failed to load)."""
+
+
+# --- Compaction Settings ---
+# Deleted vectors are hidden from searches at once and physically dropped by a background
+# rebuild once a shard has at least COMPACT_MIN_TOMBSTONES of them making up COMPACT_RATIO of it.
+try:
+    COMPACT_MIN_TOMBSTONES = int(os.getenv("FAISS_COMPACT_MIN_TOMBSTONES", 1000))
+    COMPACT_RATIO = float(os.getenv("FAISS_COMPACT_RATIO", 0.2))
+except ValueError:
+    COMPACT_MIN_TOMBSTONES, COMPACT_RATIO = 1000, 0.2
+    print("[INDEX] Warning: FAISS_COMPACT_MIN_TOMBSTONES / FAISS_COMPACT_RATIO are not valid numbers. Using defaults (1000, 0.2).")
+
+
+class RWLock:
+    """
+    A small readers/writer lock.
+
+    Any number of readers may hold the lock at once; a writer gets exclusive access.
+    Waiting writers block new readers so a steady stream of searches cannot starve uploads.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+class _Shard:
+    """
+    One user's sub-index together with the lock guarding it.
+
+    `tombstones` are ids that were deleted but are still stored in the index; searches
+    skip them through `selector` until a compaction rebuilds the index without them.
+    """
+
+    def __init__(self, index, tombstones: Optional[Set[int]] = None, generation: int = 0):
+        self.index = index
+        self.lock = RWLock()
+        # Snapshot generation this shard was loaded from (reader) or last published as (writer)
+        self.generation = generation
+        # Local changes made to the shard, and how many of them its published generation holds
+        self.changes = 0
+        self.published_changes = 0
+        self.tombstones: Set[int] = tombstones or set()
+        self.selector = None
+        self._refresh_selector()
+
+    def _refresh_selector(self):
+        self.selector = embeddings.id_exclusion_selector(self.tombstones) if self.tombstones else None
+
+    def live_count(self) -> int:
+        return self.index.ntotal - len(self.tombstones)
+
+    def needs_compaction(self) -> bool:
+        dead = len(self.tombstones)
+        return dead >= COMPACT_MIN_TOMBSTONES and dead >= COMPACT_RATIO * max(1, self.index.ntotal)
+
+
+class IndexManager:
+    """
+    Holds the per-user FAISS sub-indexes in memory.
+
+    Every user's vectors live in their own IndexIDMap2, so a search only scans the
+    caller's corpus and always returns their true top-k. Shards are read from disk
+    once, searches run under a shared per-shard lock and mutations under an exclusive
+    one. Changed shards are written back in the background after `persist_delay`
+    seconds, and on `close`.
+
+    FAISS ids are global (they are the Chunk.faiss_index_id values) and are handed out
+    by `allocate_ids`, starting after the highest id passed to `load`.
+
+    Physically a shard is append-only: `remove` only records tombstones, which `search`
+    filters out, and a background compaction later rebuilds the shard without them.
+
+    Every flush publishes a new generation in manifest.json, recording which generation
+    each shard was last written in. Shard and tombstone files are named after their
+    generation and the manifest is written after them, so publishing is atomic. A `read_only` manager (one per serving worker) maps
+    the saved shards instead of loading them and, every `refresh_seconds`, swaps in the
+    shards whose generation moved on, without a restart.
+    """
+
+    def __init__(self, directory: Optional[str] = None, persist_delay: float = PERSIST_DELAY_SECONDS,
+                 read_only: bool = INDEX_MODE == "reader", refresh_seconds: float = REFRESH_SECONDS):
+        self.directory = directory or embeddings.INDEX_DIR
+        self.persist_delay = persist_delay
+        self.read_only = read_only
+        self.refresh_seconds = refresh_seconds
+        self._generation = 0
+        self._refresh_stop = threading.Event()
+        self._refresh_thread: Optional[threading.Thread] = None
+        self._shards: Dict[int, _Shard] = {}
+        self._shards_lock = threading.Lock()
+        self._id_lock = threading.Lock()
+        self._next_id = 0
+        self._state_lock = threading.Lock()
+        self._dirty: Set[int] = set()
+        # Called once the next save of the user's shard has succeeded (see when_persisted)
+        self._persist_callbacks: Dict[int, List[Callable[[], None]]] = {}
+        self._rebuilding: Set[int] = set()
+        # Full-precision vectors for rebuilds (see set_vector_source)
+        self._vector_source: Optional[Callable[[int, np.ndarray], Dict[int, np.ndarray]]] = None
+        self._timer: Optional[threading.Timer] = None
+        self._publish_lock = threading.Lock()
+        # Cleared by mark_loading and set again when load() finishes
+        self._ready = threading.Event()
+        self._ready.set()
+        self._load_error: Optional[Exception] = None
+
+    # --- Lifecycle ---
+    def mark_loading(self):
+        """
+        Makes index calls wait for the next load() to finish. Call it before starting
+        load() on a background thread, so no request slips in ahead of the load.
+        """
+        self._load_error = None
+        self._ready.clear()
+
+    @property
+    def loaded(self) -> bool:
+        return self._ready.is_set() and self._load_error is None
+
+    def wait_loaded(self, timeout: float = LOAD_WAIT_SECONDS):
+        if self._ready.is_set() and self._load_error is None:
+            return
+        if not self._ready.wait(timeout):
+            raise IndexNotReady("The search index is still loading")
+        if self._load_error is not None:
+            raise IndexNotReady(f"The search index failed to load: {self._load_error}")
+
+    def load(self, max_assigned_id: Optional[int] = None):
+        """
+        Reads every shard on disk into memory.
+        `max_assigned_id` is the highest FAISS id already in use (e.g. from the chunks table).
+        """
+        try:
+            self._load(max_assigned_id)
+        except Exception as e:
+            self._load_error = e
+            raise
+        finally:
+            self._ready.set()
+
+    def _load(self, max_assigned_id: Optional[int]):
+        os.makedirs(self.directory, exist_ok=True)
+        if max_assigned_id is not None:
+            with self._id_lock:
+                self._next_id = max(self._next_id, int(max_assigned_id) + 1)
+        manifest = self._read_manifest()
+        self._generation = manifest["generation"]
+
+        # Published shards, plus any saved under the fixed names used before generations
+        user_ids = {int(user_id) for user_id in manifest["shards"]}
+        for name in os.listdir(self.directory):
+            parsed = embeddings.parse_shard_file(name)
+            if parsed is not None and parsed[1] is None and name.endswith(".idx"):
+                user_ids.add(parsed[0])
+        total = 0
+        for user_id in sorted(user_ids):
+            total += self._get_shard(user_id, wait=False).live_count()
+        mode = "memory-mapped, read-only" if self.read_only else "writer"
+        print(f"[INDEX] Loaded {len(self._shards)} FAISS shards with {total} vectors from {self.directory} "
+              f"({mode}, generation {self._generation})")
+        if self.read_only and self.refresh_seconds > 0 and self._refresh_thread is None:
+            self._refresh_stop.clear()
+            self._refresh_thread = threading.Thread(target=self._refresh_loop, name="index-refresh", daemon=True)
+            self._refresh_thread.start()
+
+    def close(self):
+        """Cancels any pending background save and writes outstanding changes."""
+        self._refresh_stop.set()
+        if self._refresh_thread is not None:
+            self._refresh_thread.join(self.refresh_seconds + 1)
+            self._refresh_thread = None
+        with self._state_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        self.flush()
+
+    def migrate_legacy(self, path: str, owners: Iterable[Tuple[int, int]]):
+        """
+        Splits a legacy single-file index (FAISS id == position) into per-user shards.
+        `owners` yields (faiss_index_id, user_id) pairs; the legacy file is renamed afterwards.
+        """
+        legacy = embeddings.load_index(path)
+        by_user: Dict[int, list] = {}
+        for faiss_id, user_id in owners:
+            if 0 <= faiss_id < legacy.ntotal:
+                by_user.setdefault(user_id, []).append(faiss_id)
+
+        for user_id, ids in by_user.items():
+            ids = np.asarray(sorted(ids), dtype="int64")
+            vectors = np.vstack([legacy.reconstruct(int(i)) for i in ids])
+            with self.write(user_id) as index:
+                index.add_with_ids(vectors, ids)
+
+        self.flush()
+        os.replace(path, f"{path}.migrated")
+        print(f"[INDEX] Migrated legacy FAISS index {path} into {len(by_user)} user shards")
+
+    def set_vector_source(self, source: Callable[[int, np.ndarray], Dict[int, np.ndarray]]):
+        """
+        Registers where rebuilds get full-precision vectors: `source(user_id, ids)` returns
+        {faiss_id: float32 vector} for the ids it has. Vectors it lacks are reconstructed
+        from the shard, which on compressed shards only approximates the original.
+        """
+        self._vector_source = source
+
+    def exact_vectors(self, user_id: int, ids) -> Dict[int, np.ndarray]:
+        """Full-precision vectors for `ids` from the registered source ({} without one)."""
+        if self._vector_source is None or len(ids) == 0:
+            return {}
+        try:
+            return self._vector_source(user_id, np.asarray(ids, dtype="int64"))
+        except Exception as e:
+            print(f"[INDEX] Warning: could not look up full-precision vectors for user {user_id}: {e}")
+            return {}
+
+    def _export(self, user_id: int, index, start: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+        """export_vectors, preferring full-precision vectors; logs how many had to be reconstructed."""
+        if embeddings.index_type_of(index) not in embeddings.COMPRESSED_INDEX_TYPES:
+            # Uncompressed shards store the vectors as they were added
+            return embeddings.export_vectors(index, start)
+        ids = embeddings.index_ids(index)[start:]
+        exact = self.exact_vectors(user_id, ids)
+        missing = len(ids) - len(exact)
+        if missing:
+            print(
+                f"[INDEX] Warning: {missing} of {len(ids)} vectors of user {user_id} are not in the "
+                f"embedding cache; reconstructing them from the compressed shard (lossy)."
+            )
+        return embeddings.export_vectors(index, start, exact=exact)
+
+    # --- Access ---
+    def allocate_ids(self, count: int) -> np.ndarray:
+        """Reserves `count` consecutive global FAISS ids."""
+        self._check_writable()
+        # The next free id is only known once load() has seen the chunks table
+        self.wait_loaded()
+        with self._id_lock:
+            start = self._next_id
+            self._next_id += count
+        return np.arange(start, start + count, dtype="int64")
+
+    def _get_shard(self, user_id: int, wait: bool = True) -> _Shard:
+        if wait:
+            self.wait_loaded()
+        with self._shards_lock:
+            shard = self._shards.get(user_id)
+            if shard is None:
+                shard = self._open_shard(user_id)
+                self._shards[user_id] = shard
+            return shard
+
+    def _open_shard(self, user_id: int, generation: Optional[int] = None) -> _Shard:
+        if generation is None:
+            generation = self._read_manifest()["shards"].get(str(user_id), 0)
+        path, tombstones_path = self._shard_files(user_id, generation)
+        if path is None:
+            return _Shard(embeddings.create_embeddings_index(), generation=generation)
+        tombstones = embeddings.load_tombstones(tombstones_path)
+        return _Shard(embeddings.load_index(path, mmap=self.read_only), tombstones, generation)
+
+    def _shard_files(self, user_id: int, generation: int) -> Tuple[Optional[str], Optional[str]]:
+        """
+        The index and tombstone files of a user's published generation, falling back to
+        the fixed names of shards saved before files were generation-named. (None, None)
+        for a shard that was never saved.
+        """
+        if generation:
+            path = embeddings.shard_path(user_id, self.directory, generation)
+            if os.path.exists(path):
+                return path, embeddings.tombstones_path(user_id, self.directory, generation)
+        path = embeddings.shard_path(user_id, self.directory)
+        if os.path.exists(path):
+            return path, embeddings.tombstones_path(user_id, self.directory)
+        if generation:
+            raise FileNotFoundError(f"FAISS shard for user {user_id}, generation {generation}, is missing")
+        return None, None
+
+    @contextmanager
+    def read(self, user_id: int):
+        """
+        Yields the user's sub-index for read-only use, e.g. reconstructing vectors.
+        It may still hold deleted ids; use `search` to query it.
+        """
+        shard = self._get_shard(user_id)
+        shard.lock.acquire_read()
+        try:
+            yield shard.index
+        finally:
+            shard.lock.release_read()
+
+    def _check_writable(self):
+        if self.read_only:
+            raise ReadOnlyIndex("This process serves a read-only index; changes are made by the index writer")
+
+    @contextmanager
+    def write(self, user_id: int, background_rebuild: bool = True):
+        """
+        Yields the user's sub-index for mutation and schedules a background save afterwards.
+        A shard that has outgrown its index type is rebuilt in the background unless
+        `background_rebuild` is False (the caller then runs `rebuild_shard` itself).
+        """
+        self._check_writable()
+        shard = self._get_shard(user_id)
+        shard.lock.acquire_write()
+        before = shard.index.ntotal
+        try:
+            yield shard.index
+        finally:
+            shard.changes += 1
+            metrics.VECTORS_INDEXED.inc(shard.index.ntotal - before)
+            shard.lock.release_write()
+            self._mark_dirty(user_id)
+        if background_rebuild and (embeddings.needs_rebuild(shard.index) or shard.needs_compaction()):
+            self._rebuild_in_background(user_id)
+
+    def search(self, user_id: int, query_vectors, k: int, nprobe=None, ef_search=None):
+        """
+        Searches the user's shard, skipping deleted vectors.
+        Returns FAISS's (distances, ids) arrays, or None if the shard has no live vectors.
+        """
+        shard = self._get_shard(user_id)
+        shard.lock.acquire_read()
+        try:
+            if shard.live_count() <= 0:
+                return None
+            return embeddings.search_index(
+                shard.index, query_vectors, k, nprobe=nprobe, ef_search=ef_search, selector=shard.selector,
+            )
+        finally:
+            shard.lock.release_read()
+
+    def remove(self, user_id: int, ids: Iterable[int]):
+        """
+        Deletes vectors from the user's shard. They stop matching searches immediately;
+        the space is reclaimed by a background compaction once enough have piled up.
+        """
+        self._check_writable()
+        ids = [int(i) for i in ids]
+        if not ids:
+            return
+        shard = self._get_shard(user_id)
+        shard.lock.acquire_write()
+        try:
+            before = len(shard.tombstones)
+            # Ids whose vectors never reached the shard (e.g. a failed job) need no tombstone
+            shard.tombstones.update(embeddings.stored_ids(shard.index, ids))
+            shard._refresh_selector()
+            shard.changes += 1
+            metrics.VECTORS_REMOVED.inc(len(shard.tombstones) - before)
+        finally:
+            shard.lock.release_write()
+        self._mark_dirty(user_id)
+        if shard.needs_compaction():
+            self._rebuild_in_background(user_id)
+
+    def index_type(self, user_id: int) -> str:
+        """Which of embeddings.INDEX_TYPES the user's shard currently is."""
+        return embeddings.index_type_of(self._get_shard(user_id).index)
+
+    def tombstone_count(self, user_id: int) -> int:
+        return len(self._get_shard(user_id).tombstones)
+
+    def needs_rebuild(self, user_id: int) -> bool:
+        """True if the shard should be trained into FAISS_INDEX_TYPE or compacted."""
+        shard = self._get_shard(user_id)
+        return embeddings.needs_rebuild(shard.index) or shard.needs_compaction()
+
+    # --- Rebuilds and compaction ---
+    def user_ids(self):
+        """Ids of every user with a shard in memory."""
+        with self._shards_lock:
+            return list(self._shards)
+
+    def _rebuild_in_background(self, user_id: int):
+        with self._state_lock:
+            if user_id in self._rebuilding:
+                return
+            self._rebuilding.add(user_id)
+
+        def run():
+            try:
+                self.rebuild_shard(user_id)
+            except Exception as e:
+                print(f"[INDEX] Error rebuilding FAISS shard for user {user_id}: {e}")
+            finally:
+                with self._state_lock:
+                    self._rebuilding.discard(user_id)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    @metrics.span("faiss_rebuild")
+    def rebuild_shard(self, user_id: int, index_type: Optional[str] = None) -> str:
+        """
+        Rebuilds a user's shard into `index_type` (default: FAISS_INDEX_TYPE), dropping
+        deleted vectors on the way (compaction). Returns the type actually built, which
+        is flat for shards below FAISS_TRAIN_MIN_VECTORS.
+
+        Training runs on a snapshot while searches continue on the old shard; the
+        exclusive lock is only taken to copy over late additions and swap the index in.
+        """
+        self._check_writable()
+        shard = self._get_shard(user_id)
+        shard.lock.acquire_read()
+        try:
+            ids, vectors = self._export(user_id, shard.index)
+            dropped = set(shard.tombstones)
+        finally:
+            shard.lock.release_read()
+
+        snapshot_size = len(ids)
+        if dropped:
+            keep = ~np.isin(ids, np.fromiter(dropped, dtype="int64", count=len(dropped)))
+            ids, vectors = ids[keep], vectors[keep]
+        new_index = embeddings.create_embeddings_index(vectors, ids, index_type=index_type)
+
+        shard.lock.acquire_write()
+        try:
+            # The stored index is append-only, so anything past the snapshot was added during training
+            late_ids, late_vectors = self._export(user_id, shard.index, start=snapshot_size)
+            if len(late_ids):
+                new_index.add_with_ids(late_vectors, late_ids)
+            shard.index = new_index
+            # Deletions made during the rebuild still apply to the new index
+            shard.tombstones -= dropped
+            shard._refresh_selector()
+            shard.changes += 1
+        finally:
+            shard.lock.release_write()
+        self._mark_dirty(user_id)
+        built = embeddings.index_type_of(new_index)
+        print(
+            f"[INDEX] Rebuilt FAISS shard for user {user_id} as {built} "
+            f"({new_index.ntotal} vectors, {len(dropped)} deleted vectors dropped)"
+        )
+        return built
+
+    # --- Persistence ---
+    def _mark_dirty(self, user_id: int):
+        with self._state_lock:
+            self._dirty.add(user_id)
+            if self._timer is None:
+                self._timer = threading.Timer(self.persist_delay, self._persist_from_timer)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def when_persisted(self, user_id: int, callback: Callable[[], None]):
+        """
+        Calls `callback` (on the saving thread) once the user's shard, including every
+        change made to it so far, has been written to disk.
+        """
+        with self._state_lock:
+            self._persist_callbacks.setdefault(user_id, []).append(callback)
+        self._mark_dirty(user_id)
+
+    def _persist_from_timer(self):
+        with self._state_lock:
+            self._timer = None
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"[INDEX] Error saving FAISS index in background: {e}")
+
+    def flush(self):
+        """
+        Writes every shard with unsaved changes to disk as a new generation. Each shard
+        and its tombstones go to files named after that generation, and the manifest is
+        written last, so a reader sees either the old pair of files or the new one.
+        """
+        with self._state_lock:
+            dirty, self._dirty = self._dirty, set()
+            # Callbacks registered from here on wait for the next save
+            callbacks = {user_id: self._persist_callbacks.pop(user_id) for user_id in dirty
+                         if user_id in self._persist_callbacks}
+        if not dirty:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+
+        failed = set()
+        snapshot_changes = {}
+        with self._publish_lock:
+            manifest = self._read_manifest()
+            generation = max(manifest["generation"], self._generation) + 1
+            for user_id in dirty:
+                shard = self._get_shard(user_id)
+                # A shared lock is enough: searches keep running while the snapshot is written.
+                shard.lock.acquire_read()
+                try:
+                    snapshot_changes[user_id] = shard.changes
+                    embeddings.save_index(shard.index, embeddings.shard_path(user_id, self.directory, generation))
+                    embeddings.save_tombstones(shard.tombstones,
+                                               embeddings.tombstones_path(user_id, self.directory, generation))
+                except Exception as e:
+                    print(f"[INDEX] Error saving FAISS shard for user {user_id}: {e}")
+                    failed.add(user_id)
+                finally:
+                    shard.lock.release_read()
+
+            saved = dirty - failed
+            if saved:
+                previous = {user_id: manifest["shards"].get(str(user_id), 0) for user_id in saved}
+                self._publish(manifest, generation, saved, snapshot_changes)
+                self._remove_old_files(generation, previous)
+        for user_id in saved:
+            for callback in callbacks.get(user_id, ()):
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"[INDEX] Error after saving FAISS shard for user {user_id}: {e}")
+        if failed:
+            with self._state_lock:
+                self._dirty |= failed
+                for user_id in failed:
+                    self._persist_callbacks[user_id] = callbacks.get(user_id, []) + self._persist_callbacks.get(user_id, [])
+            raise RuntimeError(f"Failed to save FAISS shards for users {sorted(failed)}")
+
+    # --- Snapshot generations ---
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST_NAME)
+
+    def _read_manifest(self) -> Dict:
+        try:
+            with open(self._manifest_path(), encoding="utf-8") as f:
+                manifest = json.load(f)
+            return {"generation": int(manifest.get("generation", 0)), "shards": dict(manifest.get("shards", {}))}
+        except (FileNotFoundError, ValueError):
+            return {"generation": 0, "shards": {}}
+
+    def _publish(self, manifest: Dict, generation: int, user_ids: Set[int], snapshot_changes: Dict[int, int]):
+        """
+        Records `generation` for the shards just saved to its files, so readers reload them.
+        `snapshot_changes` is each shard's change count when it was saved.
+        """
+        for user_id in user_ids:
+            manifest["shards"][str(user_id)] = generation
+        manifest["generation"] = generation
+        tmp_path = f"{self._manifest_path()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._manifest_path())
+        for user_id in user_ids:
+            shard = self._get_shard(user_id)
+            shard.generation, shard.published_changes = generation, snapshot_changes[user_id]
+        self._generation = generation
+
+    def _remove_old_files(self, generation: int, previous: Dict[int, int]):
+        """
+        Deletes the files of generations older than the one each shard just replaced.
+        The replaced generation is kept, since a reader may have read the old manifest
+        and not opened its files yet; readers that already mapped a file keep it anyway.
+        """
+        for name in os.listdir(self.directory):
+            parsed = embeddings.parse_shard_file(name)
+            if parsed is None or parsed[0] not in previous:
+                continue
+            user_id, file_generation = parsed
+            if file_generation == generation:
+                continue
+            if file_generation == previous[user_id] and file_generation:
+                continue
+            if file_generation is None and not os.path.exists(
+                embeddings.shard_path(user_id, self.directory, previous[user_id])
+            ):
+                continue  # the fixed-name files are what the previous generation points at
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError as e:
+                print(f"[INDEX] Warning: could not remove old shard file {name}: {e}")
+
+    def generation(self, user_id: Optional[int] = None) -> int:
+        """The snapshot generation of a user's shard, or of the whole index."""
+        if user_id is None:
+            return self._generation
+        return self._get_shard(user_id).generation
+
+    def cache_token(self, user_id: int) -> Optional[str]:
+        """
+        Identifies the contents of a user's shard by its published generation, which every
+        process reads from the same manifest. None while the shard has changes that are not
+        published yet (writer side), since no generation describes its contents then.
+        """
+        shard = self._get_shard(user_id)
+        if shard.changes != shard.published_changes:
+            return None
+        return str(shard.generation)
+
+    def refresh(self):
+        """Reader side: swaps in every loaded shard that has a newer published generation."""
+        manifest = self._read_manifest()
+        if manifest["generation"] == self._generation:
+            return
+        with self._shards_lock:
+            loaded = dict(self._shards)
+        complete = True
+        for user_id, shard in loaded.items():
+            published = manifest["shards"].get(str(user_id), 0)
+            if published <= shard.generation:
+                continue
+            try:
+                fresh = self._open_shard(user_id, published)
+            except Exception as e:
+                # Retried on the next refresh; the shard keeps serving its current snapshot
+                print(f"[INDEX] Error loading generation {published} of the FAISS shard for user {user_id}: {e}")
+                complete = False
+                continue
+            shard.lock.acquire_write()
+            try:
+                shard.index, shard.tombstones, shard.generation = fresh.index, fresh.tombstones, published
+                shard._refresh_selector()
+            finally:
+                shard.lock.release_write()
+        if complete:
+            self._generation = manifest["generation"]
+
+    def _refresh_loop(self):
+        while not self._refresh_stop.wait(self.refresh_seconds):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"[INDEX] Error refreshing FAISS shards: {e}")
+
+
+# --- Process-wide instance ---
+index_manager = IndexManager()
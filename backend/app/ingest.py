@@ -0,0 +1,521 @@
+import functools
+import json
+import os
+import queue
+import shutil
+import threading
+import uuid
+from dataclasses import asdict
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import update
+
+from . import embeddings, lexical, metrics, models, storage, text_store, utils
+from .db import SessionLocal
+from .index_manager import index_manager
+
+# --- Pipeline Settings ---
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        print(f"[INGEST] Warning: {name} is not a valid integer. Using default ({default}).")
+        return default
+
+# Intermediate results of each stage are kept here until the job finishes
+WORK_DIR = os.getenv("INGEST_WORK_DIR", "ingest_jobs")
+# Jobs waiting in front of each stage; a full queue blocks the stage feeding it
+QUEUE_SIZE = _env_int("INGEST_QUEUE_SIZE", 8)
+# /upload is rejected with 503 once this many jobs are waiting to start
+MAX_PENDING_JOBS = _env_int("INGEST_MAX_PENDING_JOBS", 100)
+EXTRACT_WORKERS = _env_int("INGEST_EXTRACT_WORKERS", 2)
+EMBED_WORKERS = _env_int("INGEST_EMBED_WORKERS", 2)
+INDEX_WORKERS = _env_int("INGEST_INDEX_WORKERS", 1)
+# Chunks read, embedded and inserted at a time, so memory does not grow with the document
+STREAM_BATCH_SIZE = _env_int("INGEST_STREAM_BATCH_SIZE", 256)
+POLL_SECONDS = 1.0
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+def job_dir(job_id: str) -> str:
+    return os.path.join(WORK_DIR, job_id)
+
+
+def _write_atomic(path: str, mode: str, write: Callable):
+    """Writes via a temporary file so a crash never leaves a half-written artifact."""
+    # Unique per writer, so two writers of the same artifact never share a temp file
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, mode, **({} if "b" in mode else {"encoding": "utf-8"})) as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+class StageSkipped(Exception):
+    """Raised by a stage to finish a job early without an error (e.g. no text)."""
+
+
+# --- Stages ---
+# Each stage reads the previous stage's artifact, writes its own, and advances job.stage.
+# The caller commits the job row, so an artifact always exists for a recorded stage.
+# index_stage is the exception: the job only becomes "indexed" once its vectors are saved.
+
+def _iter_jsonl(path: str):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def _batched(iterable, size: int):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def extract_stage(session, job: models.IngestJob):
+    """Extracts pages and chunks them as they arrive, writing text.txt and chunks.jsonl."""
+    os.makedirs(job_dir(job.id), exist_ok=True)
+    text_path = os.path.join(job_dir(job.id), "text.txt")
+    chunks_path = os.path.join(job_dir(job.id), "chunks.jsonl")
+    n_chunks = 0
+    wrote_any = has_text = False
+
+    def tee_pages(text_file):
+        nonlocal wrote_any, has_text
+        # Pages are extracted in parallel and handed to the chunker as they arrive
+        for page_number, page_text in utils.iter_text_pages(job.path, job.filename):
+            if page_text:
+                text_file.write(("\n" if wrote_any else "") + page_text)
+                wrote_any = True
+                has_text = has_text or bool(page_text.strip())
+            yield page_number, page_text
+
+    with open(f"{text_path}.tmp", "w", encoding="utf-8") as text_file, \
+            open(f"{chunks_path}.tmp", "w", encoding="utf-8") as chunks_file:
+        for record in embeddings.iter_chunks(tee_pages(text_file)):
+            chunks_file.write(json.dumps(asdict(record)) + "\n")
+            n_chunks += 1
+    os.replace(f"{text_path}.tmp", text_path)
+    os.replace(f"{chunks_path}.tmp", chunks_path)
+
+    if not has_text:
+        raise StageSkipped("File saved but no text extracted")
+    job.chunks = n_chunks
+    job.stage = "chunked"
+
+
+def embed_stage(session, job: models.IngestJob):
+    """Embeds chunks.jsonl a batch at a time into vectors.f32 (raw float32 rows)."""
+    chunks_path = os.path.join(job_dir(job.id), "chunks.jsonl")
+    vectors_path = os.path.join(job_dir(job.id), "vectors.f32")
+
+    def write_vectors(f):
+        for batch in _batched(_iter_jsonl(chunks_path), STREAM_BATCH_SIZE):
+            vectors = embeddings.embed_texts([record["text"] for record in batch])
+            f.write(np.ascontiguousarray(vectors, dtype="float32").tobytes())
+
+    _write_atomic(vectors_path, "wb", write_vectors)
+    job.stage = "embedded"
+
+
+def index_stage(session, job: models.IngestJob):
+    """
+    Creates the Document (its text compressed into the text store) and its Chunk rows,
+    then adds the vectors to the user's shard. The job is finished (see
+    finish_indexed_job) once the shard has been saved.
+    """
+    text_path = os.path.join(job_dir(job.id), "text.txt")
+    chunks_path = os.path.join(job_dir(job.id), "chunks.jsonl")
+    vectors_path = os.path.join(job_dir(job.id), "vectors.f32")
+    count = job.chunks or 0
+
+    if job.doc_id is not None:
+        # Committed by an attempt that was interrupted: the rows keep their ids, and only
+        # the vectors that did not reach the saved shard are added again.
+        ids = np.array([
+            i for (i,) in session.query(models.Chunk.faiss_index_id)
+            .filter(models.Chunk.doc_id == job.doc_id)
+            .order_by(models.Chunk.faiss_index_id)
+        ], dtype="int64")
+        with index_manager.read(job.user_id) as index:
+            missing = ~np.isin(ids, embeddings.index_ids(index))
+    else:
+        doc = models.Document(user_id=job.user_id, filename=job.filename, content_hash=job.content_hash)
+        session.add(doc)
+        session.flush()
+        text_store.put_file(doc.id, text_path)
+        job.doc_id = doc.id
+        ids = index_manager.allocate_ids(count)
+        missing = np.ones(count, dtype=bool)
+        offset = 0
+        for batch in _batched(_iter_jsonl(chunks_path), STREAM_BATCH_SIZE):
+            session.bulk_insert_mappings(models.Chunk, [
+                {
+                    "faiss_index_id": int(faiss_id),
+                    "doc_id": job.doc_id,
+                    "user_id": job.user_id,
+                    "content": record["text"],
+                    "page": record["page"],
+                    "start_offset": record["start_offset"],
+                    "end_offset": record["end_offset"],
+                    "token_count": record["token_count"],
+                }
+                for faiss_id, record in zip(ids[offset:offset + len(batch)], batch)
+            ])
+            offset += len(batch)
+        lexical.index_document(session, job.user_id, job.doc_id)
+        # The document and its rows are committed together, before the vectors are added,
+        # so the user's shard never holds an id that search cannot resolve.
+        session.commit()
+
+    if count:
+        vectors = np.memmap(vectors_path, dtype="float32", mode="r").reshape(-1, embeddings.DIM)
+        for start in range(0, count, STREAM_BATCH_SIZE):
+            end = min(start + STREAM_BATCH_SIZE, count)
+            todo = missing[start:end]
+            if not todo.any():
+                continue
+            batch = np.array(vectors[start:end])[todo]
+            # The exclusive lock is only held while adding, so searches never wait on SQL
+            with index_manager.write(job.user_id) as index:
+                index.add_with_ids(batch, ids[start:end][todo])
+        del vectors
+
+    # Until the shard is on disk the vectors only exist in memory; the job stays running
+    # (and resumes here after a crash) and keeps its artifacts until then.
+    index_manager.when_persisted(job.user_id, functools.partial(finish_indexed_job, job.id))
+    # The new version is searchable now, so the one it replaces can go
+    if job.replaces_doc_id is not None:
+        try:
+            retire_replaced(session, job.user_id, job.replaces_doc_id, keep_doc_id=job.doc_id)
+        except Exception as e:
+            session.rollback()
+            print(f"[INGEST] Job {job.id} indexed, but replaced document {job.replaces_doc_id} was not deleted: {e}")
+
+
+def finish_indexed_job(job_id: str):
+    """Marks an indexed job done and deletes its artifacts, once its vectors are saved."""
+    with SessionLocal() as session:
+        session.execute(
+            update(models.IngestJob)
+            .where(models.IngestJob.id == job_id, models.IngestJob.status == "running")
+            .values(stage="indexed", status="done")
+        )
+        session.commit()
+    shutil.rmtree(job_dir(job_id), ignore_errors=True)
+
+
+def find_indexed_copy(session, content_hash: str, user_id: int) -> Optional[models.Document]:
+    """
+    Returns an already-indexed document with this content, preferring the user's own copy.
+    """
+    candidates = (
+        session.query(models.Document)
+        .filter(models.Document.content_hash == content_hash, models.Document.chunks.any())
+        .order_by((models.Document.user_id == user_id).desc(), models.Document.id)
+    )
+    return candidates.first()
+
+
+def link_document(session, source: models.Document, user_id: int, filename: str) -> Tuple[models.Document, int]:
+    """
+    Gives `user_id` their own copy of an indexed document without re-extracting or
+    re-embedding it: the Chunk rows are copied with new FAISS ids, and the vectors come
+    from the embedding cache (or the source owner's shard for any it no longer holds).
+    Returns the new document and its chunk count.
+    """
+    chunks = (
+        session.query(models.Chunk)
+        .filter(models.Chunk.doc_id == source.id)
+        .order_by(models.Chunk.faiss_index_id)
+        .all()
+    )
+    # Full-precision vectors from the embedding cache; the source shard may be compressed
+    vectors = embeddings.embedding_cache.get_many([c.content for c in chunks])
+    missing = sum(vector is None for vector in vectors)
+    if missing:
+        print(f"[INGEST] Warning: {missing} of {len(chunks)} vectors of document {source.id} are not in the "
+              f"embedding cache; reconstructing them from user {source.user_id}'s shard (lossy if compressed).")
+        with index_manager.read(source.user_id) as src:
+            vectors = [src.reconstruct(c.faiss_index_id) if vector is None else vector
+                       for c, vector in zip(chunks, vectors)]
+    vectors = np.vstack(vectors).astype("float32")
+
+    doc = models.Document(user_id=user_id, filename=filename, content_hash=source.content_hash)
+    session.add(doc)
+    session.flush()
+    if not text_store.copy(source.id, doc.id):
+        doc.text = source.text  # legacy document whose text is still in its row
+
+    ids = index_manager.allocate_ids(len(chunks))
+    session.bulk_insert_mappings(models.Chunk, [
+        {
+            "faiss_index_id": int(faiss_id),
+            "doc_id": doc.id,
+            "user_id": user_id,
+            "content": c.content,
+            "page": c.page,
+            "start_offset": c.start_offset,
+            "end_offset": c.end_offset,
+            "token_count": c.token_count,
+        }
+        for faiss_id, c in zip(ids, chunks)
+    ])
+    lexical.index_document(session, user_id, doc.id)
+    # Rows first, as in index_stage; the shard is only locked for the add itself
+    session.commit()
+    with index_manager.write(user_id) as index:
+        index.add_with_ids(vectors, ids)
+    return doc, len(chunks)
+
+
+def _content_in_use(session, content_hash: str) -> bool:
+    """True while a document or an unfinished job still needs the stored file."""
+    if session.query(models.Document.id).filter(models.Document.content_hash == content_hash).first():
+        return True
+    return session.query(models.IngestJob.id).filter(
+        models.IngestJob.content_hash == content_hash,
+        models.IngestJob.status.in_(("queued", "running")),
+    ).first() is not None
+
+
+def delete_document(session, doc: models.Document) -> int:
+    """
+    Deletes a document and its Chunk rows, then removes its vectors from the owner's
+    shard (see IndexManager.remove). The stored upload is deleted as well once nothing
+    else uses its content. Returns the number of chunks deleted.
+    """
+    doc_id, user_id, content_hash = doc.id, doc.user_id, doc.content_hash
+    faiss_ids = [i for (i,) in session.query(models.Chunk.faiss_index_id).filter(models.Chunk.doc_id == doc_id)]
+
+    # Rows go first, so a search never resolves a vector whose chunk is being deleted
+    lexical.unindex_document(session, user_id, doc_id)
+    session.query(models.Chunk).filter(models.Chunk.doc_id == doc_id).delete(synchronize_session=False)
+    session.query(models.IngestJob).filter(models.IngestJob.doc_id == doc_id).update(
+        {"doc_id": None}, synchronize_session=False
+    )
+    session.query(models.Document).filter(models.Document.id == doc_id).delete(synchronize_session=False)
+    if index_manager.read_only:
+        # The index writer applies these (see apply_index_removals)
+        session.bulk_insert_mappings(models.IndexRemoval, [
+            {"user_id": user_id, "faiss_index_id": int(i)} for i in faiss_ids
+        ])
+    session.commit()
+    if not index_manager.read_only:
+        index_manager.remove(user_id, faiss_ids)
+    text_store.delete(doc_id)
+
+    if content_hash and not _content_in_use(session, content_hash):
+        storage.remove_content(content_hash)
+    return len(faiss_ids)
+
+
+def apply_index_removals(session, limit: int = 10000) -> int:
+    """Writer side: removes vectors queued by read-only processes. Returns how many were applied."""
+    rows = session.query(models.IndexRemoval).order_by(models.IndexRemoval.id).limit(limit).all()
+    if not rows:
+        return 0
+    by_user = {}
+    for row in rows:
+        by_user.setdefault(row.user_id, []).append(row.faiss_index_id)
+    for user_id, faiss_ids in by_user.items():
+        index_manager.remove(user_id, faiss_ids)
+    session.query(models.IndexRemoval).filter(models.IndexRemoval.id <= rows[-1].id).delete(synchronize_session=False)
+    session.commit()
+    return len(rows)
+
+
+def retire_replaced(session, user_id: int, old_doc_id: int, keep_doc_id: Optional[int] = None):
+    """Deletes the user's document `old_doc_id` after a replacement for it was indexed."""
+    old = session.get(models.Document, old_doc_id)
+    if old is not None and old.user_id == user_id and old.id != keep_doc_id:
+        delete_document(session, old)
+
+
+# The stage that runs next for a job, keyed by the last stage it completed
+STAGES = [
+    ("saved", extract_stage, EXTRACT_WORKERS),
+    ("chunked", embed_stage, EMBED_WORKERS),
+    ("embedded", index_stage, INDEX_WORKERS),
+]
+
+
+class IngestPipeline:
+    """
+    Runs uploads through extract+chunk -> embed -> index on background threads.
+
+    Jobs are persisted as IngestJob rows. A feeder thread claims queued jobs and hands
+    them to the stage after their last completed one, so jobs interrupted by a restart
+    resume where they stopped. Each stage has its own worker threads and a bounded
+    queue; when a later stage falls behind, the earlier ones block instead of piling
+    up work in memory. The feeder also applies index removals queued by read-only
+    serving workers, so whichever process runs the pipeline is the index writer.
+    """
+
+    def __init__(self, stages=STAGES, queue_size: int = QUEUE_SIZE):
+        self._stages = stages
+        self._queues: List[queue.Queue] = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self._next_stage = {completed: i for i, (completed, _, _) in enumerate(stages)}
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    # --- Lifecycle ---
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        # Anything left "running" belongs to a previous process that died mid-job
+        with SessionLocal() as session:
+            session.execute(
+                update(models.IngestJob)
+                .where(models.IngestJob.status == "running")
+                .values(status="queued")
+            )
+            session.commit()
+
+        self._spawn(self._feed, "ingest-feeder")
+        for i, (completed, func, workers) in enumerate(self._stages):
+            for n in range(max(1, workers)):
+                self._spawn(self._work, f"ingest-{func.__name__}-{n}", i)
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _spawn(self, target, name, *args):
+        thread = threading.Thread(target=target, args=args, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def notify(self):
+        """Wakes the feeder after a new job has been committed."""
+        self._wakeup.set()
+
+    # --- Feeding and running ---
+    def _put(self, stage_index: int, job_id: str) -> bool:
+        """Blocking put that gives up when the pipeline is stopping."""
+        while not self._stop.is_set():
+            try:
+                self._queues[stage_index].put(job_id, timeout=POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _claim_next(self) -> Optional[Tuple[str, str]]:
+        """Marks the oldest queued job as running and returns its (id, stage)."""
+        with SessionLocal() as session:
+            candidates = (
+                session.query(models.IngestJob.id)
+                .filter(models.IngestJob.status == "queued")
+                .order_by(models.IngestJob.created_at)
+                .limit(10)
+                .all()
+            )
+            for (job_id,) in candidates:
+                # Conditional update, so two feeders can never claim the same job
+                claimed = session.execute(
+                    update(models.IngestJob)
+                    .where(models.IngestJob.id == job_id, models.IngestJob.status == "queued")
+                    .values(status="running")
+                ).rowcount
+                session.commit()
+                if claimed:
+                    return job_id, session.get(models.IngestJob, job_id).stage
+        return None
+
+    def _feed(self):
+        while not self._stop.is_set():
+            try:
+                with SessionLocal() as session:
+                    apply_index_removals(session)
+            except Exception as e:
+                print(f"[INGEST] Error applying queued index removals: {e}")
+            try:
+                claimed = self._claim_next()
+            except Exception as e:
+                print(f"[INGEST] Error claiming jobs: {e}")
+                claimed = None
+            if claimed is None:
+                self._wakeup.wait(POLL_SECONDS)
+                self._wakeup.clear()
+                continue
+
+            job_id, stage = claimed
+            stage_index = self._next_stage.get(stage)
+            if stage_index is None:
+                self._fail(job_id, f"Unknown stage '{stage}'")
+                continue
+            self._put(stage_index, job_id)
+
+    def _work(self, stage_index: int):
+        _, func, _ = self._stages[stage_index]
+        while not self._stop.is_set():
+            try:
+                job_id = self._queues[stage_index].get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                continue
+
+            advanced = False
+            with SessionLocal() as session:
+                job = session.get(models.IngestJob, job_id)
+                if job is None:
+                    continue
+                try:
+                    with metrics.span(func.__name__):
+                        func(session, job)
+                    with metrics.span("db_commit"):
+                        session.commit()
+                    advanced = job.status == "running"
+                except StageSkipped as e:
+                    session.rollback()
+                    job.status, job.chunks, job.error = "done", 0, str(e)
+                    session.commit()
+                    shutil.rmtree(job_dir(job.id), ignore_errors=True)
+                except Exception as e:
+                    session.rollback()
+                    print(f"[INGEST] Job {job_id} failed in {func.__name__}: {e}")
+                    self._fail(job_id, str(e))
+
+            if advanced and stage_index + 1 < len(self._stages):
+                self._put(stage_index + 1, job_id)
+
+    def _fail(self, job_id: str, error: str):
+        with SessionLocal() as session:
+            session.execute(
+                update(models.IngestJob)
+                .where(models.IngestJob.id == job_id)
+                .values(status="failed", error=error)
+            )
+            session.commit()
+            # A job that failed while indexing leaves no half-indexed document behind
+            job = session.get(models.IngestJob, job_id)
+            doc = session.get(models.Document, job.doc_id) if job is not None and job.doc_id is not None else None
+            if doc is not None:
+                try:
+                    delete_document(session, doc)
+                except Exception as e:
+                    session.rollback()
+                    print(f"[INGEST] Could not remove document {doc.id} of failed job {job_id}: {e}")
+
+    # --- Introspection ---
+    def pending_jobs(self) -> int:
+        """Number of jobs accepted but not yet started."""
+        with SessionLocal() as session:
+            return session.query(models.IngestJob).filter(models.IngestJob.status == "queued").count()
+
+
+# --- Process-wide instance ---
+pipeline = IngestPipeline()
@@ -0,0 +1,27 @@
+import importlib
+import sys
+import types
+
+# --- Deferred Imports ---
+# Heavy libraries (faiss, pdfplumber, python-docx) are imported on first use instead of
+# when the app is imported, so workers start answering requests sooner.
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stands in for a module until one of its attributes is first used, then imports it.
+
+    The import goes through importlib, whose per-module lock makes a first use from
+    several threads at once safe. The real module's namespace is then copied in, so
+    later lookups are plain attribute reads.
+    """
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """The module `name` if it is already imported, otherwise a LazyModule for it."""
+    return sys.modules.get(name) or LazyModule(name)
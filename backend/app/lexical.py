@@ -0,0 +1,175 @@
+import os
+import re
+import threading
+from typing import Dict, List, Sequence, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from . import metrics
+
+# --- Lexical (BM25) Index ---
+# One SQLite FTS5 table per user over that user's chunks.content. Each is an
+# external-content table, so the text is stored once (in chunks). A MATCH only walks the
+# user's own postings, and bm25() scores against the user's own document count and term
+# frequencies, so other tenants' data neither slows nor skews a user's results.
+# Writers call index_document / unindex_document in the transaction that inserts or
+# deletes a document's Chunk rows.
+FTS_TABLE_PREFIX = "chunks_fts_u"
+# Shared table (and its triggers) used before the index was split per user
+_LEGACY_TABLE = "chunks_fts"
+_LEGACY_TRIGGERS = ("chunks_fts_insert", "chunks_fts_delete", "chunks_fts_update")
+
+try:
+    # Candidates taken from each ranked list before fusion in hybrid mode
+    HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", 50))
+    # Reciprocal-rank fusion constant: score = sum(1 / (RRF_K + rank))
+    RRF_K = int(os.getenv("RRF_K", 60))
+except ValueError:
+    HYBRID_CANDIDATES, RRF_K = 50, 60
+    print("[LEXICAL] Warning: HYBRID_CANDIDATES / RRF_K are not valid integers. Using defaults (50, 60).")
+
+_available = False
+# Users whose FTS table has been seen committed, so searches skip the catalog lookup
+_tables: Set[int] = set()
+_tables_lock = threading.Lock()
+
+
+def available() -> bool:
+    """True once ensure_index() has checked that this database supports FTS5."""
+    return _available
+
+
+def table_for(user_id: int) -> str:
+    return f"{FTS_TABLE_PREFIX}{int(user_id)}"
+
+
+def _create_table(conn, user_id: int) -> bool:
+    """Creates the user's FTS table if missing. Returns True if it was created."""
+    table = table_for(user_id)
+    exists = conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": table}
+    ).first()
+    if not exists:
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5("
+            f"content, content='chunks', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+        ))
+    return not exists
+
+
+def _has_table(conn, user_id: int) -> bool:
+    with _tables_lock:
+        if user_id in _tables:
+            return True
+    found = conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": table_for(user_id)}
+    ).first() is not None
+    if found:
+        with _tables_lock:
+            _tables.add(user_id)
+    return found
+
+
+def ensure_index(engine) -> bool:
+    """
+    Checks that the database supports FTS5 and creates the FTS table of every user with
+    chunks, indexing their existing chunks. A database still using the shared table is
+    migrated to per-user tables. Returns False (and lexical search stays disabled) when
+    the database is not SQLite or was built without FTS5.
+    """
+    global _available
+    if engine.dialect.name != "sqlite":
+        print(f"[LEXICAL] Lexical search needs SQLite FTS5; disabled on {engine.dialect.name}.")
+        return False
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS temp.fts5_probe USING fts5(content)"))
+            conn.execute(text("DROP TABLE temp.fts5_probe"))
+            for trigger in _LEGACY_TRIGGERS:
+                conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+            conn.execute(text(f"DROP TABLE IF EXISTS {_LEGACY_TABLE}"))
+            user_ids = [u for (u,) in conn.execute(text("SELECT DISTINCT user_id FROM chunks"))]
+            for user_id in user_ids:
+                if _create_table(conn, user_id):
+                    # Backfill chunks that were stored before the user's table existed
+                    table = table_for(user_id)
+                    conn.execute(
+                        text(f"INSERT INTO {table}(rowid, content) SELECT id, content FROM chunks WHERE user_id = :user_id"),
+                        {"user_id": user_id},
+                    )
+    except Exception as e:
+        print(f"[LEXICAL] Warning: could not create the FTS5 index ({e}). Lexical search disabled.")
+        return False
+    _available = True
+    return True
+
+
+def index_document(db: Session, user_id: int, doc_id: int):
+    """Adds the document's Chunk rows to the user's FTS table. Call after inserting them."""
+    if not _available:
+        return
+    _create_table(db, user_id)
+    db.execute(
+        text(f"INSERT INTO {table_for(user_id)}(rowid, content) SELECT id, content FROM chunks WHERE doc_id = :doc_id"),
+        {"doc_id": doc_id},
+    )
+
+
+def unindex_document(db: Session, user_id: int, doc_id: int):
+    """Removes the document's Chunk rows from the user's FTS table. Call before deleting them."""
+    if not _available or not _has_table(db, user_id):
+        return
+    table = table_for(user_id)
+    db.execute(
+        text(f"INSERT INTO {table}({table}, rowid, content) SELECT 'delete', id, content FROM chunks WHERE doc_id = :doc_id"),
+        {"doc_id": doc_id},
+    )
+
+
+_TERM = re.compile(r"\S+")
+
+
+def to_match_query(query: str) -> str:
+    """
+    Turns free text into an FTS5 MATCH expression. Each whitespace-separated term is
+    quoted, so operators and punctuation in the query are taken literally (a term like
+    "IL-6" becomes the phrase "IL 6"), and terms are OR-ed so BM25 ranks partial matches.
+    """
+    terms = ['"' + term.replace('"', '""') + '"' for term in _TERM.findall(query)]
+    return " OR ".join(terms)
+
+
+def search(db: Session, user_id: int, query: str, k: int) -> List[Tuple[int, float]]:
+    """
+    Returns up to k of the user's chunks as (faiss_index_id, score), best first.
+    The score is the negated FTS5 bm25() value, so higher is better.
+    """
+    match = to_match_query(query)
+    if not _available or not match or not _has_table(db, user_id):
+        return []
+    table = table_for(user_id)
+    with metrics.span("lexical_search"):
+        # The top k are ranked inside the FTS table first; only they are joined to chunks
+        rows = db.execute(
+            text(
+                f"SELECT c.faiss_index_id, hits.rank FROM ("
+                f"SELECT rowid, rank FROM {table} WHERE {table} MATCH :match ORDER BY rank LIMIT :k"
+                f") AS hits JOIN chunks AS c ON c.id = hits.rowid ORDER BY hits.rank"
+            ),
+            {"match": match, "k": k},
+        ).all()
+    return [(int(faiss_id), -float(rank)) for faiss_id, rank in rows]
+
+
+def reciprocal_rank_fusion(ranked_lists: Sequence[Sequence[int]], k: int, rrf_k: int = RRF_K) -> List[Tuple[int, float]]:
+    """
+    Fuses several best-first lists of ids into one, scoring each id by
+    sum(1 / (rrf_k + rank)) over the lists it appears in. Returns the top k (id, score).
+    """
+    scores: Dict[int, float] = {}
+    for ranked in ranked_lists:
+        for rank, item in enumerate(ranked, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (rrf_k + rank)
+    fused = sorted(scores.items(), key=lambda pair: pair[1], reverse=True)
+    return fused[:k]
@@ -1,27 +1,57 @@
 import os
-import shutil
+import threading
 import numpy as np
-from fastapi import FastAPI, Depends, File, UploadFile, HTTPException, Header
+from fastapi import FastAPI, Depends, File, UploadFile, HTTPException, Header, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 from dotenv import load_dotenv
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
+from typing import List, Literal, Optional
 
 # --- Load environment variables ---
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 # --- Import project modules ---
-from . import db, models, auth, utils, embeddings # Assuming these are configured
-from .db import SessionLocal, engine
+from . import db, models, schemas, auth, embeddings, ingest, lexical, metrics, storage, text_store # Assuming these are configured
+from .db import SessionLocal, engine, ensure_columns, get_db
+from .index_manager import IndexNotReady, index_manager
+from .result_cache import result_cache
 
-# --- Initialize DB ---
-models.Base.metadata.create_all(bind=engine)
+# Every SQL statement is timed as the db_query stage (see /metrics)
+metrics.instrument_engine(engine)
+
+# --- Startup ---
+# Importing this module does no I/O: the schema is created in a startup hook, and the FAISS
+# shards are loaded on a background thread while the server already answers / and /health.
+# Index calls made before the load finishes wait for it (503 after INDEX_LOAD_WAIT_SECONDS).
+# STARTUP_WARMUP=blocking restores loading everything before the first request.
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "background").lower()
+if STARTUP_WARMUP not in ("background", "blocking"):
+    print(f"[STARTUP] Warning: unknown STARTUP_WARMUP '{STARTUP_WARMUP}'. Using 'background'.")
+    STARTUP_WARMUP = "background"
+
+def init_database():
+    """
+    Creates missing tables, adds columns introduced since an existing database was
+    created, and sets up the per-user BM25 indexes over chunk text.
+    """
+    models.Base.metadata.create_all(bind=engine)
+    ensure_columns(engine)
+    lexical.ensure_index(engine)
 
 # --- Create FastAPI app ---
 app = FastAPI(title="Smart Research Hub", version="1.0")
 
+# --- Upload size limit ---
+# Refuses oversized multipart bodies while they arrive, before the form is parsed.
+# Added before CORS so the 413 still carries CORS headers.
+app.add_middleware(storage.UploadLimitMiddleware)
+
 # --- ✅ Enable CORS ---
 app.add_middleware(
     CORSMiddleware,
@@ -32,41 +62,141 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
-# --- File upload directory ---
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# --- Metrics ---
+# Request latency per route, per-stage timing spans and counters, exposed at /metrics.
+# Responses carry a Server-Timing header when SERVER_TIMING=1 or the request sends X-Server-Timing.
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.CallbackGauge("index_shards_loaded", "FAISS shards held in memory.", lambda: len(index_manager.user_ids()))
+metrics.CallbackGauge("index_generation", "Latest published snapshot generation.", lambda: index_manager.generation())
+metrics.CallbackGauge("search_result_cache_entries", "Entries in this worker's search result cache.",
+                      lambda: result_cache.stats()["entries"])
+
+@app.get("/metrics", include_in_schema=False)
+def read_metrics():
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# --- FAISS index lifecycle ---
+# The index is loaded once per process and kept in memory; changes are saved in the background.
+# With INDEX_MODE=reader (multi-worker serving) the shards are memory-mapped read-only and
+# refreshed from the snapshots published by the index writer (python -m app.manage index-writer).
+def cached_chunk_vectors(user_id: int, faiss_ids) -> dict:
+    """Vector source for shard rebuilds: full-precision vectors from the embedding cache."""
+    with SessionLocal() as session:
+        return full_precision_vectors(session, user_id, faiss_ids)
 
-# --- Database dependency ---
-def get_db():
-    db_session = SessionLocal()
+def load_faiss_index():
+    index_manager.set_vector_source(cached_chunk_vectors)
+    with SessionLocal() as session:
+        max_id = session.query(func.max(models.Chunk.faiss_index_id)).scalar()
+        index_manager.load(max_assigned_id=max_id)
+
+        # One-time split of the old global index into per-user shards
+        if not index_manager.read_only and os.path.exists(embeddings.INDEX_PATH):
+            owners = session.query(models.Chunk.faiss_index_id, models.Chunk.user_id).all()
+            index_manager.migrate_legacy(embeddings.INDEX_PATH, owners)
+
+# --- Ingestion pipeline lifecycle ---
+# Uploads are processed on background workers; jobs interrupted by a restart resume here.
+def start_ingest_pipeline():
+    # Read-only workers only queue jobs; the index writer process runs them
+    if not index_manager.read_only:
+        ingest.pipeline.start()
+
+def warm_up():
+    """Loads the shards, then starts the pipeline (which needs them)."""
     try:
-        yield db_session
-    finally:
-        db_session.close()
+        load_faiss_index()
+        start_ingest_pipeline()
+    except Exception as e:
+        print(f"[STARTUP] Error loading the FAISS index: {e}")
+        if STARTUP_WARMUP == "blocking":
+            raise
+
+@app.on_event("startup")
+def start_up():
+    init_database()
+    if STARTUP_WARMUP == "blocking":
+        warm_up()
+        return
+    index_manager.mark_loading()
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+@app.on_event("shutdown")
+def stop_ingest_pipeline():
+    ingest.pipeline.stop()
+
+@app.on_event("shutdown")
+def save_faiss_index():
+    index_manager.close()
+
+@app.on_event("shutdown")
+def stop_password_hasher():
+    auth.password_hasher.shutdown()
+
+# --- File upload directory ---
+os.makedirs(storage.UPLOAD_DIR, exist_ok=True)
 
 # --- Pydantic models for frontend validation ---
 class UserCreateModel(BaseModel):
     email: EmailStr
     password: str
 
+SEARCH_MODES = ("semantic", "lexical", "hybrid")
+SEARCH_MODE = os.getenv("SEARCH_MODE", "semantic").lower()
+if SEARCH_MODE not in SEARCH_MODES:
+    print(f"[SEARCH] Warning: unknown SEARCH_MODE '{SEARCH_MODE}'. Using 'semantic'.")
+    SEARCH_MODE = "semantic"
+
 class SearchQueryModel(BaseModel):
     query: str
+    # semantic: FAISS only; lexical: BM25 only (no embedding call); hybrid: both, fused by rank
+    mode: Literal["semantic", "lexical", "hybrid"] = SEARCH_MODE
+    # Optional per-query accuracy/speed knobs for approximate indexes
+    nprobe: Optional[int] = Field(None, ge=1)
+    ef_search: Optional[int] = Field(None, ge=1)
+
+# --- Health checks ---
+@app.exception_handler(IndexNotReady)
+def index_not_ready(request: Request, exc: IndexNotReady):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "5"})
+
+@app.get("/health", include_in_schema=False)
+def health():
+    """Liveness: the process is up, whether or not the index has finished loading."""
+    return {"status": "ok", "index": "ready" if index_manager.loaded else "loading"}
+
+@app.get("/ready", include_in_schema=False)
+def ready():
+    """Readiness: 503 until the FAISS shards are loaded."""
+    if not index_manager.loaded:
+        raise HTTPException(status_code=503, detail="The search index is still loading", headers={"Retry-After": "5"})
+    return {"status": "ready"}
 
 # --- Root route ---
 @app.get("/")
 def root():
     return {"message": "✅ Smart Research Hub Backend is running!"}
 
-# --- Register user (No change needed) ---
-@app.post("/register")
-def register(u: UserCreateModel, db: Session = Depends(get_db)):
-    if len(u.password) < 6:
-        raise HTTPException(status_code=422, detail="Password must be at least 6 characters")
+# --- Password hashing ---
+# bcrypt runs on auth.password_hasher's process pool; a saturated pool answers 429 immediately.
+async def run_password_hasher(fn, *args):
+    try:
+        return await fn(*args)
+    except auth.PasswordHasherBusy:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many login attempts in progress. Please retry shortly.",
+            headers={"Retry-After": "1"},
+        )
 
-    hashed = auth.hash_password(u.password)
-    new_user = models.User(email=u.email, hashed_password=hashed)
+# --- Register user ---
+def create_user(db: Session, email: str, hashed: str) -> models.User:
+    new_user = models.User(email=email, hashed_password=hashed)
     db.add(new_user)
     try:
         db.commit()
@@ -74,110 +204,497 @@ def register(u: UserCreateModel, db: Session = Depends(get_db)):
     except IntegrityError:
         db.rollback()
         raise HTTPException(status_code=422, detail="Email already registered")
+    return new_user
+
+@app.post("/register")
+async def register(u: UserCreateModel, db: Session = Depends(get_db)):
+    if len(u.password) < 6:
+        raise HTTPException(status_code=422, detail="Password must be at least 6 characters")
+
+    hashed = await run_password_hasher(auth.password_hasher.hash, u.password)
+    new_user = await run_in_threadpool(create_user, db, u.email, hashed)
 
     token = auth.create_access_token({"sub": new_user.email, "id": new_user.id})
     return {"access_token": token, "token_type": "bearer"}
 
-# --- Login user (No change needed) ---
+# --- Login user ---
+def find_user_by_email(db: Session, email: str) -> Optional[models.User]:
+    return db.query(models.User).filter(models.User.email == email).first()
+
+def store_upgraded_hash(db: Session, user: models.User, new_hash: str):
+    user.hashed_password = new_hash
+    db.commit()
+
 @app.post("/login")
-def login(u: UserCreateModel, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == u.email).first()
-    if not user or not auth.verify_password(u.password, user.hashed_password):
+async def login(u: UserCreateModel, db: Session = Depends(get_db)):
+    user = await run_in_threadpool(find_user_by_email, db, u.email)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+
+    valid, new_hash = await run_password_hasher(auth.password_hasher.verify_and_update, u.password, user.hashed_password)
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        # The stored hash used an older bcrypt cost; replace it while we have the plaintext
+        await run_in_threadpool(store_upgraded_hash, db, user, new_hash)
+
     token = auth.create_access_token({"sub": user.email, "id": user.id})
     return {"access_token": token, "token_type": "bearer"}
 
-# --- Auth helper (No change needed) ---
-def get_current_user(authorization: str = Header(None), db: Session = Depends(get_db)):
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Missing auth header")
-    token = authorization.split(" ")[1] if " " in authorization else authorization
-    payload = auth.decode_token(token)
-    if not payload:
-        raise HTTPException(status_code=401, detail="Invalid token")
+# --- Auth helper ---
+def get_current_user(authorization: str = Header(None), db: Session = Depends(get_db)) -> auth.AuthenticatedUser:
+    """
+    Resolves the bearer token to the user's id and email.
+    Verified tokens are cached (see auth.TokenCache), so repeat calls skip both the
+    JWT decode and the database; the session is only used on a cache miss.
+    """
+    with metrics.span("auth"):
+        if not authorization:
+            raise HTTPException(status_code=401, detail="Missing auth header")
+        token = authorization.split(" ")[1] if " " in authorization else authorization
 
-    user = db.query(models.User).filter(models.User.email == payload.get("sub")).first()
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
-    return user
+        cached = auth.token_cache.get(token)
+        if cached is not None:
+            return cached
+
+        payload = auth.decode_token(token)
+        if not payload:
+            raise HTTPException(status_code=401, detail="Invalid token")
+
+        # Primary-key lookup on the "id" claim; older tokens without it fall back to the email
+        user_id = payload.get("id")
+        if user_id is not None:
+            user = db.get(models.User, user_id)
+        else:
+            user = db.query(models.User).filter(models.User.email == payload.get("sub")).first()
+        if not user or user.email != payload.get("sub"):
+            raise HTTPException(status_code=401, detail="User not found")
+
+        identity = auth.AuthenticatedUser(id=user.id, email=user.email)
+        auth.token_cache.put(token, identity, payload.get("exp"))
+        return identity
+
+# --- Upload file ---
+# The file is streamed to disk without blocking the event loop (see storage.save_upload).
+# Extraction, chunking, embedding and indexing happen later in the ingestion pipeline.
+def accept_upload(db: Session, user_id: int, filename: str, content_hash: str, path: str,
+                  replaces_doc_id: Optional[int] = None):
+    """
+    Records a stored upload. Content that is already indexed is reused instead of
+    reprocessed; anything else is queued for the ingestion pipeline. With
+    `replaces_doc_id`, that document is deleted once the new content is indexed.
+    """
+    job = models.IngestJob(
+        id=ingest.new_job_id(), user_id=user_id, filename=filename,
+        path=path, content_hash=content_hash, status="queued", stage="saved",
+        replaces_doc_id=replaces_doc_id,
+    )
+
+    source = ingest.find_indexed_copy(db, content_hash, user_id)
+    if source is not None and source.user_id != user_id and index_manager.read_only:
+        source = None  # linking writes to the index; the writer's pipeline reprocesses it (cached embeddings)
+    if source is not None and source.user_id == user_id:
+        if replaces_doc_id is not None:
+            ingest.retire_replaced(db, user_id, replaces_doc_id, keep_doc_id=source.id)
+        return {"message": "Already uploaded and indexed", "doc_id": source.id, "status": "done"}
+    if source is not None:
+        try:
+            doc, n_chunks = ingest.link_document(db, source, user_id, filename)
+            job.doc_id, job.chunks, job.status, job.stage = doc.id, n_chunks, "done", "indexed"
+        except Exception as e:
+            db.rollback()
+            print(f"[UPLOAD] Could not reuse document {source.id}, processing the upload instead: {e}")
+
+    db.add(job)
+    db.commit()
+    if job.status == "queued":
+        ingest.pipeline.notify()
+        return {"message": "Upload accepted for indexing", "job_id": job.id, "status": job.status}
+    if replaces_doc_id is not None:
+        ingest.retire_replaced(db, user_id, replaces_doc_id, keep_doc_id=job.doc_id)
+    return {"message": "Identical file already indexed; linked to your documents", "job_id": job.id, "doc_id": job.doc_id, "status": job.status}
+
+async def receive_upload(response: Response, file: UploadFile, user, db: Session,
+                         replaces_doc_id: Optional[int] = None):
+    # Oversized request bodies were already refused by UploadLimitMiddleware
+    if await run_in_threadpool(ingest.pipeline.pending_jobs) >= ingest.MAX_PENDING_JOBS:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many uploads waiting to be processed. Please retry shortly.",
+            headers={"Retry-After": "30"},
+        )
+
+    try:
+        with metrics.span("upload_save"):
+            content_hash, save_path = await storage.save_upload(file)
+    except storage.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    with metrics.span("upload_accept"):
+        result = await run_in_threadpool(accept_upload, db, user.id, file.filename, content_hash, save_path, replaces_doc_id)
+    if result["status"] == "done":
+        response.status_code = 200
+    return result
 
-# --- Upload file (No change needed) ---
-@app.post("/upload")
+@app.post("/upload", status_code=202)
 async def upload_file(
+    response: Response,
     file: UploadFile = File(...),
     user=Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    save_path = os.path.join(UPLOAD_DIR, file.filename)
-    with open(save_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
+    return await receive_upload(response, file, user, db)
 
-    text = utils.extract_text(save_path, file.filename)
-    if not text.strip():
-        return {"message": "File saved but no text extracted"}
+# --- Replace and delete documents ---
+def get_owned_document(db: Session, user_id: int, doc_id: int) -> models.Document:
+    doc = db.get(models.Document, doc_id)
+    if not doc or doc.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return doc
 
-    doc = models.Document(user_id=user.id, filename=file.filename, text=text)
-    db.add(doc)
-    db.commit()
-    db.refresh(doc)
-
-    chunks = embeddings.chunk_text(text)
-    vectors = embeddings.embed_texts(chunks)
-    index = embeddings.load_index()
-    
-    # 💡 NOTE: The logic to add the chunk vectors to FAISS is here.
-    # A complete solution requires saving the mapping (FAISS index ID -> Document ID -> Chunk Text)
-    # to the database right here.
-    index.add(np.array(vectors).astype("float32")) 
-    embeddings.save_index(index)
-
-    return {"message": "Uploaded and indexed", "doc_id": doc.id, "chunks": len(chunks)}
-
-# --- Search (Fixed) ---
-@app.post("/search")
+@app.put("/documents/{doc_id}", status_code=202)
+async def replace_document(
+    doc_id: int,
+    response: Response,
+    file: UploadFile = File(...),
+    user=Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Uploads a new version of a document; the old one stays searchable until the new one is indexed."""
+    await run_in_threadpool(get_owned_document, db, user.id, doc_id)
+    return await receive_upload(response, file, user, db, replaces_doc_id=doc_id)
+
+@app.delete("/documents/{doc_id}")
+def delete_document(doc_id: int, user=Depends(get_current_user), db: Session = Depends(get_db)):
+    doc = get_owned_document(db, user.id, doc_id)
+    # Cached results move on once the writer publishes the removal (see ResultCache)
+    n_chunks = ingest.delete_document(db, doc)
+    return {"message": "Document deleted", "doc_id": doc_id, "chunks": n_chunks}
+
+# --- Browse documents ---
+# Listings are paginated and never load document text or whole chunks, so a response
+# is bounded by the page size rather than by the size of the documents.
+DOCUMENT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+CHUNK_PREVIEW_CHARS = 200
+
+def count_chunks(db: Session, doc_ids) -> dict:
+    rows = (
+        db.query(models.Chunk.doc_id, func.count(models.Chunk.id))
+        .filter(models.Chunk.doc_id.in_(list(doc_ids)))
+        .group_by(models.Chunk.doc_id)
+        .all()
+    )
+    return dict(rows)
+
+def chunk_summaries(db: Session, doc_id: int, limit: int, offset: int):
+    rows = (
+        db.query(
+            models.Chunk.id, models.Chunk.faiss_index_id, models.Chunk.page,
+            models.Chunk.start_offset, models.Chunk.end_offset, models.Chunk.token_count,
+            func.substr(models.Chunk.content, 1, CHUNK_PREVIEW_CHARS),
+        )
+        .filter(models.Chunk.doc_id == doc_id)
+        .order_by(models.Chunk.id)
+        .limit(limit)
+        .offset(offset)
+        .all()
+    )
+    return [
+        schemas.ChunkSummary(
+            id=chunk_id, faiss_index_id=faiss_id, page=page, start_offset=start,
+            end_offset=end, token_count=tokens, preview=preview,
+        )
+        for chunk_id, faiss_id, page, start, end, tokens, preview in rows
+    ]
+
+@app.get("/documents", response_model=schemas.DocumentPage)
+def list_documents(
+    limit: int = Query(DOCUMENT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    user=Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    owned = db.query(models.Document).filter(models.Document.user_id == user.id)
+    rows = (
+        db.query(models.Document.id, models.Document.filename, models.Document.content_hash, models.Document.created_at)
+        .filter(models.Document.user_id == user.id)
+        .order_by(models.Document.id.desc())
+        .limit(limit)
+        .offset(offset)
+        .all()
+    )
+    counts = count_chunks(db, [row.id for row in rows])
+    items = [
+        schemas.DocumentSummary(
+            id=row.id, filename=row.filename, content_hash=row.content_hash,
+            created_at=row.created_at, chunk_count=counts.get(row.id, 0),
+        )
+        for row in rows
+    ]
+    return schemas.DocumentPage(total=owned.count(), limit=limit, offset=offset, items=items)
+
+@app.get("/documents/{doc_id}", response_model=schemas.DocumentRead)
+def read_document(
+    doc_id: int,
+    chunk_limit: int = Query(DOCUMENT_PAGE_SIZE, ge=0, le=MAX_PAGE_SIZE),
+    chunk_offset: int = Query(0, ge=0),
+    user=Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """A document with one page of chunk summaries; more via /documents/{id}/chunks."""
+    doc = get_owned_document(db, user.id, doc_id)
+    return schemas.DocumentRead(
+        id=doc.id, user_id=doc.user_id, filename=doc.filename, content_hash=doc.content_hash,
+        created_at=doc.created_at, chunk_count=count_chunks(db, [doc.id]).get(doc.id, 0),
+        chunks=chunk_summaries(db, doc.id, chunk_limit, chunk_offset) if chunk_limit else [],
+    )
+
+@app.get("/documents/{doc_id}/chunks", response_model=schemas.ChunkPage)
+def list_document_chunks(
+    doc_id: int,
+    limit: int = Query(DOCUMENT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    user=Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    doc = get_owned_document(db, user.id, doc_id)
+    return schemas.ChunkPage(
+        total=count_chunks(db, [doc.id]).get(doc.id, 0), limit=limit, offset=offset,
+        items=chunk_summaries(db, doc.id, limit, offset),
+    )
+
+@app.get("/documents/{doc_id}/text")
+def read_document_text(doc_id: int, user=Depends(get_current_user), db: Session = Depends(get_db)):
+    """Streams the document's full text from the compressed text store."""
+    doc = get_owned_document(db, user.id, doc_id)
+    if text_store.exists(doc.id):
+        return StreamingResponse(text_store.iter_text(doc.id), media_type="text/plain; charset=utf-8")
+    # Documents stored before the text store still carry their text in the row
+    if doc.text is None:
+        raise HTTPException(status_code=404, detail="No text stored for this document")
+    return PlainTextResponse(doc.text)
+
+# --- Ingestion job status ---
+@app.get("/jobs/{job_id}", response_model=schemas.IngestJobRead)
+def get_job(job_id: str, user=Depends(get_current_user), db: Session = Depends(get_db)):
+    job = db.get(models.IngestJob, job_id)
+    if not job or job.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+def resolve_search_hits_many(db: Session, user_id: int, ranked):
+    """
+    Maps the FAISS ids of several ranked lists, given as (ids, scores) pairs, to their
+    chunk text and document with a single query. Each list keeps its rank order, and
+    hits that do not belong to the user are dropped.
+    """
+    wanted = {int(i) for ids, _ in ranked for i in ids if i >= 0}
+    if not wanted:
+        return [[] for _ in ranked]
+
+    rows = (
+        db.query(models.Chunk, models.Document.filename)
+        .join(models.Document, models.Chunk.doc_id == models.Document.id)
+        .filter(models.Chunk.faiss_index_id.in_(wanted), models.Chunk.user_id == user_id)
+        .all()
+    )
+    by_id = {chunk.faiss_index_id: (chunk, filename) for chunk, filename in rows}
+
+    all_results = []
+    for index_ids, scores in ranked:
+        results = []
+        for idx, score in zip(index_ids, scores):
+            row = by_id.get(int(idx))
+            if row is None:
+                continue
+            chunk, filename = row
+            results.append(schemas.SearchResultItem(
+                index_id=int(idx),
+                similarity_score=float(score),
+                text_snippet=chunk.content,
+                document_id=chunk.doc_id,
+                document_filename=filename,
+                page=chunk.page,
+                start_offset=chunk.start_offset,
+                end_offset=chunk.end_offset,
+            ))
+        all_results.append(results)
+    return all_results
+
+def resolve_search_hits(db: Session, user_id: int, index_ids, distances):
+    """Single-list form of resolve_search_hits_many."""
+    return resolve_search_hits_many(db, user_id, [(index_ids, distances)])[0]
+
+# --- Search ---
+SEARCH_K = 5
+
+def full_precision_vectors(db: Session, user_id: int, faiss_ids) -> dict:
+    """
+    float32 vectors for the given chunks, looked up in the embedding cache by chunk text.
+    Chunks whose vector is not cached are left out.
+    """
+    faiss_ids = [int(i) for i in faiss_ids]
+    found = {}
+    # Batched, so a whole shard stays under SQLite's bound-parameter limit
+    for start in range(0, len(faiss_ids), 10000):
+        rows = (
+            db.query(models.Chunk.faiss_index_id, models.Chunk.content)
+            .filter(models.Chunk.faiss_index_id.in_(faiss_ids[start:start + 10000]), models.Chunk.user_id == user_id)
+            .all()
+        )
+        vectors = embeddings.embedding_cache.get_many([content for _, content in rows])
+        found.update((faiss_id, vector) for (faiss_id, _), vector in zip(rows, vectors) if vector is not None)
+    return found
+
+def semantic_search_many(db: Session, queries, user_id: int, k: int, nprobe=None, ef_search=None):
+    """
+    Embeds the queries in one batch and runs one FAISS search over the stacked vectors.
+    Returns one (ids, distances) pair per query, best first.
+
+    On compressed shards RERANK_FACTOR * k candidates are fetched and re-ranked
+    with exact distances (see embeddings.rerank_exact).
+    """
+    with metrics.span("embed_query"):
+        embs = embeddings.embed_queries(queries) if len(queries) > 1 else embeddings.embed_query(queries[0])
+    rerank = embeddings.RERANK_FACTOR > 1 and index_manager.index_type(user_id) in embeddings.COMPRESSED_INDEX_TYPES
+    fetch_k = k * embeddings.RERANK_FACTOR if rerank else k
+    # Only the caller's own shard is scanned, so all k hits are theirs
+    found = index_manager.search(user_id, embs, fetch_k, nprobe=nprobe, ef_search=ef_search)
+    if found is None:
+        return [([], []) for _ in queries]
+    D, I = found
+
+    ranked = []
+    for row_ids, row_dists in zip(I.tolist(), D.tolist()):
+        hits = [(int(i), float(d)) for i, d in zip(row_ids, row_dists) if i >= 0]
+        ranked.append(([i for i, _ in hits], [d for _, d in hits]))
+
+    if rerank:
+        with metrics.span("rerank"):
+            full = full_precision_vectors(db, user_id, {i for ids, _ in ranked for i in ids})
+            query_vectors = np.asarray(embs, dtype="float32").reshape(len(queries), -1)
+            ranked = [
+                embeddings.rerank_exact(query_vector, ids, dists, full, k)
+                for query_vector, (ids, dists) in zip(query_vectors, ranked)
+            ]
+    return ranked
+
+def rank_queries(db: Session, user_id: int, queries, mode: str, nprobe=None, ef_search=None):
+    """
+    Ranks candidates for each query in the given mode; returns (ids, scores) per query.
+    Lexical mode never calls the embedding API.
+    """
+    if mode == "semantic":
+        return semantic_search_many(db, queries, user_id, SEARCH_K, nprobe, ef_search)
+    if mode == "lexical":
+        ranked = []
+        for query in queries:
+            hits = lexical.search(db, user_id, query, SEARCH_K)
+            ranked.append(([i for i, _ in hits], [s for _, s in hits]))
+        return ranked
+
+    semantic = semantic_search_many(db, queries, user_id, lexical.HYBRID_CANDIDATES, nprobe, ef_search)
+    ranked = []
+    for query, (semantic_ids, _) in zip(queries, semantic):
+        lexical_ids = [i for i, _ in lexical.search(db, user_id, query, lexical.HYBRID_CANDIDATES)]
+        fused = lexical.reciprocal_rank_fusion([semantic_ids, lexical_ids], SEARCH_K)
+        ranked.append(([i for i, _ in fused], [s for _, s in fused]))
+    return ranked
+
+def search_cache_key(user_id: int, query_text: str, mode: str, nprobe=None, ef_search=None) -> Optional[str]:
+    """Cache key for one query; it changes whenever the user's shard does (uploads, deletes, rebuilds)."""
+    return result_cache.make_key(
+        user_id, query_text, index_manager.cache_token(user_id),
+        mode=mode, k=SEARCH_K, nprobe=nprobe, ef_search=ef_search,
+    )
+
+@app.post("/search", response_model=schemas.SearchResponse)
 def search(q: SearchQueryModel, user=Depends(get_current_user), db: Session = Depends(get_db)):
     query_text = q.query
     if not query_text.strip():
         raise HTTPException(status_code=422, detail="Query cannot be empty")
+    if q.mode != "semantic" and not lexical.available():
+        raise HTTPException(status_code=422, detail="Lexical search is not available on this server")
+
+    # 0. Repeated searches are answered from the result cache, without embedding or scanning
+    with metrics.span("search_cache"):
+        cache_key = search_cache_key(user.id, query_text, q.mode, q.nprobe, q.ef_search)
+        cached = result_cache.get(cache_key)
+    if cached is not None:
+        return schemas.SearchResponse.model_validate_json(cached).model_copy(update={"query": query_text})
+
+    # 1. Rank candidates
+    ranked = rank_queries(db, user.id, [query_text], q.mode, q.nprobe, q.ef_search)
+
+    # 2. Map the FAISS ids back to chunk text and documents in one round trip
+    with metrics.span("resolve_hits"):
+        final_results = resolve_search_hits_many(db, user.id, ranked)[0]
+    response = schemas.SearchResponse(query=query_text, mode=q.mode, total_matches=len(final_results), results=final_results)
+    result_cache.put(cache_key, response.model_dump_json())
+    return response
+
+@app.get("/search/cache")
+def search_cache_stats(user=Depends(get_current_user)):
+    """Hit/miss counters of this worker's search result cache."""
+    return result_cache.stats()
+
+# --- Batch search ---
+# Queries are processed in groups of SEARCH_BATCH_GROUP: one batched embedding call, one
+# matrix FAISS search and one chunk fetch per group. Each group's results are streamed
+# back as NDJSON lines as soon as it finishes.
+try:
+    SEARCH_BATCH_MAX = int(os.getenv("SEARCH_BATCH_MAX", 5000))
+    SEARCH_BATCH_GROUP = max(1, int(os.getenv("SEARCH_BATCH_GROUP", 256)))
+except ValueError:
+    SEARCH_BATCH_MAX, SEARCH_BATCH_GROUP = 5000, 256
+    print("[SEARCH] Warning: SEARCH_BATCH_MAX / SEARCH_BATCH_GROUP are not valid integers. Using defaults.")
+
+class BatchSearchQueryModel(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=SEARCH_BATCH_MAX)
+    mode: Literal["semantic", "lexical", "hybrid"] = SEARCH_MODE
+    nprobe: Optional[int] = Field(None, ge=1)
+    ef_search: Optional[int] = Field(None, ge=1)
+
+def iter_batch_search(q: BatchSearchQueryModel, user_id: int):
+    # Uses its own session: the response body is produced after the request's dependencies
+    with SessionLocal() as session:
+        for start in range(0, len(q.queries), SEARCH_BATCH_GROUP):
+            group = q.queries[start:start + SEARCH_BATCH_GROUP]
+            keys = [search_cache_key(user_id, query_text, q.mode, q.nprobe, q.ef_search) for query_text in group]
+            results_by_offset = {}
+            for offset, key in enumerate(keys):
+                cached = result_cache.get(key)
+                if cached is not None:
+                    results_by_offset[offset] = schemas.SearchResponse.model_validate_json(cached).results
+
+            # Only the queries the cache could not answer are embedded and searched
+            missing = [offset for offset in range(len(group)) if offset not in results_by_offset]
+            if missing:
+                ranked = rank_queries(session, user_id, [group[i] for i in missing], q.mode, q.nprobe, q.ef_search)
+                for offset, results in zip(missing, resolve_search_hits_many(session, user_id, ranked)):
+                    results_by_offset[offset] = results
+                    response = schemas.SearchResponse(
+                        query=group[offset], mode=q.mode, total_matches=len(results), results=results,
+                    )
+                    result_cache.put(keys[offset], response.model_dump_json())
+
+            for offset, query_text in enumerate(group):
+                results = results_by_offset[offset]
+                line = schemas.BatchSearchResult(
+                    position=start + offset, query=query_text, mode=q.mode,
+                    total_matches=len(results), results=results,
+                )
+                yield line.model_dump_json() + "\n"
 
-    emb = embeddings.embeddings_client.embed_query(query_text)
-    index = embeddings.load_index()
-    if index.ntotal == 0:
-        return {"results": []}
-
-    # 1. Perform FAISS search
-    D, I = index.search(np.array([np.array(emb).astype("float32")]), k=5)
-    index_ids = I[0].tolist()
-    distances = D[0].tolist()
-
-    # 2. Logic to map the index IDs back to actual content
-    # Since we don't have the external mapping table, we will use a placeholder.
-    # In a real app, you would query your mapping table here:
-    # chunk_details = db.query(models.Chunk).filter(models.Chunk.faiss_id.in_(index_ids)).all()
-    
-    # 3. Filter by user's documents and build final results
-    final_results = []
-    
-    # Simulate retrieving and filtering results (This is where the logic needs to be)
-    # Placeholder Logic: Assuming we have a way to retrieve the text and doc_id for each index_id
-    for idx, dist in zip(index_ids, distances):
-        # 💡 PLACEHOLDER: Replace this with your actual database lookup function
-        # For homework, this demonstrates the *intent* of the final output.
-        doc_id_placeholder = (idx % 2) + 1 # Assign a mock doc ID for demonstration
-        
-        # In a real application, you would check if the doc_id_placeholder belongs to the current user
-        # user_document_check = db.query(models.Document).filter(models.Document.id == doc_id_placeholder, models.Document.user_id == user.id).first()
-        
-        # if user_document_check:
-        final_results.append({
-            "index_id": int(idx),
-            "similarity_score": float(dist),
-            "text_snippet": f"Retrieved text snippet for index {idx}. (Simulated Doc ID: {doc_id_placeholder})",
-            # "document_filename": user_document_check.filename
-        })
-
-    # The search result structure is now much more useful for the frontend
-    return {"query": query_text, "total_matches": len(final_results), "results": final_results}
+@app.post("/search/batch")
+def search_batch(q: BatchSearchQueryModel, user=Depends(get_current_user)):
+    """Runs many queries in one call; returns one schemas.BatchSearchResult per line (NDJSON), in input order."""
+    if any(not query.strip() for query in q.queries):
+        raise HTTPException(status_code=422, detail="Queries cannot be empty")
+    if q.mode != "semantic" and not lexical.available():
+        raise HTTPException(status_code=422, detail="Lexical search is not available on this server")
+    return StreamingResponse(iter_batch_search(q, user.id), media_type="application/x-ndjson")
 
 # --- Run server ---
 if __name__ == "__main__":
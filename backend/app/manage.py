@@ -0,0 +1,131 @@
+"""
+Maintenance commands for the backend.
+
+Run from the backend directory, e.g.:
+    python -m app.manage rebuild-index --type ivf_flat
+    python -m app.manage bulk-import papers/ --user 1
+    python -m app.manage index-writer
+"""
+import argparse
+import sys
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from . import embeddings
+from .index_manager import index_manager
+
+
+def rebuild_index(args):
+    """Rebuilds every user shard (or one, with --user) into the requested index type."""
+    # Loads the shards and splits a legacy faiss_index.idx first, exactly as the server does
+    from .main import init_database, load_faiss_index
+    init_database()
+    load_faiss_index()
+
+    user_ids = [args.user] if args.user is not None else index_manager.user_ids()
+    kept_flat = []
+    for user_id in user_ids:
+        if index_manager.rebuild_shard(user_id, index_type=args.type) != args.type:
+            kept_flat.append(user_id)
+    index_manager.close()
+    print(f"[MANAGE] Rebuilt {len(user_ids)} shard(s) in {index_manager.directory}")
+    if kept_flat:
+        print(
+            f"[MANAGE] {len(kept_flat)} shard(s) were built as flat, not {args.type}: they hold fewer than "
+            f"FAISS_TRAIN_MIN_VECTORS ({embeddings.TRAIN_MIN_VECTORS}) vectors. Users: "
+            f"{', '.join(map(str, kept_flat))}. Lower FAISS_TRAIN_MIN_VECTORS to build them as {args.type}."
+        )
+
+
+def bulk_import(args):
+    """Imports a directory or manifest of documents for one user (see app.bulk_ingest)."""
+    from .main import init_database, load_faiss_index
+    from .db import SessionLocal
+    from . import bulk_ingest, models
+    init_database()
+    load_faiss_index()
+
+    with SessionLocal() as session:
+        user = session.get(models.User, args.user)
+        if user is None:
+            print(f"[MANAGE] No user with id {args.user}")
+            return 1
+        work_dir = args.work_dir or bulk_ingest.WORK_DIR
+        files = bulk_ingest.discover_files(args.source)
+        print(f"[MANAGE] Importing {len(files)} file(s) for {user.email} (work dir: {work_dir})")
+        importer = bulk_ingest.BulkImporter(
+            user.id, work_dir=work_dir, workers=args.workers, embed_concurrency=args.embed_concurrency,
+        )
+        summary = importer.run(session, files, keep_work=args.keep_work)
+    index_manager.close()
+    print(f"[MANAGE] Imported {summary['documents']} document(s), added {summary['vectors_added']} vectors")
+    if summary["failed"]:
+        print(f"[MANAGE] {summary['failed']} file(s) could not be imported; rerun the same command to retry them")
+        return 1
+    return 0
+
+
+def index_writer(args):
+    """
+    Runs the ingestion pipeline and owns the FAISS shards, publishing snapshots for
+    serving workers started with INDEX_MODE=reader. Stops on Ctrl+C / SIGTERM.
+    """
+    import signal
+    import threading
+    from . import ingest
+    if index_manager.read_only:
+        print("[MANAGE] The index writer cannot run with INDEX_MODE=reader")
+        return 1
+
+    from .main import init_database, load_faiss_index
+    init_database()
+    load_faiss_index()
+    ingest.pipeline.start()
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    print(f"[MANAGE] Index writer running on {index_manager.directory}")
+    try:
+        while not stop.wait(1.0):
+            pass
+    except KeyboardInterrupt:
+        pass
+    ingest.pipeline.stop()
+    index_manager.close()
+    print(f"[MANAGE] Index writer stopped at generation {index_manager.generation()}")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m app.manage", description="Smart Research Hub maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = commands.add_parser("rebuild-index", help="Rebuild FAISS shards into a new index type, dropping deleted vectors")
+    rebuild.add_argument("--type", choices=embeddings.INDEX_TYPES, default=embeddings.INDEX_TYPE,
+                         help="Target index type (default: FAISS_INDEX_TYPE)")
+    rebuild.add_argument("--user", type=int, default=None, help="Only rebuild this user's shard")
+    rebuild.set_defaults(func=rebuild_index)
+
+    bulk = commands.add_parser("bulk-import", help="Import a directory or manifest of documents (stop the server first)")
+    bulk.add_argument("source", help="Directory to walk, or a manifest file with one path per line")
+    bulk.add_argument("--user", type=int, required=True, help="Id of the user who will own the documents")
+    bulk.add_argument("--workers", type=int, default=None, help="Extraction processes (default: CPU count)")
+    bulk.add_argument("--embed-concurrency", type=int, default=4, help="Files embedded at once")
+    bulk.add_argument("--work-dir", default=None, help="Where resumable intermediate results are kept (default: BULK_IMPORT_WORK_DIR)")
+    bulk.add_argument("--keep-work", action="store_true", help="Keep the work directory after a successful import")
+    bulk.set_defaults(func=bulk_import)
+
+    writer = commands.add_parser("index-writer", help="Run ingestion and publish index snapshots for INDEX_MODE=reader workers")
+    writer.set_defaults(func=index_writer)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, func
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, func, event
+from sqlalchemy.orm import deferred, relationship
 from sqlalchemy.schema import UniqueConstraint 
 from .db import Base # 💡 FIX: Import Base from your db.py file
+from . import auth
 
 # Note: The 'Base = declarative_base()' line was removed, as it belongs in db.py
 
@@ -18,13 +19,28 @@ class User(Base):
     chunks = relationship("Chunk", back_populates="user") 
 
 
+# Cached logins must not outlive the account or its old password
+@event.listens_for(User, "after_delete")
+def _invalidate_deleted_user(mapper, connection, target):
+    auth.invalidate_user(target.id)
+
+@event.listens_for(User.hashed_password, "set")
+def _invalidate_changed_password(target, value, oldvalue, initiator):
+    if target.id is not None:
+        auth.invalidate_user(target.id)
+
+
 class Document(Base):
     __tablename__ = "documents"
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     filename = Column(String(512), nullable=False)
-    text = Column(Text, nullable=True) 
+    # Legacy only: new documents keep their full text compressed in text_store. Deferred,
+    # so queries over documents never load it unless asked to.
+    text = deferred(Column(Text, nullable=True))
+    # SHA-256 of the uploaded file; identical uploads reuse existing chunks and vectors
+    content_hash = Column(String(64), nullable=True, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     owner = relationship("User", back_populates="documents")
@@ -45,11 +61,17 @@ class Chunk(Base):
     faiss_index_id = Column(Integer, nullable=False, index=True, unique=True)
     
     # Foreign Keys
-    doc_id = Column(Integer, ForeignKey("documents.id"), nullable=False)
+    doc_id = Column(Integer, ForeignKey("documents.id"), nullable=False, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     
     # The actual text content that was embedded
     content = Column(Text, nullable=False)
+
+    # Provenance: page the chunk starts on and its span in the extracted document text
+    page = Column(Integer, nullable=True)
+    start_offset = Column(Integer, nullable=True)
+    end_offset = Column(Integer, nullable=True)
+    token_count = Column(Integer, nullable=True)
     
     # Relationships for easy navigation
     document = relationship("Document", back_populates="chunks")
@@ -58,4 +80,43 @@ class Chunk(Base):
     __table_args__ = (
         # Ensure the FAISS ID is unique to prevent mapping conflicts
         UniqueConstraint('faiss_index_id', name='uq_faiss_id'),
-    )
\ No newline at end of file
+    )
+
+class IngestJob(Base):
+    """
+    Tracks one upload through the ingestion pipeline.
+    `stage` is the last stage that completed, so an interrupted job resumes after it.
+    """
+    __tablename__ = "ingest_jobs"
+
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    doc_id = Column(Integer, ForeignKey("documents.id"), nullable=True)
+    filename = Column(String(512), nullable=False)
+    path = Column(String(1024), nullable=False)
+    content_hash = Column(String(64), nullable=True)
+    # Document this upload replaces; it is deleted once the new version is indexed
+    replaces_doc_id = Column(Integer, nullable=True)
+
+    # queued -> running -> done | failed
+    status = Column(String(16), nullable=False, default="queued", index=True)
+    # saved -> chunked -> embedded -> indexed
+    stage = Column(String(16), nullable=False, default="saved")
+    chunks = Column(Integer, nullable=True)
+    error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class IndexRemoval(Base):
+    """
+    A vector to delete from a user's shard, queued by a process that cannot change the
+    index itself (a read-only serving worker) and applied by the index writer.
+    """
+    __tablename__ = "index_removals"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    faiss_index_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
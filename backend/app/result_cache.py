@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from . import metrics
+from .embedding_cache import normalize_text
+
+# --- Result Cache Settings ---
+# Serialized search responses kept per process; 0 disables the cache.
+try:
+    RESULT_CACHE_SIZE = int(os.getenv("SEARCH_RESULT_CACHE_SIZE", 4096))
+    RESULT_CACHE_TTL_SECONDS = int(os.getenv("SEARCH_RESULT_CACHE_TTL_SECONDS", 300))
+except ValueError:
+    RESULT_CACHE_SIZE, RESULT_CACHE_TTL_SECONDS = 4096, 300
+    print("[RESULTS] Warning: SEARCH_RESULT_CACHE_SIZE / SEARCH_RESULT_CACHE_TTL_SECONDS are not valid integers. Using defaults.")
+# Optional tier shared by all workers, e.g. redis://localhost:6379/0
+RESULT_CACHE_REDIS_URL = os.getenv("SEARCH_RESULT_CACHE_REDIS_URL", "")
+
+
+def _connect_shared(url: str):
+    """Returns a Redis client for the shared tier, or None if it is not configured or unavailable."""
+    if not url:
+        return None
+    try:
+        import redis
+        client = redis.Redis.from_url(url, socket_timeout=0.05, socket_connect_timeout=0.5)
+        client.ping()
+        return client
+    except Exception as e:
+        print(f"[RESULTS] Warning: shared result cache unavailable ({e}). Using the in-process cache only.")
+        return None
+
+
+class ResultCache:
+    """
+    Caches serialized search responses.
+
+    Keys combine the user, the normalized query, the search parameters and the published
+    generation of the user's shard (IndexManager.cache_token). Every worker reads that
+    generation from the same manifest, so they all compute the same key for the same
+    snapshot, and publishing a change (an upload, a delete, a rebuild) moves every worker
+    to new keys at once; stale entries simply age out. A shard with unpublished changes
+    has no token and its searches are not cached. Entries live in an in-process LRU and,
+    when configured, in a shared Redis tier with a TTL.
+    """
+
+    def __init__(self, size: int = RESULT_CACHE_SIZE, shared_url: str = RESULT_CACHE_REDIS_URL,
+                 ttl_seconds: int = RESULT_CACHE_TTL_SECONDS):
+        self.size = size
+        self.ttl_seconds = ttl_seconds
+        self._local: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Connected on first use, so importing the app never waits on Redis
+        self._shared_url = shared_url if size > 0 else ""
+        self._shared = None
+        self._shared_checked = not self._shared_url
+        self._stats = {"hits": 0, "shared_hits": 0, "misses": 0}
+
+    def make_key(self, user_id: int, query: str, token: Optional[str], **params) -> Optional[str]:
+        """The cache key of a search, or None (not cacheable) when there is no token."""
+        if token is None:
+            return None
+        payload = json.dumps([user_id, normalize_text(query), token, sorted(params.items())], default=str)
+        return "search:" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: Optional[str]) -> Optional[str]:
+        if self.size <= 0 or key is None:
+            return None
+        with self._lock:
+            value = self._local.get(key)
+            if value is not None:
+                self._local.move_to_end(key)
+                self._stats["hits"] += 1
+                metrics.cache_lookup("search_result", hits=1)
+                return value
+
+        if self._shared_client() is not None:
+            try:
+                shared = self._shared.get(key)
+            except Exception:
+                shared = None
+            if shared is not None:
+                value = shared.decode("utf-8")
+                self._remember(key, value)
+                with self._lock:
+                    self._stats["shared_hits"] += 1
+                metrics.cache_lookup("search_result", hits=1)
+                return value
+
+        with self._lock:
+            self._stats["misses"] += 1
+        metrics.cache_lookup("search_result", misses=1)
+        return None
+
+    def put(self, key: Optional[str], value: str):
+        if self.size <= 0 or key is None:
+            return
+        self._remember(key, value)
+        if self._shared_client() is not None:
+            try:
+                self._shared.set(key, value.encode("utf-8"), ex=self.ttl_seconds)
+            except Exception as e:
+                print(f"[RESULTS] Warning: could not write to the shared result cache: {e}")
+
+    def _shared_client(self):
+        if not self._shared_checked:
+            with self._lock:
+                if not self._shared_checked:
+                    self._shared = _connect_shared(self._shared_url)
+                    self._shared_checked = True
+        return self._shared
+
+    def _remember(self, key: str, value: str):
+        with self._lock:
+            self._local[key] = value
+            self._local.move_to_end(key)
+            while len(self._local) > self.size:
+                self._local.popitem(last=False)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._local)
+        lookups = stats["hits"] + stats["shared_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["hits"] + stats["shared_hits"]) / lookups, 4) if lookups else 0.0
+        stats["shared_tier"] = self._shared is not None
+        return stats
+
+
+# --- Process-wide instance ---
+result_cache = ResultCache()
@@ -40,24 +40,53 @@ class ChunkRead(BaseModel):
     user_id: int
     faiss_index_id: int
     content: str
+    page: Optional[int] = None
+    start_offset: Optional[int] = None
+    end_offset: Optional[int] = None
+    token_count: Optional[int] = None
     
     class Config:
         from_attributes = True
 
-class DocumentRead(BaseModel):
-    """Schema for returning document data (response model)."""
+class ChunkSummary(BaseModel):
+    """A chunk's position and a short preview of its text, instead of the whole chunk."""
+    id: int
+    faiss_index_id: int
+    page: Optional[int] = None
+    start_offset: Optional[int] = None
+    end_offset: Optional[int] = None
+    token_count: Optional[int] = None
+    preview: str
+
+class DocumentSummary(BaseModel):
+    """Schema for a document in a listing (no text, no chunks)."""
     id: int
-    user_id: int
     filename: str
-    created_at: datetime
-    # Optionally include text, but be mindful of size for large documents
-    text: Optional[str] = None 
-    
-    # You can nest the relationship for viewing all chunks in a document
-    chunks: List[ChunkRead] = [] 
+    content_hash: Optional[str] = None
+    created_at: Optional[datetime] = None
+    chunk_count: int = 0
 
-    class Config:
-        from_attributes = True
+class DocumentRead(DocumentSummary):
+    """
+    Schema for returning one document. The full text is served separately
+    (GET /documents/{id}/text); `chunks` holds one page of chunk summaries.
+    """
+    user_id: int
+    chunks: List[ChunkSummary] = []
+
+class DocumentPage(BaseModel):
+    """One page of the caller's documents."""
+    total: int
+    limit: int
+    offset: int
+    items: List[DocumentSummary]
+
+class ChunkPage(BaseModel):
+    """One page of a document's chunk summaries."""
+    total: int
+    limit: int
+    offset: int
+    items: List[ChunkSummary]
 
 # --- 3. Search Schemas ---
 
@@ -68,12 +97,40 @@ class SearchQuery(BaseModel):
 class SearchResultItem(BaseModel):
     """Schema for a single search result item."""
     index_id: int
+    # semantic: L2 distance (lower is closer); lexical: BM25 (higher is better);
+    # hybrid: reciprocal-rank-fusion score (higher is better)
     similarity_score: float
     text_snippet: str
     document_id: int
+    document_filename: Optional[str] = None
+    page: Optional[int] = None
+    start_offset: Optional[int] = None
+    end_offset: Optional[int] = None
 
 class SearchResponse(BaseModel):
     """Schema for the overall search response."""
     query: str
+    mode: str = "semantic"
     total_matches: int
-    results: List[SearchResultItem]
\ No newline at end of file
+    results: List[SearchResultItem]
+
+class BatchSearchResult(SearchResponse):
+    """One NDJSON line of a /search/batch response; `position` is the query's index in the request."""
+    position: int
+
+# --- 4. Ingestion Job Schemas ---
+
+class IngestJobRead(BaseModel):
+    """Schema for the status of an upload in the ingestion pipeline."""
+    id: str
+    filename: str
+    status: str
+    stage: str
+    doc_id: Optional[int] = None
+    chunks: Optional[int] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,158 @@
+import hashlib
+import os
+import uuid
+from typing import Tuple
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+# --- Upload Storage Settings ---
+# Files are stored once per content, at UPLOAD_DIR/<sha[:2]>/<sha[2:4]>/<sha>
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+try:
+    MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", 50)) * 1024 * 1024
+except ValueError:
+    MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+    print("[STORAGE] Warning: MAX_UPLOAD_MB is not a valid integer. Using default (50).")
+READ_CHUNK_BYTES = 1024 * 1024
+# Room for the multipart boundaries and part headers around the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised while streaming an upload once it passes MAX_UPLOAD_BYTES."""
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware: rejects multipart request bodies over the upload limit with 413
+    while they are still arriving, before the form is parsed and spooled to disk.
+
+    A declared Content-Length over the limit is refused without reading the body.
+    Otherwise the bytes received are counted, which also covers chunked uploads that
+    declare no length; once they pass the limit the 413 is sent, the application sees
+    the client disconnect, and anything it tries to send afterwards is dropped.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _is_multipart(scope):
+            await self.app(scope, receive, send)
+            return
+
+        limit = MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES
+        declared = dict(scope.get("headers", [])).get(b"content-length", b"")
+        if declared.isdigit() and int(declared) > limit:
+            await _send_too_large(send)
+            return
+
+        received = 0
+        started = False
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit and not started:
+                    rejected = True
+                    await _send_too_large(send)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            if rejected:
+                return
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not rejected:
+                raise
+
+
+def _is_multipart(scope) -> bool:
+    content_type = dict(scope.get("headers", [])).get(b"content-type", b"")
+    return content_type.lower().startswith(b"multipart/")
+
+
+async def _send_too_large(send):
+    body = b'{"detail":"File exceeds the %d MB upload limit"}' % (MAX_UPLOAD_BYTES // (1024 * 1024))
+    await send({
+        "type": "http.response.start",
+        "status": 413,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                    (b"connection", b"close")],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def content_path(content_hash: str) -> str:
+    """Where the file with this SHA-256 lives in the content-addressed store."""
+    return os.path.join(UPLOAD_DIR, content_hash[:2], content_hash[2:4], content_hash)
+
+
+def remove_content(content_hash: str):
+    """Deletes a file from the store; the caller checks that nothing refers to it any more."""
+    try:
+        os.remove(content_path(content_hash))
+    except FileNotFoundError:
+        pass
+
+
+def _open_temp() -> Tuple[str, object]:
+    tmp_dir = os.path.join(UPLOAD_DIR, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+    return tmp_path, open(tmp_path, "wb")
+
+
+def _publish(tmp_path: str, content_hash: str) -> str:
+    """Moves a finished temp file into the store, or drops it if the content is already there."""
+    final_path = content_path(content_hash)
+    if os.path.exists(final_path):
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(tmp_path, final_path)
+    return final_path
+
+
+async def save_upload(upload: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> Tuple[str, str]:
+    """
+    Streams an upload to the content-addressed store in READ_CHUNK_BYTES pieces.
+
+    The SHA-256 is computed while the file is written, and UploadTooLarge is raised
+    as soon as more than `max_bytes` have been read. UploadLimitMiddleware has already
+    capped the request body; this holds the file part itself to the exact limit. File
+    writes run on the threadpool so the event loop is never blocked. Returns
+    (sha256 hex, stored path).
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    tmp_path, f = await run_in_threadpool(_open_temp)
+    try:
+        while chunk := await upload.read(READ_CHUNK_BYTES):
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(f"File exceeds the {max_bytes // (1024 * 1024)} MB upload limit")
+            hasher.update(chunk)
+            await run_in_threadpool(f.write, chunk)
+    except BaseException:
+        await run_in_threadpool(f.close)
+        await run_in_threadpool(os.remove, tmp_path)
+        raise
+    await run_in_threadpool(f.close)
+
+    content_hash = hasher.hexdigest()
+    final_path = await run_in_threadpool(_publish, tmp_path, content_hash)
+    return content_hash, final_path
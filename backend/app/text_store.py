@@ -0,0 +1,116 @@
+import codecs
+import gzip
+import os
+import shutil
+import uuid
+from typing import Iterator, Optional
+
+# --- Document Text Storage ---
+# The full extracted text of each document is kept out of the database, compressed, at
+# TEXT_STORE_DIR/<id % 256>/<id>.txt.zst (or .txt.gz when zstandard is not installed).
+# It is written and read as a stream, so no request holds a whole document in memory.
+TEXT_STORE_DIR = os.getenv("TEXT_STORE_DIR", "document_text")
+try:
+    ZSTD_LEVEL = int(os.getenv("TEXT_STORE_ZSTD_LEVEL", 10))
+except ValueError:
+    ZSTD_LEVEL = 10
+    print("[TEXT] Warning: TEXT_STORE_ZSTD_LEVEL is not a valid integer. Using default (10).")
+READ_CHUNK_BYTES = 256 * 1024
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+    print("[TEXT] Warning: zstandard not installed. Document text is stored gzip-compressed instead.")
+
+_EXTENSIONS = (".txt.zst", ".txt.gz")
+
+
+def _base_path(doc_id: int) -> str:
+    return os.path.join(TEXT_STORE_DIR, f"{int(doc_id) % 256:02x}", str(int(doc_id)))
+
+
+def _find(doc_id: int) -> Optional[str]:
+    base = _base_path(doc_id)
+    for ext in _EXTENSIONS:
+        if os.path.exists(base + ext):
+            return base + ext
+    return None
+
+
+def _open_read(path: str):
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"{path} is zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    return gzip.open(path, "rb")
+
+
+def exists(doc_id: int) -> bool:
+    return _find(doc_id) is not None
+
+
+def put_file(doc_id: int, src_path: str):
+    """Compresses the UTF-8 text file `src_path` into the store as the text of `doc_id`."""
+    base = _base_path(doc_id)
+    os.makedirs(os.path.dirname(base), exist_ok=True)
+    final_path = base + (".txt.zst" if zstandard is not None else ".txt.gz")
+    tmp_path = f"{final_path}.{uuid.uuid4().hex}.tmp"
+    with open(src_path, "rb") as src:
+        if zstandard is not None:
+            with open(tmp_path, "wb") as dst:
+                zstandard.ZstdCompressor(level=ZSTD_LEVEL).copy_stream(src, dst)
+        else:
+            with gzip.open(tmp_path, "wb") as dst:
+                shutil.copyfileobj(src, dst, READ_CHUNK_BYTES)
+    os.replace(tmp_path, final_path)
+    # A document's text is only ever stored in one format
+    for ext in _EXTENSIONS:
+        if base + ext != final_path and os.path.exists(base + ext):
+            os.remove(base + ext)
+
+
+def copy(src_doc_id: int, dst_doc_id: int) -> bool:
+    """Gives `dst_doc_id` the same stored text as `src_doc_id`. False if the source has none."""
+    src_path = _find(src_doc_id)
+    if src_path is None:
+        return False
+    dst_base = _base_path(dst_doc_id)
+    os.makedirs(os.path.dirname(dst_base), exist_ok=True)
+    ext = ".txt.zst" if src_path.endswith(".zst") else ".txt.gz"
+    tmp_path = f"{dst_base}{ext}.{uuid.uuid4().hex}.tmp"
+    shutil.copyfile(src_path, tmp_path)
+    os.replace(tmp_path, dst_base + ext)
+    return True
+
+
+def iter_text(doc_id: int, chunk_bytes: int = READ_CHUNK_BYTES) -> Iterator[str]:
+    """Yields the document's text in pieces of about `chunk_bytes`; nothing if none is stored."""
+    path = _find(doc_id)
+    if path is None:
+        return
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    with _open_read(path) as f:
+        while block := f.read(chunk_bytes):
+            text = decoder.decode(block)
+            if text:
+                yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def read_text(doc_id: int) -> Optional[str]:
+    """The whole text of a document, or None. Prefer iter_text for anything user-facing."""
+    if _find(doc_id) is None:
+        return None
+    return "".join(iter_text(doc_id))
+
+
+def delete(doc_id: int):
+    base = _base_path(doc_id)
+    for ext in _EXTENSIONS:
+        try:
+            os.remove(base + ext)
+        except FileNotFoundError:
+            pass
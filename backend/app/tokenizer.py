@@ -0,0 +1,32 @@
+import os
+from functools import lru_cache
+from typing import List
+
+# Encoding used by the OpenAI embedding models (text-embedding-3-*, ada-002)
+TOKEN_ENCODING = os.getenv("EMBEDDING_TOKEN_ENCODING", "cl100k_base")
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    """Loads tiktoken's encoder once; returns None if tiktoken is unavailable."""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TOKEN_ENCODING)
+    except Exception as e:
+        print(f"[TOKENS] Warning: tiktoken unavailable ({e}). Estimating tokens as characters / 4.")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Number of embedding-model tokens in `text` (estimated if tiktoken is missing)."""
+    enc = _encoding()
+    if enc is None:
+        return max(1, len(text) // 4)
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def count_tokens_many(texts: List[str]) -> List[int]:
+    enc = _encoding()
+    if enc is None:
+        return [max(1, len(t) // 4) for t in texts]
+    return [len(tokens) for tokens in enc.encode_batch(texts, disallowed_special=())]
@@ -1,34 +1,215 @@
-import pdfplumber
-# Changed import name to standard 'docx' for clarity
-import docx 
+import codecs
+import multiprocessing
 import os
-from typing import Optional, Union
+import signal
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterator, List, Optional, Tuple, Union
+
+from .lazy import lazy_import
+
+# Imported on first use (see lazy.py); extraction workers and the pipeline load them when needed
+pdfplumber = lazy_import("pdfplumber")
+# Changed import name to standard 'docx' for clarity
+docx = lazy_import("docx")
 
 # Define the full path type for clarity
 FilePath = Union[str, os.PathLike]
 
 
-def extract_text_from_pdf(path: FilePath) -> str:
+# --- Parallel Extraction Settings ---
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        print(f"[UTILS] Warning: {name} is not a valid integer. Using default ({default}).")
+        return default
+
+PDF_WORKERS = _env_int("PDF_EXTRACT_WORKERS", os.cpu_count() or 2)
+PDF_PAGES_PER_TASK = _env_int("PDF_PAGES_PER_TASK", 8)
+# A page taking longer than this is skipped (its text comes back empty)
+PDF_PAGE_TIMEOUT_SECONDS = _env_int("PDF_PAGE_TIMEOUT_SECONDS", 30)
+# Address-space cap per extraction process; 0 disables it
+PDF_WORKER_MEMORY_MB = _env_int("PDF_WORKER_MEMORY_MB", 2048)
+# Times a page range is submitted before its pages are skipped when workers keep dying
+PDF_RANGE_ATTEMPTS = 3
+# Paragraphs per block when streaming DOCX, characters per block for plaintext
+DOCX_PARAGRAPHS_PER_BLOCK = 50
+TEXT_BLOCK_CHARS = 64 * 1024
+
+
+class _PageTimeout(Exception):
+    pass
+
+
+def _pdf_worker_init(memory_mb: int):
+    """Runs once in each extraction process: caps its memory so one page cannot exhaust the host."""
+    if memory_mb > 0:
+        try:
+            import resource
+            limit = memory_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError) as e:
+            print(f"[UTILS] Warning: could not cap extraction worker memory: {e}")
+
+
+def _raise_page_timeout(signum, frame):
+    raise _PageTimeout()
+
+
+def _extract_pdf_page_range(path: FilePath, start: int, end: int, timeout: int) -> List[Tuple[int, str]]:
+    """Worker task: extracts pages [start, end) and returns (page_number, text) pairs."""
+    results = []
+    use_alarm = timeout > 0 and hasattr(signal, "SIGALRM")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _raise_page_timeout)
+
+    with pdfplumber.open(path) as pdf:
+        for i in range(start, min(end, len(pdf.pages))):
+            text = ""
+            page = pdf.pages[i]
+            try:
+                if use_alarm:
+                    signal.alarm(timeout)
+                text = page.extract_text() or ""
+            except _PageTimeout:
+                print(f"[UTILS] Warning: page {i + 1} of {path} timed out after {timeout}s; skipping it.")
+            except MemoryError:
+                print(f"[UTILS] Warning: page {i + 1} of {path} exceeded the memory cap; skipping it.")
+            except Exception as e:
+                print(f"[UTILS] Warning: could not extract page {i + 1} of {path}: {e}")
+            finally:
+                if use_alarm:
+                    signal.alarm(0)
+                # Drops the page's parsed objects so memory stays flat across long documents
+                page.close()
+            results.append((i + 1, text))
+    return results
+
+
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+_pdf_pool_lock = threading.Lock()
+
+
+def _get_pdf_pool(replace: Optional[ProcessPoolExecutor] = None) -> ProcessPoolExecutor:
     """
-    Extracts text from a PDF file using pdfplumber, handling potential errors.
+    The shared extraction pool. Passing the pool a caller found broken replaces it,
+    unless another job already did; jobs sharing a broken pool all end up on one new pool.
+    """
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if replace is not None and _pdf_pool is replace:
+            # Its queued work has already failed with BrokenProcessPool; owners resubmit it
+            _pdf_pool.shutdown(wait=False)
+            _pdf_pool = None
+        if _pdf_pool is None:
+            # "spawn" because the server process is multi-threaded, where fork is unsafe
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=max(1, PDF_WORKERS),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_pdf_worker_init,
+                initargs=(PDF_WORKER_MEMORY_MB,),
+            )
+        return _pdf_pool
+
+
+def _terminate_pdf_workers(pool: ProcessPoolExecutor):
+    """
+    Kills the pool's worker processes, so a hung one does not hold a slot forever.
+    The executor does not say which process runs which task, so all of them go; the
+    pool breaks and every job with work on it resubmits that work to a new pool.
+    """
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        try:
+            process.terminate()
+        except Exception:
+            pass
+
+
+def iter_pdf_pages(path: FilePath) -> Iterator[Tuple[int, str]]:
+    """
+    Yields (page_number, text) for every page of a PDF, in order, as soon as it is ready.
+
+    Page ranges are extracted in parallel on a process pool. Only a few ranges are
+    in flight at once, so memory does not grow with the document, and callers can
+    start working on the first pages while later ones are still being parsed.
+
+    The pool is shared by all jobs. When a worker dies, the ranges this job had in
+    flight are resubmitted to a fresh pool (up to PDF_RANGE_ATTEMPTS times each), so
+    a crash caused by another document does not blank this one's pages. A range that
+    hangs past its deadline is skipped and the pool's workers are terminated.
     """
-    texts = []
     try:
         with pdfplumber.open(path) as pdf:
-            for page in pdf.pages:
-                # Use := (walrus operator) for efficiency and check if text exists
-                if (text := page.extract_text()): 
-                    texts.append(text)
-        
-        return "\n".join(texts)
-    
+            n_pages = len(pdf.pages)
     except FileNotFoundError:
         print(f"[UTILS] Error: PDF file not found at path: {path}")
+        return
     except Exception as e:
-        # Catch errors like corrupted PDF structure, permissions issues, etc.
         print(f"[UTILS] Error processing PDF file {path}: {e}")
-    
-    return "" # Return empty string on failure
+        return
+
+    # Workers may not share our working directory assumptions, so hand them an absolute path
+    path = os.path.abspath(path)
+    step = max(1, PDF_PAGES_PER_TASK)
+    ranges = deque((start, min(start + step, n_pages)) for start in range(0, n_pages, step))
+    attempts = {}
+    in_flight = deque()
+
+    def submit_next():
+        start, end = ranges.popleft()
+        attempts[start] = attempts.get(start, 0) + 1
+        pool = _get_pdf_pool()
+        try:
+            future = pool.submit(_extract_pdf_page_range, path, start, end, PDF_PAGE_TIMEOUT_SECONDS)
+        except BrokenProcessPool:
+            pool = _get_pdf_pool(replace=pool)
+            future = pool.submit(_extract_pdf_page_range, path, start, end, PDF_PAGE_TIMEOUT_SECONDS)
+        in_flight.append((start, end, pool, future))
+
+    def requeue_in_flight():
+        for s, e, _, future in reversed(in_flight):
+            future.cancel()
+            ranges.appendleft((s, e))
+        in_flight.clear()
+
+    while ranges or in_flight:
+        while ranges and len(in_flight) < 2 * max(1, PDF_WORKERS):
+            submit_next()
+        start, end, pool, future = in_flight.popleft()
+        try:
+            # Each page has its own timeout in the worker; this only guards against a hung process
+            pages = future.result(timeout=PDF_PAGE_TIMEOUT_SECONDS * (end - start) + 60 if PDF_PAGE_TIMEOUT_SECONDS > 0 else None)
+        except TimeoutError:
+            print(f"[UTILS] Error: extraction of pages {start + 1}-{end} of {path} hung; skipping them.")
+            _terminate_pdf_workers(pool)
+            _get_pdf_pool(replace=pool)
+            requeue_in_flight()
+            pages = [(i + 1, "") for i in range(start, end)]
+        except BrokenProcessPool as e:
+            # A worker died (killed for memory, or terminated because another job's range
+            # hung): move to a new pool and resubmit this range and the ones behind it
+            _get_pdf_pool(replace=pool)
+            requeue_in_flight()
+            ranges.appendleft((start, end))
+            if attempts[start] < max(1, PDF_RANGE_ATTEMPTS):
+                continue
+            ranges.remove((start, end))
+            print(f"[UTILS] Error: extraction of pages {start + 1}-{end} of {path} failed {attempts[start]} times ({e!r}); skipping them.")
+            pages = [(i + 1, "") for i in range(start, end)]
+        except Exception as e:
+            print(f"[UTILS] Error processing pages {start + 1}-{end} of PDF file {path}: {e}")
+            pages = [(i + 1, "") for i in range(start, end)]
+        yield from pages
+
+
+def extract_text_from_pdf(path: FilePath) -> str:
+    """
+    Extracts text from a PDF file using pdfplumber, handling potential errors.
+    """
+    return "\n".join(text for _, text in iter_pdf_pages(path) if text)
 
 
 def extract_text_from_docx(path: FilePath) -> str:
@@ -90,4 +271,95 @@ def extract_text(path: FilePath, filename: str) -> str:
         except Exception as e:
             print(f"[UTILS] Error processing file {path} as plaintext: {e}")
             
-        return "" # Final fallback for any failure
\ No newline at end of file
+        return "" # Final fallback for any failure
+
+
+def iter_docx_blocks(path: FilePath) -> Iterator[Tuple[int, str]]:
+    """Yields (block_number, text) for groups of DOCX_PARAGRAPHS_PER_BLOCK paragraphs."""
+    try:
+        doc = docx.Document(path)
+    except FileNotFoundError:
+        print(f"[UTILS] Error: DOCX file not found at path: {path}")
+        return
+    except docx.opc.exceptions.PackageNotFoundError:
+        print(f"[UTILS] Error: DOCX file is corrupt or not a valid DOCX format at path: {path}")
+        return
+    except Exception as e:
+        print(f"[UTILS] Error processing DOCX file {path}: {e}")
+        return
+
+    block, number = [], 1
+    for p in doc.paragraphs:
+        if p.text:
+            block.append(p.text)
+        if len(block) >= DOCX_PARAGRAPHS_PER_BLOCK:
+            yield number, "\n".join(block)
+            block, number = [], number + 1
+    if block:
+        yield number, "\n".join(block)
+
+
+def iter_plaintext_blocks(path: FilePath) -> Iterator[Tuple[int, str]]:
+    """
+    Yields (block_number, text) for consecutive TEXT_BLOCK_CHARS-sized blocks of a text file.
+    Decodes as UTF-8 and switches to Latin-1 from the first undecodable block on.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    number = 1
+    try:
+        with open(path, "rb") as f:
+            while True:
+                raw = f.read(TEXT_BLOCK_CHARS)
+                try:
+                    text = decoder.decode(raw, final=not raw)
+                except UnicodeDecodeError:
+                    print(f"[UTILS] Warning: Could not decode file {path} as UTF-8. Trying Latin-1.")
+                    decoder = codecs.getincrementaldecoder("latin-1")()
+                    text = decoder.decode(raw, final=not raw)
+                if text:
+                    yield number, text
+                    number += 1
+                if not raw:
+                    break
+    except FileNotFoundError:
+        print(f"[UTILS] Error: Plaintext file not found at path: {path}")
+    except Exception as e:
+        print(f"[UTILS] Error processing file {path} as plaintext: {e}")
+
+
+def iter_pdf_pages_serial(path: FilePath) -> Iterator[Tuple[int, str]]:
+    """
+    Like `iter_pdf_pages`, but extracts every page in the calling process.
+    For callers that already parallelize across files, e.g. from inside a worker process.
+    """
+    try:
+        with pdfplumber.open(path) as pdf:
+            n_pages = len(pdf.pages)
+    except Exception as e:
+        print(f"[UTILS] Error processing PDF file {path}: {e}")
+        return
+
+    step = max(1, PDF_PAGES_PER_TASK)
+    for start in range(0, n_pages, step):
+        end = min(start + step, n_pages)
+        try:
+            yield from _extract_pdf_page_range(path, start, end, PDF_PAGE_TIMEOUT_SECONDS)
+        except Exception as e:
+            print(f"[UTILS] Error processing pages {start + 1}-{end} of PDF file {path}: {e}")
+            yield from ((i + 1, "") for i in range(start, end))
+
+
+def iter_text_pages(path: FilePath, filename: str, parallel: bool = True) -> Iterator[Tuple[int, str]]:
+    """
+    Streaming counterpart of `extract_text`: yields (page_number, text) pairs.
+
+    For PDFs these are real pages, extracted on the shared process pool unless
+    `parallel` is False. DOCX and plaintext have no pages, so they are split into
+    numbered blocks of paragraphs or characters instead.
+    """
+    ext = filename.lower().split('.')[-1] if '.' in filename else ''
+    if ext == "pdf":
+        return iter_pdf_pages(path) if parallel else iter_pdf_pages_serial(path)
+    elif ext == "docx":
+        return iter_docx_blocks(path)
+    return iter_plaintext_blocks(path)
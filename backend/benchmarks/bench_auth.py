@@ -0,0 +1,73 @@
+"""
+Password hashing throughput: logins (bcrypt verifications) per second, per core.
+
+Run from the backend directory:
+    python -m benchmarks.bench_auth --rounds 12 --logins 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=int(os.getenv("BCRYPT_ROUNDS", 12)), help="bcrypt cost factor")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="hashing processes")
+    parser.add_argument("--logins", type=int, default=100, help="verifications to run through the pool")
+    return parser.parse_args(argv)
+
+
+async def run_pool(hasher, password, hashed, logins):
+    # Keep the pool exactly at capacity so nothing is rejected as busy
+    gate = asyncio.Semaphore(hasher.capacity)
+
+    async def one():
+        async with gate:
+            ok, _ = await hasher.verify_and_update(password, hashed)
+            assert ok
+
+    await asyncio.gather(*(one() for _ in range(logins)))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # The cost factor is read at import time, also by the spawned workers
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    from app import auth
+
+    password = "benchmark-password"
+    hashed = auth.hash_password(password)
+
+    # Single-thread baseline: what one core does without the pool
+    baseline_n = max(5, args.logins // 10)
+    start = time.perf_counter()
+    for _ in range(baseline_n):
+        auth.verify_password(password, hashed)
+    baseline = baseline_n / (time.perf_counter() - start)
+
+    hasher = auth.PasswordHasher(workers=args.workers, max_queue=args.workers)
+    asyncio.run(run_pool(hasher, password, hashed, hasher.workers))  # warm up the worker processes
+    start = time.perf_counter()
+    asyncio.run(run_pool(hasher, password, hashed, args.logins))
+    elapsed = time.perf_counter() - start
+    hasher.shutdown()
+
+    cores = min(args.workers, os.cpu_count() or 1)
+    report = {
+        "bcrypt_rounds": args.rounds,
+        "workers": args.workers,
+        "cores_used": cores,
+        "logins": args.logins,
+        "single_thread_logins_per_sec": round(baseline, 2),
+        "pool_logins_per_sec": round(args.logins / elapsed, 2),
+        "pool_logins_per_sec_per_core": round(args.logins / elapsed / cores, 2),
+    }
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""
+Vector compression: memory per vector vs recall@k for every FAISS index type,
+with and without full-precision re-ranking of the top candidates.
+
+Ground truth is an exact search over the same vectors. By default the vectors are
+synthetic (unit-length, clustered like text embeddings); pass --vectors with an
+(n, dim) float32 .npy file of real embeddings for numbers that transfer.
+
+Run from the backend directory:
+    python -m benchmarks.bench_compression --n 50000 --dim 1536 --queries 200
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.corpus import synthetic_vectors
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", default=None, help=".npy file of embeddings (default: synthetic)")
+    parser.add_argument("--n", type=int, default=20000, help="synthetic vectors to index")
+    parser.add_argument("--dim", type=int, default=1536, help="synthetic vector dimension")
+    parser.add_argument("--queries", type=int, default=200, help="queries, held out from the indexed vectors")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--rerank-factor", type=int, default=4, help="candidates fetched per result when re-ranking")
+    parser.add_argument("--types", default="flat,sq_fp16,sq8,opq_pq,ivf_flat,ivf_pq,hnsw")
+    return parser.parse_args(argv)
+
+
+def recall(found, truth):
+    return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.vectors:
+        data = np.load(args.vectors).astype("float32")
+    else:
+        data = synthetic_vectors(args.n + args.queries, args.dim)
+    queries, base = data[:args.queries], data[args.queries:]
+
+    # Settings are read at import time: index at the data's dimension, train even small sets
+    os.environ.update({
+        "EMBEDDING_PROVIDER": "local",
+        "EMBEDDING_DIM": str(base.shape[1]),
+        "EMBEDDING_CACHE_PATH": "",
+        "FAISS_TRAIN_MIN_VECTORS": "0",
+    })
+    import faiss
+    from app import embeddings
+
+    ids = np.arange(len(base), dtype="int64")
+    exact = faiss.IndexFlatL2(base.shape[1])
+    exact.add(base)
+    _, truth = exact.search(queries, args.k)
+    full = dict(zip(ids.tolist(), base))
+
+    report = {"vectors": len(base), "dim": base.shape[1], "k": args.k, "rerank_factor": args.rerank_factor, "types": {}}
+    for index_type in args.types.split(","):
+        start = time.perf_counter()
+        index = embeddings.create_embeddings_index(base, ids, index_type=index_type)
+        build_seconds = time.perf_counter() - start
+        size = len(faiss.serialize_index(index))
+
+        start = time.perf_counter()
+        _, found = embeddings.search_index(index, queries, args.k)
+        search_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        start = time.perf_counter()
+        D, I = embeddings.search_index(index, queries, args.k * args.rerank_factor)
+        reranked = [
+            embeddings.rerank_exact(q, [int(i) for i in row_ids if i >= 0], row_d.tolist(), full, args.k)[0]
+            for q, row_ids, row_d in zip(queries, I, D)
+        ]
+        rerank_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        report["types"][index_type] = {
+            "bytes_per_vector": round(size / len(base), 1),
+            "index_mb": round(size / 2**20, 2),
+            "recall_at_k": round(recall(found, truth), 4),
+            "recall_at_k_reranked": round(recall(reranked, truth), 4),
+            "search_ms_per_query": round(search_ms, 3),
+            "search_rerank_ms_per_query": round(rerank_ms, 3),
+            "build_seconds": round(build_seconds, 2),
+        }
+        print(f"[BENCH] {index_type}: {report['types'][index_type]}", file=sys.stderr)
+
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""
+Cold start: how long `import app.main` takes, which imports dominate it (python -X importtime),
+and how long a fresh uvicorn worker takes to answer / and to report /ready.
+
+The server runs against a throwaway database and index directory unless --use-env is
+given. With --budget-seconds, exits with status 1 if / took longer than that to respond.
+
+Run from the backend directory:
+    python -m benchmarks.bench_startup --budget-seconds 3
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="cold imports / server starts to take the median of")
+    parser.add_argument("--top", type=int, default=15, help="slowest top-level imports to report")
+    parser.add_argument("--budget-seconds", type=float, default=None, help="fail if / takes longer than this to respond")
+    parser.add_argument("--timeout", type=float, default=120.0, help="give up waiting for the server after this long")
+    parser.add_argument("--use-env", action="store_true", help="use the current configuration instead of a scratch one")
+    return parser.parse_args(argv)
+
+
+def scratch_env(work_dir):
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(work_dir, 'startup.db')}",
+        "FAISS_INDEX_DIR": os.path.join(work_dir, "faiss_index"),
+        "FAISS_INDEX_PATH": os.path.join(work_dir, "faiss_index.idx"),
+        "UPLOAD_DIR": os.path.join(work_dir, "uploads"),
+        "TEXT_STORE_DIR": os.path.join(work_dir, "document_text"),
+        "INGEST_WORK_DIR": os.path.join(work_dir, "ingest_jobs"),
+        "EMBEDDING_CACHE_PATH": os.path.join(work_dir, "embedding_cache.db"),
+        "EMBEDDING_PROVIDER": env.get("EMBEDDING_PROVIDER", "local"),
+    })
+    return env
+
+
+def import_seconds(env):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import app.main"], cwd=BACKEND_DIR, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def import_profile(env, top):
+    """Top-level imports of app.main by cumulative time (python -X importtime)."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"], cwd=BACKEND_DIR, env=env,
+                            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    entries = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((len(indent), name, int(self_us), int(cumulative_us)))
+    top_level = min((depth for depth, *_ in entries), default=0)
+    ranked = sorted((e for e in entries if e[0] == top_level), key=lambda e: e[3], reverse=True)
+    return [{"module": name, "cumulative_ms": round(cum / 1000, 1), "self_ms": round(own / 1000, 1)}
+            for _, name, own, cum in ranked[:top]]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, deadline):
+    """Polls `url` every 10 ms until it answers 200; False if `deadline` passes first."""
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return True
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.01)
+    return False
+
+
+def server_start(env, timeout):
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = start + timeout
+        if not wait_for(f"http://127.0.0.1:{port}/", deadline):
+            raise RuntimeError("the server did not answer / in time")
+        root = time.perf_counter() - start
+        if not wait_for(f"http://127.0.0.1:{port}/ready", deadline):
+            raise RuntimeError("the server did not become ready in time")
+        return root, time.perf_counter() - start
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    work_dir = None if args.use_env else tempfile.mkdtemp(prefix="bench_startup_")
+    env = dict(os.environ) if args.use_env else scratch_env(work_dir)
+    try:
+        imports = [import_seconds(env) for _ in range(args.repeat)]
+        profile = import_profile(env, args.top)
+        starts = [server_start(env, args.timeout) for _ in range(args.repeat)]
+    finally:
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    root_seconds = statistics.median(root for root, _ in starts)
+    report = {
+        "import_app_main_seconds": round(statistics.median(imports), 3),
+        "first_response_seconds": round(root_seconds, 3),
+        "ready_seconds": round(statistics.median(ready for _, ready in starts), 3),
+        "slowest_imports": profile,
+    }
+    status = 0
+    if args.budget_seconds is not None:
+        report["budget_seconds"] = args.budget_seconds
+        report["within_budget"] = root_seconds <= args.budget_seconds
+        status = 0 if report["within_budget"] else 1
+    print(json.dumps(report, indent=2))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
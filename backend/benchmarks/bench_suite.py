@@ -0,0 +1,379 @@
+"""
+Offline benchmark suite for ingestion and search. No network and no API key: embeddings
+come from the deterministic local embedder (EMBEDDING_PROVIDER=local) and all inputs are
+generated from --seed, so runs are reproducible and comparable across releases.
+
+Stages (each runs in a fresh process, so its peak RSS is its own):
+    extract  utils.extract_text / iter_text_pages on generated PDF, DOCX and TXT files
+    chunk    embeddings.chunk_text on synthetic documents
+    embed    embeddings.embed_texts through the embedding scheduler
+    index    FAISS build and search over --chunks vectors, with recall@k against exact search
+    api      /upload (until indexed) and /search end to end, against a throwaway database
+
+Every stage reports throughput, p50/p95/p99 latency and peak RSS. The report is JSON;
+pass --baseline with an earlier report to flag regressions (exit status 1).
+
+Run from the backend directory:
+    python -m benchmarks.bench_suite --chunks 100000 --output bench.json
+    python -m benchmarks.bench_suite --stages index --chunks 1000000 --dim 384 --index-type hnsw
+    python -m benchmarks.bench_suite --baseline bench.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from benchmarks.corpus import Corpus, synthetic_vectors, write_fixtures
+
+STAGES = ("extract", "chunk", "embed", "index", "api")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma-separated subset of: " + ", ".join(STAGES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dim", type=int, default=384, help="embedding dimension")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--documents", type=int, default=10, help="fixture documents per format (extract, chunk)")
+    parser.add_argument("--pages", type=int, default=10, help="pages per fixture document")
+    parser.add_argument("--embed-chunks", type=int, default=5000, help="chunks embedded by the embed stage")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="simulated provider round trip per request")
+    parser.add_argument("--chunks", type=int, default=10000, help="vectors in the index stage (1k to 1M)")
+    parser.add_argument("--index-type", default="flat", help="FAISS index type for the index and api stages")
+    parser.add_argument("--index-vectors", choices=("synthetic", "local"), default="synthetic",
+                        help="index stage vectors: clustered random (fast at any size) or local embeddings of the corpus")
+    parser.add_argument("--api-documents", type=int, default=5, help="documents per format uploaded by the api stage")
+    parser.add_argument("--work-dir", default=None, help="scratch directory (default: a temporary one, removed afterwards)")
+    parser.add_argument("--output", default=None, help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", default=None, help="earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="relative change counted as a regression")
+    return parser.parse_args(argv)
+
+
+# --- Measurement helpers ---
+def latency_summary(seconds):
+    """Percentiles of per-operation latencies, in milliseconds."""
+    ms = np.asarray(seconds, dtype="float64") * 1000
+    if not len(ms):
+        return {"count": 0}
+    return {
+        "count": int(len(ms)),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (2**20 if sys.platform == "darwin" else 1024), 1)
+
+
+def recall_at_k(found, truth):
+    return round(float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)])), 4)
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def configure(args, work_dir, **extra):
+    """Settings are read at import time, so each stage sets them before importing the app."""
+    os.environ.update({
+        "EMBEDDING_PROVIDER": "local",
+        "EMBEDDING_DIM": str(args.dim),
+        "LOCAL_EMBEDDING_LATENCY_MS": str(args.embed_latency_ms),
+        # Every stage measures real work, not cache hits
+        "EMBEDDING_CACHE_PATH": "",
+        "FAISS_INDEX_TYPE": args.index_type,
+        "FAISS_INDEX_DIR": os.path.join(work_dir, "faiss_index"),
+        **{name: str(value) for name, value in extra.items()},
+    })
+
+
+# --- Stages ---
+def stage_extract(args, work_dir):
+    configure(args, work_dir)
+    from app import utils
+
+    corpus = Corpus(args.seed)
+    paths = write_fixtures(os.path.join(work_dir, "fixtures"), corpus, args.documents, args.pages)
+    report = {}
+    for fmt in ("pdf", "docx", "txt"):
+        files = [p for p in paths if p.endswith("." + fmt)]
+        total_bytes = sum(os.path.getsize(p) for p in files)
+        whole, streamed = [], []
+        for path in files:
+            _, seconds = timed(utils.extract_text, path, os.path.basename(path))
+            whole.append(seconds)
+            _, seconds = timed(lambda: sum(1 for _ in utils.iter_text_pages(path, os.path.basename(path))))
+            streamed.append(seconds)
+        report[fmt] = {
+            "files": len(files),
+            "mb": round(total_bytes / 2**20, 2),
+            "extract_text": latency_summary(whole),
+            "extract_text_mb_per_second": round(total_bytes / 2**20 / sum(whole), 2),
+            "extract_text_pages_per_second": round(len(files) * args.pages / sum(whole), 1),
+            "iter_text_pages": latency_summary(streamed),
+            "iter_text_pages_pages_per_second": round(len(files) * args.pages / sum(streamed), 1),
+        }
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+
+def stage_chunk(args, work_dir):
+    configure(args, work_dir)
+    from app import embeddings
+
+    corpus = Corpus(args.seed)
+    documents = ["\n\n".join(corpus.document(n, args.pages * 4)) for n in range(args.documents)]
+    latencies, n_chunks = [], 0
+    for text in documents:
+        chunks, seconds = timed(embeddings.chunk_text, text)
+        latencies.append(seconds)
+        n_chunks += len(chunks)
+    total_mb = sum(len(text.encode("utf-8")) for text in documents) / 2**20
+    return {
+        "documents": len(documents),
+        "chunks": n_chunks,
+        "chunk_text": latency_summary(latencies),
+        "chunks_per_second": round(n_chunks / sum(latencies), 1),
+        "mb_per_second": round(total_mb / sum(latencies), 2),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+EMBED_BATCH = 256
+
+def stage_embed(args, work_dir):
+    configure(args, work_dir)
+    from app import embeddings
+
+    texts = Corpus(args.seed).chunks(args.embed_chunks)
+    embeddings.embed_texts(texts[:8])  # start the scheduler before timing
+    latencies = []
+    for start in range(0, len(texts), EMBED_BATCH):
+        _, seconds = timed(embeddings.embed_texts, texts[start:start + EMBED_BATCH])
+        latencies.append(seconds)
+    return {
+        "chunks": len(texts),
+        "batch_size": EMBED_BATCH,
+        "embed_texts": latency_summary(latencies),
+        "chunks_per_second": round(len(texts) / sum(latencies), 1),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def stage_index(args, work_dir):
+    # Small runs should still exercise the trained index types
+    configure(args, work_dir, FAISS_TRAIN_MIN_VECTORS=0)
+    import faiss
+    from app import embeddings
+
+    if args.index_vectors == "local":
+        corpus = Corpus(args.seed)
+        base = embeddings.embed_texts(corpus.chunks(args.chunks))
+        queries = embeddings.embed_queries(corpus.queries(args.queries))
+    else:
+        data = synthetic_vectors(args.chunks + args.queries, args.dim, seed=args.seed)
+        queries, base = data[:args.queries], data[args.queries:]
+    ids = np.arange(len(base), dtype="int64")
+
+    index, build_seconds = timed(embeddings.create_embeddings_index, base, ids, index_type=args.index_type)
+
+    exact = faiss.IndexFlatL2(base.shape[1])
+    exact.add(base)
+    _, truth = exact.search(queries, args.k)
+
+    single, found = [], []
+    for query in queries:
+        (_, I), seconds = timed(embeddings.search_index, index, query[None, :], args.k)
+        single.append(seconds)
+        found.append(I[0])
+    (_, batch_found), batch_seconds = timed(embeddings.search_index, index, queries, args.k)
+
+    return {
+        "vectors": len(base),
+        "dim": base.shape[1],
+        "index_type": embeddings.index_type_of(index),
+        "build_seconds": round(build_seconds, 3),
+        "add_vectors_per_second": round(len(base) / build_seconds, 1),
+        "index_mb": round(len(faiss.serialize_index(index)) / 2**20, 2),
+        "search": latency_summary(single),
+        "search_queries_per_second": round(len(queries) / sum(single), 1),
+        "batch_search_queries_per_second": round(len(queries) / batch_seconds, 1),
+        "recall_at_k": recall_at_k(found, truth),
+        "batch_recall_at_k": recall_at_k(batch_found, truth),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+JOB_POLL_SECONDS = 0.05
+
+def stage_api(args, work_dir):
+    api_dir = os.path.join(work_dir, "api")
+    os.makedirs(api_dir, exist_ok=True)
+    configure(
+        args, work_dir,
+        DATABASE_URL=f"sqlite:///{os.path.join(api_dir, 'bench.db')}",
+        UPLOAD_DIR=os.path.join(api_dir, "uploads"),
+        TEXT_STORE_DIR=os.path.join(api_dir, "document_text"),
+        INGEST_WORK_DIR=os.path.join(api_dir, "ingest_jobs"),
+        INDEX_MODE="writer",
+        BCRYPT_ROUNDS=4,
+    )
+    from fastapi.testclient import TestClient
+    from app import lexical, main
+
+    corpus = Corpus(args.seed)
+    paths = write_fixtures(os.path.join(work_dir, "fixtures"), corpus, args.api_documents, args.pages)
+    report = {"documents": len(paths)}
+    with TestClient(main.app) as client:
+        token = client.post("/register", json={"email": "bench@example.com", "password": "benchmark"}).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        # Uploads return once the file is stored; indexing finishes in the pipeline
+        uploads, submitted = [], {}
+        first_upload = time.perf_counter()
+        for path in paths:
+            with open(path, "rb") as f:
+                start = time.perf_counter()
+                r = client.post("/upload", files={"file": (os.path.basename(path), f)}, headers=headers)
+                uploads.append(time.perf_counter() - start)
+            r.raise_for_status()
+            if "job_id" in r.json():
+                submitted[r.json()["job_id"]] = start
+
+        indexed, failed = [], 0
+        while submitted:
+            time.sleep(JOB_POLL_SECONDS)
+            for job_id, start in list(submitted.items()):
+                status = client.get(f"/jobs/{job_id}", headers=headers).json()["status"]
+                if status in ("done", "failed"):
+                    indexed.append(time.perf_counter() - start)
+                    failed += status == "failed"
+                    del submitted[job_id]
+        report["documents_indexed_per_second"] = round(len(indexed) / (time.perf_counter() - first_upload), 2)
+        report["upload"] = latency_summary(uploads)
+        report["upload_to_indexed"] = latency_summary(indexed)
+        report["failed_jobs"] = failed
+
+        queries = corpus.queries(args.queries)
+        modes = ["semantic"] + (["lexical", "hybrid"] if lexical.available() else [])
+        for mode in modes:
+            for label in ("search", "search_repeat"):  # the repeat pass is served by the result cache
+                latencies = []
+                for query in queries:
+                    start = time.perf_counter()
+                    client.post("/search", json={"query": query, "mode": mode}, headers=headers).raise_for_status()
+                    latencies.append(time.perf_counter() - start)
+                report[f"{label}_{mode}"] = latency_summary(latencies)
+                report[f"{label}_{mode}_queries_per_second"] = round(len(latencies) / sum(latencies), 1)
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+
+STAGE_FUNCTIONS = {
+    "extract": stage_extract,
+    "chunk": stage_chunk,
+    "embed": stage_embed,
+    "index": stage_index,
+    "api": stage_api,
+}
+
+
+# --- Regression check ---
+def _flatten(report, prefix=""):
+    for key, value in report.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}{key}", value
+
+
+def compare(report, baseline, tolerance):
+    """Metrics that got worse by more than `tolerance` (relative) since `baseline`."""
+    old = dict(_flatten(baseline.get("stages", {})))
+    regressions = []
+    for name, value in _flatten(report["stages"]):
+        before = old.get(name)
+        if not before:
+            continue
+        leaf = name.rsplit(".", 1)[-1]
+        if leaf.endswith("_per_second") or "recall" in leaf:
+            change = (before - value) / before  # higher is better
+        elif leaf.endswith("_ms") or leaf.endswith("_seconds") or leaf.endswith("_mb"):
+            change = (value - before) / before  # lower is better
+        else:
+            continue
+        if change > tolerance:
+            regressions.append({"metric": name, "baseline": before, "current": value, "change": round(change, 4)})
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        print(f"[BENCH] Unknown stages: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="bench_suite_")
+    os.makedirs(work_dir, exist_ok=True)
+    report = {
+        "config": vars(args),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "numpy": np.__version__,
+        },
+        "stages": {},
+    }
+    try:
+        for stage in stages:
+            # A fresh process per stage: clean settings and an honest peak RSS
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                start = time.perf_counter()
+                report["stages"][stage] = pool.submit(STAGE_FUNCTIONS[stage], args, work_dir).result()
+                report["stages"][stage]["wall_seconds"] = round(time.perf_counter() - start, 2)
+            print(f"[BENCH] {stage}: {json.dumps(report['stages'][stage])}", file=sys.stderr)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+        for regression in report["regressions"]:
+            print(f"[BENCH] Regression: {regression}", file=sys.stderr)
+        status = 1 if report["regressions"] else 0
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+"""
+Deterministic synthetic data for the benchmarks: research-like prose, search queries,
+clustered embedding vectors, and PDF / DOCX / TXT fixture files built from them.
+
+Everything is derived from a seed, so two runs with the same arguments measure
+exactly the same work.
+"""
+import itertools
+import os
+import random
+
+import numpy as np
+
+_SYLLABLES = (
+    "ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "xe", "zu", "bra", "cli", "dro", "fen",
+    "gar", "hul", "jin", "mor", "pel", "quo", "ris", "sten", "tor", "ul", "ven", "wex",
+)
+_FILLER = ("the", "of", "and", "in", "to", "a", "is", "for", "with", "on", "by", "that")
+
+
+class Corpus:
+    """
+    Prose over a fixed vocabulary with Zipf-distributed word frequencies. Every paragraph
+    draws most of its content words from one of `topics` topics, so paragraphs on the same
+    topic share words, as real documents on one subject do.
+    """
+
+    def __init__(self, seed: int = 0, vocab_size: int = 20000, topics: int = 200):
+        rng = random.Random(seed)
+        words = set()
+        while len(words) < vocab_size:
+            words.add("".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))))
+        self.vocab = sorted(words)
+        rng.shuffle(self.vocab)
+        self.topics = [rng.sample(self.vocab, 60) for _ in range(topics)]
+        self._cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(self.vocab))))
+        self.seed = seed
+
+    def _rng(self, *key) -> random.Random:
+        # Seeding with a string is stable across processes, unlike hash()
+        return random.Random(":".join(map(str, (self.seed,) + key)))
+
+    def sentence(self, rng: random.Random, topic) -> str:
+        words = []
+        for _ in range(rng.randint(8, 20)):
+            roll = rng.random()
+            if roll < 0.35:
+                words.append(rng.choice(_FILLER))
+            elif roll < 0.75:
+                words.append(rng.choice(topic))
+            else:
+                words.append(rng.choices(self.vocab, cum_weights=self._cum_weights)[0])
+        return " ".join(words).capitalize() + "."
+
+    def paragraph(self, n: int, sentences: int = 6) -> str:
+        rng = self._rng("paragraph", n)
+        topic = self.topics[rng.randrange(len(self.topics))]
+        return " ".join(self.sentence(rng, topic) for _ in range(sentences))
+
+    def document(self, n: int, paragraphs: int = 20):
+        """The paragraphs of synthetic document `n`."""
+        return [self.paragraph(n * 100003 + i) for i in range(paragraphs)]
+
+    def chunks(self, count: int, start: int = 0):
+        """`count` chunk-sized texts (about a paragraph each)."""
+        return [self.paragraph(10**9 + start + i, sentences=8) for i in range(count)]
+
+    def queries(self, count: int):
+        """Short keyword queries drawn from the topics."""
+        out = []
+        for i in range(count):
+            rng = self._rng("query", i)
+            topic = self.topics[rng.randrange(len(self.topics))]
+            out.append(" ".join(rng.sample(topic, rng.randint(2, 5))))
+        return out
+
+
+def synthetic_vectors(n, dim, seed=0):
+    """Unit vectors scattered around a few hundred topic centres."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((max(8, n // 100), dim)).astype("float32")
+    vectors = centres[rng.integers(len(centres), size=n)] + 0.6 * rng.standard_normal((n, dim)).astype("float32")
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+# --- Fixture files ---
+def _wrap(text: str, width: int):
+    line = []
+    for word in text.split():
+        if line and sum(len(w) + 1 for w in line) + len(word) > width:
+            yield " ".join(line)
+            line = []
+        line.append(word)
+    if line:
+        yield " ".join(line)
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages):
+    """
+    Writes a text PDF with one page per entry of `pages` (each a list of paragraphs),
+    using only the standard Helvetica font, so no PDF library is needed.
+    """
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_refs = []
+    for paragraphs in pages:
+        lines = ["BT", "/F1 10 Tf", "12 TL", "50 780 Td"]
+        for paragraph in paragraphs:
+            for line in _wrap(paragraph, 95):
+                lines.append(f"({_pdf_escape(line)}) Tj T*")
+            lines.append("T*")
+        lines.append("ET")
+        stream = "\n".join(lines).encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects))
+        )
+        page_refs.append(len(objects))
+    kids = " ".join(f"{ref} 0 R" for ref in page_refs).encode()
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_refs))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def write_docx(path: str, paragraphs):
+    import docx
+    document = docx.Document()
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    document.save(path)
+
+
+def write_txt(path: str, paragraphs):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n\n".join(paragraphs))
+
+
+def write_fixtures(directory: str, corpus: Corpus, documents: int, pages: int, paragraphs_per_page: int = 4,
+                   formats=("pdf", "docx", "txt")):
+    """Writes `documents` files per format; returns their paths. Existing files are reused."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for n in range(documents):
+        paragraphs = corpus.document(n, pages * paragraphs_per_page)
+        for fmt in formats:
+            path = os.path.join(directory, f"s{corpus.seed}_doc{n:05d}_{pages}p.{fmt}")
+            paths.append(path)
+            if os.path.exists(path):
+                continue
+            if fmt == "pdf":
+                write_pdf(path, [paragraphs[i:i + paragraphs_per_page] for i in range(0, len(paragraphs), paragraphs_per_page)])
+            elif fmt == "docx":
+                write_docx(path, paragraphs)
+            else:
+                write_txt(path, paragraphs)
+    return paths
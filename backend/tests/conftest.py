@@ -0,0 +1,107 @@
+"""
+Test settings. The app reads its configuration at import time, so everything points at
+a throwaway directory before any test imports it: a fresh SQLite database, index
+directory, stores and the offline embedder. Shards are only saved when a test flushes.
+"""
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+WORK_DIR = tempfile.mkdtemp(prefix="smart_research_hub_tests_")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(WORK_DIR, 'test.db')}",
+    "FAISS_INDEX_DIR": os.path.join(WORK_DIR, "faiss_index"),
+    "FAISS_INDEX_PATH": os.path.join(WORK_DIR, "faiss_index.idx"),
+    "UPLOAD_DIR": os.path.join(WORK_DIR, "uploads"),
+    "TEXT_STORE_DIR": os.path.join(WORK_DIR, "document_text"),
+    "INGEST_WORK_DIR": os.path.join(WORK_DIR, "ingest_jobs"),
+    "EMBEDDING_CACHE_PATH": os.path.join(WORK_DIR, "embedding_cache.db"),
+    "EMBEDDING_PROVIDER": "local",
+    "EMBEDDING_DIM": "64",
+    "CHUNK_TOKENS": "64",
+    "CHUNK_OVERLAP_TOKENS": "8",
+    "FAISS_PERSIST_DELAY_SECONDS": "3600",
+    "INDEX_MODE": "writer",
+    "BCRYPT_ROUNDS": "4",
+})
+
+_emails = itertools.count()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def app_state():
+    """Creates the schema and loads the (empty) index once for the whole run."""
+    from app import main
+    main.init_database()
+    main.load_faiss_index()
+    yield
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def session():
+    from app.db import SessionLocal
+    with SessionLocal() as session:
+        yield session
+
+
+@pytest.fixture
+def make_user(session):
+    """Creates a user with a unique email; each test works in its own users' shards."""
+    from app import models
+
+    def make():
+        user = models.User(email=f"user{next(_emails)}@example.com", hashed_password="not-a-real-hash")
+        session.add(user)
+        session.commit()
+        return user
+
+    return make
+
+
+@pytest.fixture
+def text_file(tmp_path):
+    """Writes a plain-text upload of `paragraphs` distinct paragraphs and returns its path."""
+    def write(name="doc.txt", paragraphs=12, topic="alpha"):
+        path = tmp_path / name
+        path.write_text(
+            "\n\n".join(
+                f"Paragraph {i} about {topic}: " + " ".join(f"{topic}{i}word{j}" for j in range(40))
+                for i in range(paragraphs)
+            ),
+            encoding="utf-8",
+        )
+        return str(path)
+
+    return write
+
+
+@pytest.fixture
+def index_file(session):
+    """Runs an upload through every ingest stage and saves the shard; returns the finished job."""
+    from app import ingest, models
+    from app.index_manager import index_manager
+
+    def index(user, path, replaces_doc_id=None):
+        job = models.IngestJob(
+            id=ingest.new_job_id(), user_id=user.id, filename=os.path.basename(path), path=path,
+            status="running", stage="saved", replaces_doc_id=replaces_doc_id,
+        )
+        session.add(job)
+        session.commit()
+        for _, func, _ in ingest.STAGES:
+            func(session, job)
+            session.commit()
+        index_manager.flush()
+        session.refresh(job)
+        assert job.status == "done", job.error
+        return job
+
+    return index
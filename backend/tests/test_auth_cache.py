@@ -0,0 +1,68 @@
+"""Cached logins are dropped when the user changes their password or is deleted."""
+import pytest
+from fastapi import HTTPException
+
+from app import auth, main
+
+
+def login(session, user):
+    """Issues a token for `user` and resolves it once, which caches it."""
+    token = auth.create_access_token({"sub": user.email, "id": user.id})
+    identity = main.get_current_user(f"Bearer {token}", session)
+    assert identity.id == user.id
+    assert auth.token_cache.get(token) == identity
+    return token
+
+
+class CountingSession:
+    """Wraps a session and counts the user lookups made through it."""
+
+    def __init__(self, session):
+        self.session = session
+        self.lookups = 0
+
+    def get(self, *args, **kwargs):
+        self.lookups += 1
+        return self.session.get(*args, **kwargs)
+
+    def query(self, *args, **kwargs):
+        self.lookups += 1
+        return self.session.query(*args, **kwargs)
+
+
+def test_cached_token_skips_the_database(session, make_user):
+    user = make_user()
+    token = login(session, user)
+
+    counting = CountingSession(session)
+    assert main.get_current_user(f"Bearer {token}", counting).id == user.id
+    assert counting.lookups == 0
+
+
+def test_password_change_drops_cached_tokens(session, make_user):
+    user, other = make_user(), make_user()
+    token, other_token = login(session, user), login(session, other)
+
+    user.hashed_password = "a-new-hash"
+    session.commit()
+
+    assert auth.token_cache.get(token) is None
+    assert auth.token_cache.get(other_token) is not None  # only the user's own tokens go
+    counting = CountingSession(session)
+    assert main.get_current_user(f"Bearer {token}", counting).id == user.id
+    assert counting.lookups == 1  # re-checked against the database
+
+
+def test_deleting_the_user_drops_cached_tokens(session, make_user):
+    user, other = make_user(), make_user()
+    token, other_token = login(session, user), login(session, other)
+
+    session.delete(user)
+    session.commit()
+
+    assert auth.token_cache.get(token) is None
+    assert auth.token_cache.get(other_token) is not None
+    with pytest.raises(HTTPException) as error:
+        main.get_current_user(f"Bearer {token}", session)
+    assert error.value.status_code == 401
+
@@ -0,0 +1,58 @@
+"""Bulk import keeps going past a failed file and only cleans up what it wrote."""
+import os
+
+import pytest
+
+from app import bulk_ingest, models
+
+
+@pytest.fixture
+def sources(text_file):
+    return [text_file(f"{topic}.txt", paragraphs=4, topic=topic) for topic in ("alpha", "beta", "gamma")]
+
+
+def imported_filenames(session, user):
+    return sorted(
+        filename for (filename,) in session.query(models.Document.filename).filter(models.Document.user_id == user.id)
+    )
+
+
+def test_embed_failure_skips_only_that_file(session, make_user, sources, tmp_path, monkeypatch):
+    user = make_user()
+    work_dir = tmp_path / "work"
+    embed_artifact = bulk_ingest.embed_artifact
+    broken = bulk_ingest._file_hash(sources[1])
+
+    def embed(out_dir):
+        if os.path.basename(out_dir) == broken:
+            raise RuntimeError("provider unavailable")
+        return embed_artifact(out_dir)
+
+    monkeypatch.setattr(bulk_ingest, "embed_artifact", embed)
+    importer = bulk_ingest.BulkImporter(user.id, work_dir=str(work_dir), workers=1)
+    summary = importer.run(session, sources)
+
+    assert summary["failed"] == 1
+    assert list(importer.failures) == [sources[1]]
+    assert imported_filenames(session, user) == ["alpha.txt", "gamma.txt"]
+    assert (work_dir / "state.jsonl").exists()  # kept so a rerun retries the failure
+
+    monkeypatch.setattr(bulk_ingest, "embed_artifact", embed_artifact)
+    summary = bulk_ingest.BulkImporter(user.id, work_dir=str(work_dir), workers=1).run(session, sources)
+    assert summary["failed"] == 0
+    assert imported_filenames(session, user) == ["alpha.txt", "beta.txt", "gamma.txt"]
+    assert not work_dir.exists()
+
+
+def test_cleanup_leaves_other_files_in_the_work_dir(session, make_user, sources, tmp_path):
+    user = make_user()
+    work_dir = tmp_path / "data"
+    (work_dir / "notes").mkdir(parents=True)
+    (work_dir / "notes" / "keep.txt").write_text("not the importer's")
+    (work_dir / "keep.csv").write_text("a,b\n")
+
+    summary = bulk_ingest.BulkImporter(user.id, work_dir=str(work_dir), workers=1).run(session, sources)
+
+    assert summary["failed"] == 0
+    assert sorted(os.listdir(work_dir)) == ["keep.csv", "notes"]
+    assert (work_dir / "notes" / "keep.txt").read_text() == "not the importer's"
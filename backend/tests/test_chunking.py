@@ -0,0 +1,66 @@
+"""iter_chunks keeps each chunk's page number and its offsets in the page-joined text."""
+from app import embeddings
+from app.tokenizer import count_tokens
+
+
+def make_pages(count=5, words=120):
+    return [
+        (number, " ".join(f"p{number}w{i}" for i in range(words)))
+        for number in range(1, count + 1)
+    ]
+
+
+def page_of(offset, pages):
+    """Page number of the character at `offset` in the pages joined with newlines."""
+    position = 0
+    for number, text in pages:
+        if offset < position + len(text) + 1:
+            return number
+        position += len(text) + 1
+    return pages[-1][0]
+
+
+def test_offsets_point_at_the_chunk_text():
+    pages = make_pages()
+    document = "\n".join(text for _, text in pages)
+    chunks = list(embeddings.iter_chunks(iter(pages), chunk_tokens=40, overlap_tokens=8))
+
+    assert len(chunks) > len(pages)
+    for chunk in chunks:
+        assert document[chunk.start_offset:chunk.end_offset] == chunk.text
+        assert chunk.token_count == count_tokens(chunk.text)
+
+
+def test_page_is_the_page_each_chunk_starts_on():
+    pages = make_pages()
+    chunks = list(embeddings.iter_chunks(iter(pages), chunk_tokens=40, overlap_tokens=8))
+
+    for chunk in chunks:
+        assert chunk.page == page_of(chunk.start_offset, pages)
+        assert chunk.text.split()[0].startswith(f"p{chunk.page}w")
+    assert {chunk.page for chunk in chunks} == {number for number, _ in pages}
+
+
+def test_chunks_cover_the_document_in_order():
+    pages = make_pages()
+    chunks = list(embeddings.iter_chunks(iter(pages), chunk_tokens=40, overlap_tokens=8))
+
+    starts = [chunk.start_offset for chunk in chunks]
+    assert starts == sorted(starts)
+    assert chunks[0].start_offset == 0
+    assert chunks[-1].end_offset == len("\n".join(text for _, text in pages))
+    # Consecutive chunks overlap or touch; no text is skipped
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert chunk.start_offset <= previous.end_offset + 1
+
+
+def test_empty_pages_keep_later_page_numbers():
+    pages = [(1, "first page " * 30), (2, ""), (3, "third page " * 30)]
+    chunks = list(embeddings.iter_chunks(iter(pages), chunk_tokens=40, overlap_tokens=8))
+    document = "\n".join(text for _, text in pages if text)
+
+    for chunk in chunks:
+        assert document[chunk.start_offset:chunk.end_offset] == chunk.text
+    assert chunks[0].page == 1
+    assert chunks[-1].page == 3
+    assert 2 not in {chunk.page for chunk in chunks}
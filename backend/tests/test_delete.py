@@ -0,0 +1,126 @@
+"""Deleted and replaced documents leave search, and their tombstones outlive saves and compaction."""
+from app import embeddings, ingest, lexical, models
+from app.index_manager import index_manager
+
+
+def chunk_ids(session, doc_id):
+    return {i for (i,) in session.query(models.Chunk.faiss_index_id).filter(models.Chunk.doc_id == doc_id)}
+
+
+def semantic_ids(user_id, query, k=50):
+    found = index_manager.search(user_id, embeddings.embed_query(query), k)
+    if found is None:
+        return set()
+    return {int(i) for i in found[1][0] if i != -1}
+
+
+def reload_shard(user_id):
+    """Drops the in-memory shard so the next access reads the saved one."""
+    with index_manager._shards_lock:
+        index_manager._shards.pop(user_id, None)
+
+
+def delete(session, doc_id):
+    return ingest.delete_document(session, session.get(models.Document, doc_id))
+
+
+def test_deleted_document_leaves_semantic_and_lexical_search(session, make_user, text_file, index_file):
+    user = make_user()
+    alpha = index_file(user, text_file("alpha.txt", topic="alpha"))
+    beta = index_file(user, text_file("beta.txt", topic="beta"))
+    alpha_ids = chunk_ids(session, alpha.doc_id)
+    assert semantic_ids(user.id, "alpha3word7") & alpha_ids
+    assert lexical.search(session, user.id, "alpha3word7", 5)
+
+    assert delete(session, alpha.doc_id) == len(alpha_ids)
+
+    assert not semantic_ids(user.id, "alpha3word7") & alpha_ids
+    assert lexical.search(session, user.id, "alpha3word7", 5) == []
+    assert semantic_ids(user.id, "beta3word7") & chunk_ids(session, beta.doc_id)
+    assert index_manager.tombstone_count(user.id) == len(alpha_ids)
+
+
+def test_tombstones_survive_save_and_reload(session, make_user, text_file, index_file):
+    user = make_user()
+    alpha = index_file(user, text_file("alpha.txt", topic="alpha"))
+    index_file(user, text_file("beta.txt", topic="beta"))
+    alpha_ids = chunk_ids(session, alpha.doc_id)
+    delete(session, alpha.doc_id)
+
+    index_manager.flush()
+    reload_shard(user.id)
+
+    assert index_manager.tombstone_count(user.id) == len(alpha_ids)
+    assert not semantic_ids(user.id, "alpha3word7") & alpha_ids
+
+
+def test_compaction_drops_deleted_vectors_for_good(session, make_user, text_file, index_file):
+    user = make_user()
+    alpha = index_file(user, text_file("alpha.txt", topic="alpha"))
+    beta = index_file(user, text_file("beta.txt", topic="beta"))
+    alpha_ids, beta_ids = chunk_ids(session, alpha.doc_id), chunk_ids(session, beta.doc_id)
+    delete(session, alpha.doc_id)
+
+    index_manager.rebuild_shard(user.id)
+    index_manager.flush()
+    reload_shard(user.id)
+
+    assert index_manager.tombstone_count(user.id) == 0
+    with index_manager.read(user.id) as index:
+        assert set(embeddings.index_ids(index).tolist()) == beta_ids
+    assert not semantic_ids(user.id, "alpha3word7") & alpha_ids
+
+
+def test_delete_during_compaction_is_not_lost(session, make_user, text_file, index_file, monkeypatch):
+    user = make_user()
+    alpha = index_file(user, text_file("alpha.txt", topic="alpha"))
+    beta = index_file(user, text_file("beta.txt", topic="beta"))
+    gamma = index_file(user, text_file("gamma.txt", topic="gamma"))
+    alpha_ids, beta_ids = chunk_ids(session, alpha.doc_id), chunk_ids(session, beta.doc_id)
+    delete(session, alpha.doc_id)
+
+    build = embeddings.create_embeddings_index
+
+    def build_while_deleting(*args, **kwargs):
+        # Runs while the new index trains on a snapshot that still holds beta
+        delete(session, beta.doc_id)
+        return build(*args, **kwargs)
+
+    monkeypatch.setattr(embeddings, "create_embeddings_index", build_while_deleting)
+    index_manager.rebuild_shard(user.id)
+    monkeypatch.undo()
+
+    # alpha was compacted away; beta's tombstones carried over to the new index
+    assert index_manager.tombstone_count(user.id) == len(beta_ids)
+    assert not semantic_ids(user.id, "beta3word7") & beta_ids
+    index_manager.flush()
+    reload_shard(user.id)
+    assert index_manager.tombstone_count(user.id) == len(beta_ids)
+    assert not semantic_ids(user.id, "beta3word7") & (alpha_ids | beta_ids)
+    assert semantic_ids(user.id, "gamma3word7") & chunk_ids(session, gamma.doc_id)
+
+
+def test_replacement_retires_the_old_version(session, make_user, text_file, index_file):
+    user = make_user()
+    old = index_file(user, text_file("report.txt", topic="alpha"))
+    old_doc_id = old.doc_id  # the finished job's doc_id is cleared when its document goes
+    old_ids = chunk_ids(session, old_doc_id)
+
+    new = index_file(user, text_file("report_v2.txt", topic="delta"), replaces_doc_id=old_doc_id)
+
+    session.expire_all()
+    assert session.get(models.Document, old_doc_id) is None
+    assert not chunk_ids(session, old_doc_id)
+    assert not semantic_ids(user.id, "alpha3word7") & old_ids
+    assert lexical.search(session, user.id, "alpha3word7", 5) == []
+    new_ids = chunk_ids(session, new.doc_id)
+    assert semantic_ids(user.id, "delta3word7") & new_ids
+
+    # Tombstoned until compaction, then gone from the shard's id map
+    with index_manager.read(user.id) as index:
+        assert set(embeddings.stored_ids(index, old_ids)) == old_ids
+    assert index_manager._get_shard(user.id).tombstones == old_ids
+    index_manager.rebuild_shard(user.id)
+    with index_manager.read(user.id) as index:
+        assert set(embeddings.index_ids(index).tolist()) == new_ids
+    assert index_manager.tombstone_count(user.id) == 0
@@ -0,0 +1,46 @@
+"""Shards too small to train stay flat, and a rebuild that asked for another type says so."""
+import argparse
+
+import numpy as np
+
+from app import embeddings, manage
+from app.index_manager import index_manager
+
+
+def vectors(n):
+    return np.random.default_rng(0).random((n, embeddings.DIM), dtype="float32")
+
+
+def test_explicit_type_below_the_minimum_is_reported(capsys):
+    index = embeddings.create_embeddings_index(vectors(50), index_type="sq8")
+
+    assert embeddings.index_type_of(index) == "flat"
+    assert "flat index instead of sq8" in capsys.readouterr().out
+
+
+def test_default_type_falls_back_quietly(capsys):
+    index = embeddings.create_embeddings_index(vectors(50))
+
+    assert embeddings.index_type_of(index) == "flat"
+    assert "instead of" not in capsys.readouterr().out
+
+
+def test_explicit_type_is_built_once_there_are_enough_vectors(monkeypatch):
+    monkeypatch.setattr(embeddings, "TRAIN_MIN_VECTORS", 10)
+    index = embeddings.create_embeddings_index(vectors(50), index_type="sq8")
+
+    assert embeddings.index_type_of(index) == "sq8"
+
+
+def test_rebuild_command_lists_shards_kept_flat(make_user, monkeypatch, capsys):
+    user = make_user()
+    with index_manager.write(user.id) as index:
+        index.add_with_ids(vectors(20), np.arange(20) + 10_000_000)
+    monkeypatch.setattr(index_manager, "close", lambda: None)
+
+    manage.rebuild_index(argparse.Namespace(type="hnsw", user=user.id))
+
+    out = capsys.readouterr().out
+    assert index_manager.index_type(user.id) == "flat"
+    assert "1 shard(s) were built as flat, not hnsw" in out
+    assert f"Users: {user.id}." in out
@@ -0,0 +1,160 @@
+"""Ingestion jobs resume after a crash at any stage without losing or duplicating work."""
+import os
+import time
+
+import pytest
+
+from app import embeddings, ingest, lexical, models
+from app.index_manager import index_manager
+
+STAGE_NAMES = [completed for completed, _, _ in ingest.STAGES]
+
+
+def make_job(session, user, path):
+    job = models.IngestJob(
+        id=ingest.new_job_id(), user_id=user.id, filename=os.path.basename(path), path=path,
+        status="running", stage="saved",
+    )
+    session.add(job)
+    session.commit()
+    return job
+
+
+def run_stages(session, job, count):
+    """Runs the first `count` stages the way a pipeline worker does (commit after each)."""
+    for _, func, _ in ingest.STAGES[:count]:
+        func(session, job)
+        session.commit()
+
+
+def lose_unsaved_index_state(user_id):
+    """What a crash does to the index writer: unsaved shard changes and pending callbacks vanish."""
+    with index_manager._state_lock:
+        index_manager._dirty.discard(user_id)
+        index_manager._persist_callbacks.pop(user_id, None)
+    with index_manager._shards_lock:
+        index_manager._shards.pop(user_id, None)
+
+
+def resume(session, job_id, timeout=30.0):
+    """Restarts the pipeline, as on the next startup, and waits for the job to finish."""
+    pipeline = ingest.IngestPipeline()
+    pipeline.start()
+    try:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            # Jobs finish once their vectors are saved; tests save explicitly
+            index_manager.flush()
+            session.expire_all()
+            job = session.get(models.IngestJob, job_id)
+            if job.status in ("done", "failed"):
+                return job
+            time.sleep(0.05)
+    finally:
+        pipeline.stop()
+    pytest.fail(f"job {job_id} did not finish within {timeout}s")
+
+
+def assert_indexed_once(session, job):
+    assert job.status == "done", job.error
+    assert job.stage == "indexed"
+    assert not os.path.exists(ingest.job_dir(job.id))
+
+    docs = session.query(models.Document).filter(models.Document.user_id == job.user_id).all()
+    assert [doc.id for doc in docs] == [job.doc_id]
+    chunk_ids = sorted(i for (i,) in session.query(models.Chunk.faiss_index_id).filter(models.Chunk.doc_id == job.doc_id))
+    assert len(chunk_ids) == job.chunks > 0
+
+    with index_manager.read(job.user_id) as index:
+        stored = embeddings.index_ids(index)
+    assert sorted(stored.tolist()) == chunk_ids  # every vector exactly once
+
+    # The saved shard, not just the in-memory one, holds them
+    lose_unsaved_index_state(job.user_id)
+    with index_manager.read(job.user_id) as index:
+        assert sorted(embeddings.index_ids(index).tolist()) == chunk_ids
+
+
+def test_job_runs_through_every_stage(session, make_user, text_file):
+    user = make_user()
+    job = make_job(session, user, text_file())
+    job = resume(session, job.id)
+
+    assert_indexed_once(session, job)
+    hits = lexical.search(session, user.id, "alpha3word7", 5)
+    assert hits and hits[0][0] in {
+        i for (i,) in session.query(models.Chunk.faiss_index_id).filter(models.Chunk.doc_id == job.doc_id)
+    }
+
+
+@pytest.mark.parametrize("completed_stages", range(len(STAGE_NAMES)))
+def test_job_resumes_after_the_last_completed_stage(session, make_user, text_file, completed_stages):
+    user = make_user()
+    job = make_job(session, user, text_file())
+    run_stages(session, job, completed_stages)
+    assert job.stage == STAGE_NAMES[completed_stages]
+    session.close()
+
+    job = resume(session, job.id)
+    assert_indexed_once(session, job)
+
+
+def test_crash_after_index_rows_were_committed(session, make_user, text_file, monkeypatch):
+    user = make_user()
+    job = make_job(session, user, text_file())
+    run_stages(session, job, 2)
+
+    def crash(user_id, **kwargs):
+        raise SystemExit("killed while adding vectors")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(index_manager, "write", crash)
+        with pytest.raises(SystemExit):
+            ingest.index_stage(session, job)
+    session.rollback()
+    assert job.doc_id is not None  # the document and its rows were committed first
+    session.close()
+
+    job = resume(session, job.id)
+    assert_indexed_once(session, job)
+
+
+def test_crash_before_the_shard_was_saved(session, make_user, text_file):
+    user = make_user()
+    job = make_job(session, user, text_file())
+    run_stages(session, job, len(ingest.STAGES))
+    session.refresh(job)
+    # Indexed in memory only: the job must not be done yet
+    assert (job.status, job.stage) == ("running", "embedded")
+    assert os.path.exists(ingest.job_dir(job.id))
+
+    lose_unsaved_index_state(user.id)
+    session.close()
+
+    job = resume(session, job.id)
+    assert_indexed_once(session, job)
+
+
+def test_failed_job_leaves_no_document_behind(session, make_user, text_file, monkeypatch):
+    user = make_user()
+    job = make_job(session, user, text_file())
+    run_stages(session, job, 2)
+
+    def fail(user_id, **kwargs):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(index_manager, "write", fail)
+        with pytest.raises(OSError):
+            ingest.index_stage(session, job)
+    session.rollback()
+    ingest.pipeline._fail(job.id, "disk full")
+
+    session.expire_all()
+    job = session.get(models.IngestJob, job.id)
+    assert (job.status, job.doc_id) == ("failed", None)
+    assert session.query(models.Document).filter(models.Document.user_id == user.id).count() == 0
+    assert session.query(models.Chunk).filter(models.Chunk.user_id == user.id).count() == 0
+    assert lexical.search(session, user.id, "alpha3word7", 5) == []
+    assert index_manager.tombstone_count(user.id) == 0
+    assert index_manager.search(user.id, embeddings.embed_query("alpha"), 3) is None
@@ -0,0 +1,72 @@
+"""iter_pdf_pages returns every page once, in order, when extraction workers die."""
+import contextlib
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from app import utils
+
+N_PAGES = 6
+
+
+class FakePdf:
+    pages = [None] * N_PAGES
+
+
+class FakePdfplumber:
+    @staticmethod
+    @contextlib.contextmanager
+    def open(path):
+        yield FakePdf()
+
+
+class BreakingPool:
+    """Runs ranges inline; the range starting at `breaks_at` breaks the pool `times` times."""
+
+    def __init__(self, breaks_at, times):
+        self.breaks_at = breaks_at
+        self.times = times
+        self.submitted = []
+
+    def submit(self, func, path, start, end, timeout):
+        self.submitted.append(start)
+        future = Future()
+        if start == self.breaks_at and self.times > 0:
+            self.times -= 1
+            future.set_exception(BrokenProcessPool("worker killed"))
+        else:
+            future.set_result([(i + 1, f"page {i + 1}") for i in range(start, end)])
+        return future
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    def make(breaks_at, times):
+        fake = BreakingPool(breaks_at, times)
+        monkeypatch.setattr(utils, "pdfplumber", FakePdfplumber)
+        monkeypatch.setattr(utils, "_get_pdf_pool", lambda replace=None: fake)
+        monkeypatch.setattr(utils, "PDF_PAGES_PER_TASK", 1)
+        monkeypatch.setattr(utils, "PDF_WORKERS", 2)
+        return fake
+    return make
+
+
+@pytest.mark.parametrize("breaks_at", [0, 2, N_PAGES - 1])
+def test_broken_range_is_retried_in_place(pool, breaks_at):
+    fake = pool(breaks_at, times=utils.PDF_RANGE_ATTEMPTS - 1)
+    pages = list(utils.iter_pdf_pages("doc.pdf"))
+
+    assert pages == [(i, f"page {i}") for i in range(1, N_PAGES + 1)]
+    assert fake.submitted.count(breaks_at) == utils.PDF_RANGE_ATTEMPTS
+
+
+@pytest.mark.parametrize("breaks_at", [0, 2, N_PAGES - 1])
+def test_range_that_keeps_breaking_is_skipped_alone(pool, breaks_at):
+    fake = pool(breaks_at, times=10)
+    pages = list(utils.iter_pdf_pages("doc.pdf"))
+
+    assert [number for number, _ in pages] == list(range(1, N_PAGES + 1))
+    assert pages[breaks_at] == (breaks_at + 1, "")
+    assert all(text == f"page {number}" for number, text in pages if number != breaks_at + 1)
+    assert fake.submitted.count(breaks_at) == utils.PDF_RANGE_ATTEMPTS
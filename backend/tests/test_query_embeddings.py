@@ -0,0 +1,98 @@
+"""
+Search queries share the in-memory query LRU, whether embedded one at a time or in a
+batch, and misses go through the embedding scheduler's rate limits in its urgent lane.
+"""
+import asyncio
+import time
+
+import numpy as np
+import pytest
+
+from app import embeddings
+from app.embedding_cache import normalize_text
+from app.embedding_scheduler import EmbeddingScheduler, RateLimiter
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    """The live embedding cache, counting the queries that reach SQLite."""
+    cache = embeddings.embedding_cache
+    lookup = cache._lookup
+    looked_up = []
+
+    def counting_lookup(texts):
+        looked_up.extend(texts)
+        return lookup(texts)
+
+    monkeypatch.setattr(cache, "_lookup", counting_lookup)
+    cache.looked_up = looked_up
+    yield cache
+    del cache.looked_up
+
+
+def test_batch_queries_fill_the_lru(cache):
+    queries = ["batch query one", "batch query two", "batch query one"]
+    vectors = embeddings.embed_queries(queries)
+
+    assert np.array_equal(vectors[0], vectors[2])
+    for query in queries:
+        assert normalize_text(query) in cache._hot
+    cache.looked_up.clear()
+    # Served from memory by either entry point
+    assert np.array_equal(embeddings.embed_query("batch query two"), vectors[1])
+    assert np.array_equal(embeddings.embed_queries(queries), vectors)
+    assert cache.looked_up == []
+
+
+def test_batch_queries_read_the_lru(cache):
+    single = embeddings.embed_query("single query")
+    cache.looked_up.clear()
+
+    vectors = embeddings.embed_queries(["single query", "another query"])
+
+    assert np.array_equal(vectors[0], single)
+    assert cache.looked_up == ["another query"]  # one SQLite lookup, only for the miss
+
+
+def test_query_misses_go_through_the_scheduler(monkeypatch):
+    calls = []
+    embed = embeddings.embedding_scheduler.embed
+
+    def spy(texts, urgent=False):
+        calls.append((list(texts), urgent))
+        return embed(texts, urgent=urgent)
+
+    monkeypatch.setattr(embeddings.embedding_scheduler, "embed", spy)
+    embeddings.embed_query("scheduled query")
+    embeddings.embed_queries(["scheduled query", "second scheduled query"])
+
+    assert calls == [(["scheduled query"], True), (["second scheduled query"], True)]
+
+
+def test_urgent_lane_skips_the_coalescing_delay():
+    async def embed_batch(texts):
+        return [[float(len(text))] for text in texts]
+
+    # Its loop runs on a daemon thread, like the shared scheduler's
+    scheduler = EmbeddingScheduler(embed_batch, coalesce_seconds=5.0, rpm=0, tpm=0)
+    start = time.monotonic()
+    assert scheduler.embed(["query"], urgent=True).tolist() == [[5.0]]
+    assert time.monotonic() - start < 1.0
+
+
+def test_urgent_requests_go_ahead_of_queued_batches():
+    async def run():
+        limiter = RateLimiter(rpm=600, tpm=0)  # one request per 0.1s
+        limiter._requests = 0.0
+        order = []
+
+        async def take(name, urgent=False):
+            await limiter.acquire(1, urgent=urgent)
+            order.append(name)
+
+        batches = [asyncio.create_task(take(f"batch{i}")) for i in range(4)]
+        await asyncio.sleep(0.01)
+        await asyncio.gather(take("query", urgent=True), *batches)
+        return order
+
+    assert asyncio.run(run())[0] == "query"
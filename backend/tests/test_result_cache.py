@@ -0,0 +1,89 @@
+"""Search result cache keys follow the published shard generation, the same in every process."""
+import numpy as np
+import pytest
+
+from app.index_manager import IndexManager
+from app.result_cache import ResultCache
+
+USER_ID = 1
+DIM = 64
+
+
+@pytest.fixture
+def managers(tmp_path):
+    """An index writer and a read-only serving worker sharing one index directory."""
+    directory = str(tmp_path / "faiss_index")
+    writer = IndexManager(directory, persist_delay=3600, read_only=False)
+    writer.load()
+    with writer.write(USER_ID) as index:
+        index.add_with_ids(np.random.default_rng(0).random((4, DIM), dtype="float32"), np.arange(4))
+    writer.flush()
+    reader = IndexManager(directory, read_only=True, refresh_seconds=0)
+    reader.load()
+    return writer, reader
+
+
+def key(cache, manager, query="what is faiss"):
+    return cache.make_key(USER_ID, query, manager.cache_token(USER_ID), mode="semantic", k=5)
+
+
+def test_writer_and_reader_agree_on_keys(managers):
+    writer, reader = managers
+    cache = ResultCache(size=16, shared_url="")
+    assert key(cache, writer) is not None
+    assert key(cache, writer) == key(cache, reader)
+
+
+def test_published_change_moves_every_process_to_new_keys(managers):
+    writer, reader = managers
+    cache = ResultCache(size=16, shared_url="")
+    before = key(cache, reader)
+    cache.put(before, "stale results")
+
+    with writer.write(USER_ID) as index:
+        index.add_with_ids(np.ones((1, DIM), dtype="float32"), np.array([10]))
+    writer.flush()
+    reader.refresh()
+
+    after = key(cache, reader)
+    assert after != before
+    assert after == key(cache, writer)
+    assert cache.get(after) is None
+
+
+def test_removal_bumps_the_version(managers):
+    writer, reader = managers
+    cache = ResultCache(size=16, shared_url="")
+    before = key(cache, reader)
+
+    writer.remove(USER_ID, [0])
+    writer.flush()
+    reader.refresh()
+
+    assert key(cache, reader) != before
+
+
+def test_unpublished_changes_are_not_cached(managers):
+    writer, _ = managers
+    cache = ResultCache(size=16, shared_url="")
+    with writer.write(USER_ID) as index:
+        index.add_with_ids(np.ones((1, DIM), dtype="float32"), np.array([11]))
+
+    assert writer.cache_token(USER_ID) is None
+    unpublished = key(cache, writer)
+    assert unpublished is None
+    cache.put(unpublished, "results")
+    assert cache.get(unpublished) is None
+    assert cache.stats()["entries"] == 0
+
+    writer.flush()
+    assert key(cache, writer) is not None
+
+
+def test_keys_depend_on_the_query_and_parameters(managers):
+    _, reader = managers
+    cache = ResultCache(size=16, shared_url="")
+    token = reader.cache_token(USER_ID)
+    assert cache.make_key(USER_ID, " what  is faiss", token, k=5) == cache.make_key(USER_ID, "what is faiss", token, k=5)
+    assert cache.make_key(USER_ID, "what is faiss", token, k=5) != cache.make_key(USER_ID, "what is faiss", token, k=10)
+    assert cache.make_key(USER_ID, "what is faiss", token, k=5) != cache.make_key(USER_ID + 1, "what is faiss", token, k=5)
@@ -0,0 +1,85 @@
+"""Oversized uploads are refused with 413 while they arrive, before the form is parsed."""
+import asyncio
+import json
+
+import pytest
+
+from app import auth, main, storage
+
+CHUNK = 64 * 1024
+
+
+@pytest.fixture
+def small_limit(monkeypatch):
+    monkeypatch.setattr(storage, "MAX_UPLOAD_BYTES", 256 * 1024)
+    return storage.MAX_UPLOAD_BYTES + storage.MULTIPART_OVERHEAD_BYTES
+
+
+def post_upload(user, chunks, content_length=None):
+    """Sends a multipart POST /upload straight to the ASGI app; returns (status, body, chunks read)."""
+    token = auth.create_access_token({"sub": user.email, "id": user.id})
+    headers = [
+        (b"authorization", f"Bearer {token}".encode()),
+        (b"content-type", b"multipart/form-data; boundary=limit-test"),
+    ]
+    if content_length is not None:
+        headers.append((b"content-length", str(content_length).encode()))
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/upload", "raw_path": b"/upload", "root_path": "", "query_string": b"",
+        "headers": headers, "client": ("127.0.0.1", 1234), "server": ("testserver", 80),
+    }
+    read = 0
+    sent = []
+
+    async def receive():
+        nonlocal read
+        chunk = next(chunks, None)
+        if chunk is None:
+            return {"type": "http.request", "body": b"", "more_body": False}
+        read += 1
+        return {"type": "http.request", "body": chunk, "more_body": True}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(main.app(scope, receive, send))
+    starts = [message for message in sent if message["type"] == "http.response.start"]
+    assert len(starts) == 1  # nothing is sent after the 413
+    body = b"".join(message.get("body", b"") for message in sent if message["type"] == "http.response.body")
+    return starts[0]["status"], body, read
+
+
+def endless_file():
+    """A multipart body whose file part never ends."""
+    yield b'--limit-test\r\nContent-Disposition: form-data; name="file"; filename="big.txt"\r\n\r\n'
+    while True:
+        yield b"x" * CHUNK
+
+
+def test_chunked_upload_without_length_is_cut_off(make_user, small_limit):
+    status, body, read = post_upload(make_user(), endless_file())
+
+    assert status == 413
+    assert "upload limit" in json.loads(body)["detail"]
+    # Reading stopped just past the limit instead of running to the end of the body
+    assert read <= small_limit // CHUNK + 2
+
+
+def test_declared_length_over_the_limit_is_refused_unread(make_user, small_limit):
+    status, _, read = post_upload(make_user(), endless_file(), content_length=small_limit + 1)
+
+    assert status == 413
+    assert read == 0
+
+
+def test_upload_under_the_limit_is_accepted(make_user, small_limit):
+    payload = b"small upload " * 100
+    parts = iter([
+        b'--limit-test\r\nContent-Disposition: form-data; name="file"; filename="small.txt"\r\n\r\n',
+        payload,
+        b"\r\n--limit-test--\r\n",
+    ])
+    status, body, _ = post_upload(make_user(), parts)
+
+    assert status in (200, 202), body
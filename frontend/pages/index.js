@@ -125,7 +125,7 @@ export default function Home() {
       });
 
       setUploadMsg(JSON.stringify(res.data, null, 2));
-      alert("Document uploaded and indexed!");
+      alert("Document uploaded! Indexing runs in the background.");
       console.log("Upload response:", res.data);
     } catch (e) {
       handleError(e);